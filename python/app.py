@@ -1,14 +1,32 @@
 # app.py (完成版)
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
+import time
+from startup import StartupTimer
+# 起動時間の計測（最初の import より前から測る）
+startup_timer = StartupTimer(time.perf_counter())
+
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, session, stream_with_context
 from models import User, LossReason, FoodLossRecord
-from schemas import LossRecordInput # ★ LossRecordInputをインポート
-from services import calculate_weekly_points_logic, add_new_loss_record_direct, get_weekly_stats, get_all_loss_reasons
+from services import calculate_weekly_points_logic, add_new_loss_record_direct, add_new_loss_records_bulk, get_all_loss_reasons, list_loss_records
+from stats_engine import get_start_and_end_of_week, get_weekly_stats, get_weekly_stats_window, get_range_stats
 from datetime import datetime
-from database import init_db, get_db
-from pydantic import ValidationError # ★ ValidationErrorをインポート
-from statistics import get_total_grams_for_weeks, get_last_two_weeks 
+from database import SCHEMA_BOOTSTRAP, access_for, engine, init_db, read_engine
+from db_session import get_request_db, init_app as init_db_session, pool_stats, read_pool_stats, shard_pool_stats
+from leaderboard import leaderboard
+from metrics import init_app as init_metrics, instrument_engine, metrics
+from reason_registry import reason_registry
+from sharding import init_shards, session_for_user, shards
+from request_log import get_logger, init_app as init_request_log, log_stats
+from stats_cache import weekly_stats_cache, week_has_ended, week_start_of
 from user_service import get_user_by_username, register_new_user, get_user_profile
 import datetime
+import os
+import queue
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from write_behind import start_record_writer, write_behind_mode
+
+# pydantic（schemas）・バッチ・エクスポートなど、一部のルートや設定でしか使わない重いモジュールは
+# 使う場所で import し、ワーカーの起動時には読み込まない
+startup_timer.mark("imports")
 
 # --- アプリケーション初期設定 ---
 app = Flask(__name__,
@@ -16,23 +34,55 @@ app = Flask(__name__,
             static_folder='../static')
 
 app.secret_key = 'a_secure_and_complex_secret_key' 
-init_db()
+# スキーマの確認・作成。server.py のワーカーはマスターが起動前に1回だけ済ませるので
+# FOOD_LOSS_SCHEMA_BOOTSTRAP=skip で起動され、ここではDBへの接続を開かない
+if SCHEMA_BOOTSTRAP != "skip":
+    init_db()
+    # シャーディング中（FOOD_LOSS_SHARDS > 1）は、記録を置くシャードのファイルも用意する
+    init_shards()
+startup_timer.mark("schema")
+# リクエスト単位のDBセッション（初回使用時に作成し、teardown で必ず閉じる）
+init_db_session(app)
+
+# 廃棄記録の書き込みキュー（FOOD_LOSS_WRITE_BEHIND=durable/async のときのみ。off なら従来どおり1件ずつコミット）
+WRITE_BEHIND_MODE = write_behind_mode()
+# durable モードでコミットを待つ最大秒数（超えたら保留IDを返す）
+WRITE_BEHIND_WAIT_SECONDS = 10
+record_writer = start_record_writer() if WRITE_BEHIND_MODE != 'off' else None
+
+# /metrics（エンドポイント別のレイテンシ・SQL の回数と時間など）。プール・キャッシュ・書き込みキューの状態も出力する
+init_metrics(app, engine)
+metrics.register_collector("db_pool", pool_stats)
+if read_engine is not engine:
+    instrument_engine(read_engine)
+    metrics.register_collector("db_read_pool", read_pool_stats)
+if len(shards) > 1:
+    for shard in shards:
+        instrument_engine(shard.engine)
+        if shard.read_engine is not shard.engine:
+            instrument_engine(shard.read_engine)
+    metrics.register_collector("db_shards", shard_pool_stats)
+metrics.register_collector("weekly_stats_cache", weekly_stats_cache.stats)
+if record_writer is not None:
+    metrics.register_collector("write_queue", record_writer.metrics)
+# アクセスログ（1リクエスト1行の JSON。書き出しは別スレッド）。metrics の計測値を使うので init_metrics の後に登録する
+init_request_log(app)
+metrics.register_collector("log_queue", log_stats)
+auth_logger = get_logger("auth")
+
+# 週の境界で全ユーザーの週次ポイントを一括付与する（WEEKLY_POINTS_SCHEDULER=1 のときのみ）
+if os.environ.get('WEEKLY_POINTS_SCHEDULER') == '1':
+    from batch_points import start_weekly_scheduler
+    start_weekly_scheduler()
+startup_timer.mark("background")
 
 #未実装
 def login_required(func):
     """ログインしているかチェックするデコレータ"""
     def wrapper(*args, **kwargs):
-        
-        # --- ★デバッグ用に追加 (ここから)★ ---
-        print(f"--- デコレータ実行 ({func.__name__}) ---")
-        print(f"現在のセッション: {session}")
-        # --- ★デバッグ用に追加 (ここまで)★ ---
-
         if 'user_id' not in session:
-            print("セッションに user_id が見つからないため /login へリダイレクトします") # ★デバッグ用
+            auth_logger.debug("login_required", extra={"fields": {"endpoint": func.__name__}})
             return redirect(url_for('login'))
-        
-        print("セッションOK。ページを表示します。") # ★デバッグ用
         return func(*args, **kwargs)
     
     wrapper.__name__ = func.__name__ 
@@ -42,13 +92,15 @@ def login_required(func):
 def index():
     return render_template('login.html')
 
-@app.route("/input")
+@app.route("/input", methods=['GET', 'POST'])
 def input():
     # --- POSTリクエスト（フォーム送信時）の処理 ---
     if request.method == 'POST':
         user_id = session.get('user_id')
-        db = next(get_db())
+        db = get_request_db()
 
+        from pydantic import ValidationError
+        from schemas import LossRecordInput
         try:
             # 1. フォームデータ取得と検証
             form_data = request.form.to_dict()
@@ -62,7 +114,6 @@ def input():
             return redirect(url_for('input', success_message='記録が完了しました！'))
 
         except ValidationError as e:
-            db.close()
             # 失敗時: render_template で処理を終了
             return render_template('input.html', 
                                    today=datetime.date.today(), 
@@ -71,7 +122,6 @@ def input():
         
         except Exception as e:
             db.rollback()
-            db.close()
             # サーバーエラー時: render_template で処理を終了
             return render_template('input.html', 
                                    today=datetime.date.today(), 
@@ -110,8 +160,7 @@ def log():
 
     # --- 週の計算 ---
     # 基準日をもとに、その週の日曜日を計算
-    start_of_week = target_date - datetime.timedelta(days=(target_date.weekday() + 1) % 7)
-    end_of_week = start_of_week + datetime.timedelta(days=6)
+    start_of_week, end_of_week = get_start_and_end_of_week(target_date)
 
     # --- 1週間分の日付リストを作成 ---
     week_dates = []
@@ -165,9 +214,15 @@ def account():
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
-    db = next(get_db())
+    # GET（画面表示）ではDBに触れずにログイン画面を返す
+    if request.method == 'GET':
+        return render_template('login.html')
+
     username = request.form.get('username')
-    
+    if not username:
+        return render_template('login.html', error="ユーザー名を入力してください。")
+
+    db = get_request_db(get_user_by_username)
     try:
         user = get_user_by_username(db, username) # Services層でユーザーを取得
         
@@ -180,8 +235,6 @@ def login():
 
     except Exception as e:
         return render_template('input.html', error=f"エラーが発生しました: {str(e)}")
-    finally:
-        db.close()
 
 # --- API: ユーザー登録 ---
 @app.route("/api/register_user", methods=["POST"])
@@ -194,7 +247,7 @@ def register_user_api():
     if not all([username, email, password]):
         return jsonify({"message": "すべての情報が必要です。"}), 400
 
-    db = next(get_db())
+    db = get_request_db()
     try:
         # ★ Services層を呼び出し、DB操作を任せる ★
         user_id = register_new_user(db, username, email, password)
@@ -203,8 +256,6 @@ def register_user_api():
     except Exception as e:
         db.rollback()
         return jsonify({"message": f"登録エラー: {str(e)}"}), 500
-    finally:
-        db.close()
     
 @app.route("/api/add_loss_record", methods=["POST"])
 def add_loss_record_api():
@@ -218,11 +269,22 @@ def add_loss_record_api():
     
     # 必須項目チェック (手動チェックは削除)
     
-    db = next(get_db())
+    from pydantic import ValidationError
+    from schemas import LossRecordInput
+    db = get_request_db()
     try:
         # ★ 1. Pydanticでデータの検証と型変換を一度に行う ★
         validated_data = LossRecordInput(**data)
         
+        # 2. 書き込みキューが有効なら、ライタースレッドのグループコミットに任せる
+        if record_writer is not None:
+            pending_id, future = record_writer.submit(db, validated_data.model_dump())
+            if WRITE_BEHIND_MODE == 'durable':
+                # 自分の記録を含むバッチのコミットを待つ
+                record_id = future.result(timeout=WRITE_BEHIND_WAIT_SECONDS)
+                return jsonify({"message": "記録完了！", "record_id": record_id}), 201
+            return jsonify({"message": "記録を受け付けました。", "pending_id": pending_id}), 202
+
         # 2. Services層へ処理を渡す
         record_id = add_new_loss_record_direct(db, validated_data.model_dump())
         # NOTE: validated_data.model_dump() でPydanticオブジェクトをPython辞書に変換して渡す
@@ -232,12 +294,98 @@ def add_loss_record_api():
     except ValidationError as e:
         # ★ Pydanticのエラーを捕捉し、422を返す ★
         return jsonify({"message": "入力データが無効です", "details": e.errors()}), 422 # 422 Unprocessable Entity
+    except queue.Full:
+        return jsonify({"message": "記録の受付が混み合っています。しばらくしてから再送してください。"}), 503
+    except FutureTimeoutError:
+        # コミットが遅れている場合は保留IDを返し、後から状態を確認してもらう
+        return jsonify({"message": "記録を受け付けました。", "pending_id": pending_id}), 202
     except Exception as e:
         db.rollback()
         return jsonify({"message": f"記録エラー: {str(e)}"}), 500
-    finally:
-        db.close()
         
+@app.route("/api/add_loss_record/pending/<pending_id>", methods=["GET"])
+def get_pending_record_api(pending_id):
+    """非同期モードで受け付けた記録の処理状況（pending / committed / failed）を返すAPI"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"message": "認証が必要です。再ログインしてください。"}), 401
+    if record_writer is None:
+        return jsonify({"message": "書き込みキューは無効です。"}), 404
+    # 結果はユーザーのシャードにあり、他のユーザーの保留IDは見つからない扱いになる
+    status = record_writer.pending_status(get_request_db(record_writer.pending_status), pending_id, user_id)
+    if status is None:
+        return jsonify({"message": "保留IDが見つかりません。"}), 404
+    return jsonify(status), 200
+
+@app.route("/api/write_queue_stats", methods=["GET"])
+def get_write_queue_stats_api():
+    """書き込みキューの深さとバッチサイズの統計を返すAPI"""
+    if record_writer is None:
+        return jsonify({"mode": WRITE_BEHIND_MODE}), 200
+    return jsonify({"mode": WRITE_BEHIND_MODE, **record_writer.metrics()}), 200
+
+@app.route("/api/db_pool_stats", methods=["GET"])
+def get_db_pool_stats_api():
+    """コネクションプールの貸し出し状況（checkout/checkin/overflow など）を返すAPI（read は読み取り専用エンジンの分）"""
+    stats = pool_stats()
+    if read_engine is not engine:
+        stats["read"] = read_pool_stats()
+    return jsonify(stats), 200
+
+# --- API: 廃棄記録の一括登録 ---
+# 1リクエストで受け付ける記録の上限
+MAX_BATCH_RECORDS = 5000
+
+@app.route("/api/add_loss_records", methods=["POST"])
+def add_loss_records_api():
+    """記録の配列を受け取り、全件を検証してから1トランザクションでまとめて登録するAPI"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"message": "認証が必要です。再ログインしてください。"}), 401
+
+    data = request.get_json(silent=True)
+    # {"records": [...]} と、配列そのものの両方を受け付ける
+    items = data.get("records") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"message": "記録の配列が必要です。"}), 400
+    if len(items) > MAX_BATCH_RECORDS:
+        return jsonify({"message": f"一度に登録できる記録は {MAX_BATCH_RECORDS} 件までです。"}), 413
+
+    from pydantic import ValidationError
+    from schemas import LossRecordInput
+    db = get_request_db()
+    try:
+        # ★ 1. 全件を1パスで検証し、エラーは要素ごとに集める ★
+        valid_reasons = set(get_all_loss_reasons(db))
+        validated_records = []
+        errors = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({"index": index, "details": [{"msg": "記録はオブジェクトである必要があります。"}]})
+                continue
+            try:
+                record = LossRecordInput(**{**item, 'user_id': user_id}).model_dump()
+            except ValidationError as e:
+                errors.append({"index": index, "details": e.errors(include_url=False, include_context=False)})
+                continue
+            if record['reason_text'] not in valid_reasons:
+                errors.append({"index": index, "details": [{"loc": ["reason_text"], "msg": f"無効な廃棄理由: {record['reason_text']}"}]})
+                continue
+            validated_records.append(record)
+
+        # 1件でも不正なら何も登録しない（クライアントは修正してそのまま再送できる）
+        if errors:
+            return jsonify({"message": "入力データが無効です", "errors": errors}), 422
+
+        # 2. Services層で executemany による一括挿入（コミットは1回）
+        record_ids = add_new_loss_records_bulk(db, validated_records)
+
+        return jsonify({"message": "記録完了！", "record_ids": record_ids}), 201
+
+    except Exception as e:
+        db.rollback()
+        return jsonify({"message": f"記録エラー: {str(e)}"}), 500
+
 # --- API: 週次ポイント計算 ---
 @app.route("/api/calculate_weekly_points", methods=["POST"])
 def calculate_weekly_points_api():
@@ -245,41 +393,36 @@ def calculate_weekly_points_api():
     if not user_id:
         return jsonify({"message": "認証が必要です。"}), 401 
     
-    db = next(get_db())
+    db = get_request_db()
     try:
-        today = datetime.now()
-        week_boundaries = get_last_two_weeks(today) # 今週と先週の境界
-
-        # --- 1. 週間の合計廃棄量を取得 ---
-        this_week_grams = get_total_grams_for_weeks(db, user_id, *week_boundaries["this_week"])
-        last_week_grams = get_total_grams_for_weeks(db, user_id, *week_boundaries["last_week"])
         # ★ Services層を呼び出し、ロジックを実行させる ★
+        # (集計の取得は1クエリ、ポイントの付与は台帳への記帳と1回の UPDATE で行われる)
         result = calculate_weekly_points_logic(db, user_id)
         
         return jsonify({
-            "message": "週次ポイントを計算・付与しました。",
+            "message": "今週のポイントは付与済みです。" if result.get("already_awarded") else "週次ポイントを計算・付与しました。",
             **result
         }), 200
         
     except Exception as e:
         db.rollback()
         return jsonify({"message": f"ポイント計算中にエラーが発生しました: {str(e)}"}), 500
-    finally:
-        db.close()
 
 @app.route("/api/loss_reasons", methods=["GET"])
 def get_loss_reasons_api():
     """フロントエンドのドロップダウンリスト用の廃棄理由を返すAPI"""
-    db = next(get_db())
+    db = get_request_db(get_all_loss_reasons)
     try:
-        # Services層の関数を呼び出す
+        # Services層の関数を呼び出す（理由一覧はメモリ上のレジストリから返る）
         reasons_list = get_all_loss_reasons(db)
         
-        return jsonify({"reasons": reasons_list}), 200
+        # ETag を付け、ブラウザが If-None-Match で再検証できるようにする（一致すれば 304）
+        response = jsonify({"reasons": reasons_list})
+        response.set_etag(reason_registry.etag(db))
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({"message": f"理由の取得中にエラーが発生しました: {str(e)}"}), 500
-    finally:
-        db.close()
 
 @app.route("/api/user/me", methods=["GET"])
 def get_user_profile_api():
@@ -288,7 +431,7 @@ def get_user_profile_api():
     if not user_id:
         return jsonify({"message": "認証が必要です。"}), 401
     
-    db = next(get_db())
+    db = get_request_db(get_user_profile)
     try:
         profile_data = get_user_profile(db, user_id)
         
@@ -298,8 +441,6 @@ def get_user_profile_api():
         return jsonify(profile_data), 200
     except Exception as e:
         return jsonify({"message": f"プロフィールの取得中にエラーが発生しました: {str(e)}"}), 500
-    finally:
-        db.close()
 
 @app.route("/api/weekly_stats", methods=["GET"])
 def get_weekly_stats_api():
@@ -317,23 +458,198 @@ def get_weekly_stats_api():
         except ValueError:
             pass # 不正な場合は今日の日付を使用
 
-    db = next(get_db())
+    # キャッシュにあればDBに触れずに返す（ブラウザの再検証なら 304）。キャッシュされるのは終わった週だけ
+    week_start = week_start_of(target_date)
+    cached = weekly_stats_cache.get(user_id, week_start)
+    if cached is None:
+        db = get_request_db(get_weekly_stats)
+        try:
+            # Services層を呼び出し、週次データを取得
+            stats_data = get_weekly_stats(db, user_id, target_date)
+        except Exception as e:
+            return jsonify({"message": f"統計データの取得中にエラーが発生しました: {str(e)}"}), 500
+        cached = weekly_stats_cache.put(user_id, week_start, stats_data)
+
+    response = jsonify(cached.payload)
+    response.set_etag(cached.etag)
+    response.last_modified = cached.last_modified
+    # ユーザーごとの内容なので共有キャッシュには置かせず、毎回再検証させる
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        weekly_stats_cache.record_not_modified()
+    return response
+
+@app.route("/api/weekly_stats/cache_stats", methods=["GET"])
+def get_weekly_stats_cache_stats_api():
+    """週次統計キャッシュのヒット・ミスなどの件数を返すAPI"""
+    return jsonify(weekly_stats_cache.stats()), 200
+
+# --- API: 任意期間の統計 ---
+STATS_GRANULARITIES = ("day", "week", "month")
+# 1回のリクエストで集計できる期間（日）の上限
+MAX_STATS_RANGE_DAYS = 366 * 20
+
+@app.route("/api/stats/range", methods=["GET"])
+def get_range_stats_api():
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD&granularity=day|week|month&group_by=reason の期間集計を返すAPI"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"message": "認証が必要です。"}), 401
+
     try:
-        # Services層を呼び出し、週次データを取得
-        stats_data = get_weekly_stats(db, user_id, target_date)
-        
-        return jsonify(stats_data), 200
-        
+        to_date = datetime.datetime.strptime(request.args['to'], '%Y-%m-%d').date() \
+            if request.args.get('to') else datetime.date.today()
+        from_date = datetime.datetime.strptime(request.args['from'], '%Y-%m-%d').date() \
+            if request.args.get('from') else to_date - datetime.timedelta(days=89)
+    except ValueError:
+        return jsonify({"message": "from / to は YYYY-MM-DD 形式で指定してください。"}), 400
+    granularity = request.args.get('granularity', 'day')
+    group_by = request.args.get('group_by') or None
+
+    if granularity not in STATS_GRANULARITIES:
+        return jsonify({"message": f"granularity は {', '.join(STATS_GRANULARITIES)} のいずれかです。"}), 400
+    if group_by not in (None, 'reason'):
+        return jsonify({"message": "group_by は reason のみ指定できます。"}), 400
+    if from_date > to_date:
+        return jsonify({"message": "from は to 以前の日付にしてください。"}), 400
+    if (to_date - from_date).days >= MAX_STATS_RANGE_DAYS:
+        return jsonify({"message": f"期間は {MAX_STATS_RANGE_DAYS} 日以内で指定してください。"}), 400
+
+    db = get_request_db(get_range_stats)
+    try:
+        return jsonify(get_range_stats(db, user_id, from_date, to_date, granularity, group_by)), 200
     except Exception as e:
         return jsonify({"message": f"統計データの取得中にエラーが発生しました: {str(e)}"}), 500
-    finally:
-        db.close()
+
+@app.route("/api/stats/weeks", methods=["GET"])
+def get_adjacent_weeks_stats_api():
+    """基準日の週と、その前週・次週の週次統計を1回で返すAPI（log ページの先読み用）"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"message": "認証が必要です。"}), 401
+
+    date_str = request.args.get('date')
+    target_date = datetime.date.today()
+    if date_str:
+        try:
+            target_date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            pass # 不正な場合は今日の日付を使用
+
+    db = get_request_db(get_weekly_stats_window)
+    try:
+        previous_week, current_week, next_week = get_weekly_stats_window(db, user_id, target_date, 1, 1)
+    except Exception as e:
+        return jsonify({"message": f"統計データの取得中にエラーが発生しました: {str(e)}"}), 500
+
+    # 取得した週のうち終わった週は /api/weekly_stats のキャッシュにも入れておく（前の週へ移動したときにヒットする）
+    # 今週・次週は他のワーカーでの書き込みで変わりうるので入れない
+    for week in (previous_week, current_week, next_week):
+        week_start = datetime.datetime.strptime(week["week_start"], '%Y-%m-%d').date()
+        if week_has_ended(week_start):
+            weekly_stats_cache.put(user_id, week_start, week)
+
+    return jsonify({"previous": previous_week, "current": current_week, "next": next_week}), 200
+
+# --- API: 記録履歴 ---
+# 1ページの件数の既定値と上限
+DEFAULT_RECORDS_PAGE_SIZE = 50
+MAX_RECORDS_PAGE_SIZE = 200
+
+@app.route("/api/records", methods=["GET"])
+def list_records_api():
+    """?cursor=&limit=&reason=&item= でログイン中のユーザーの記録を新しい順にページ送りで返すAPI"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"message": "認証が必要です。"}), 401
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_RECORDS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"message": "limit は整数で指定してください。"}), 400
+    if not 1 <= limit <= MAX_RECORDS_PAGE_SIZE:
+        return jsonify({"message": f"limit は 1 〜 {MAX_RECORDS_PAGE_SIZE} で指定してください。"}), 400
+
+    db = get_request_db(list_loss_records)
+    try:
+        page = list_loss_records(
+            db, user_id, limit,
+            cursor=request.args.get('cursor') or None,
+            reason_text=request.args.get('reason') or None,
+            item_name=request.args.get('item') or None,
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"message": f"記録の取得中にエラーが発生しました: {str(e)}"}), 500
+    return jsonify(page), 200
+
+# --- API: ランキング ---
+@app.route("/api/leaderboard", methods=["GET"])
+def get_leaderboard_api():
+    """?limit= でポイントの上位ユーザーを返すAPI（ポイントに変化が無ければ users テーブルを読まない）"""
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({"message": "limit は整数で指定してください。"}), 400
+
+    db = get_request_db(leaderboard.top)
+    try:
+        return jsonify({"leaderboard": leaderboard.top(db, limit)}), 200
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"message": f"ランキングの取得中にエラーが発生しました: {str(e)}"}), 500
+
+@app.route("/api/leaderboard/me", methods=["GET"])
+def get_my_rank_api():
+    """ログイン中のユーザーのポイントと順位を返すAPI"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"message": "認証が必要です。"}), 401
+
+    db = get_request_db(leaderboard.rank_of)
+    try:
+        return jsonify(leaderboard.rank_of(db, user_id)), 200
+    except Exception as e:
+        return jsonify({"message": f"順位の取得中にエラーが発生しました: {str(e)}"}), 500
+
+# --- API: エクスポート ---
+@app.route("/api/export", methods=["GET"])
+def export_records_api():
+    """?format=csv|ndjson&gzip=1 でログイン中のユーザーの記録を逐次ダウンロードさせるAPI（全ユーザー分は export.py の CLI で）"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"message": "認証が必要です。"}), 401
+
+    from export import EXPORT_FORMATS, export_filename, iter_export
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"message": f"format は {', '.join(EXPORT_FORMATS)} のいずれかです。"}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    # リクエストのセッション（get_request_db）は最初のチャンクより前に teardown で閉じられるので、
+    # ジェネレータの中で専用のセッションを開き、読み終わるか切断されたら閉じる
+    def generate():
+        with session_for_user(user_id, access_for(iter_export)) as db:
+            yield from iter_export(db, fmt, compress, user_id)
+
+    chunks = stream_with_context(generate())
+    mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response = Response(chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(fmt, compress, user_id)}"'
+    return response
 
 @app.route("/register")
 def register_page():
     return render_template('register.html')
 
+startup_timer.mark("routes")
+get_logger("startup").info("startup_finished", extra={"fields": startup_timer.fields()})
+
 # --- サーバー実行 ---
 if __name__ == "__main__":
-    # Flaskサーバーを起動
+    # Flaskの開発用サーバーを起動（本番では python server.py で複数ワーカーを起動する）
     app.run(debug=True)
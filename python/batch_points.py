@@ -0,0 +1,224 @@
+# batch_points.py
+"""
+全ユーザーの週次ポイントを一括で計算・付与するバッチ。
+
+ユーザーIDを chunk_size 件ずつの範囲に分け、範囲ごとに
+  1. 日次集計行（user_day_totals）を GROUP BY user_id で1回集計し、
+  2. weekly_point_awards・points_ledger への INSERT と users への UPDATE を1トランザクションで行う
+という集合指向の処理を、プロセスプールで並列に実行します。
+シャーディング中（sharding.py）は、1. の集計を全シャードに並列に問い合わせて合わせます。
+(user_id, week_key) ごとの付与実績が残るため、途中で落ちても再実行すれば
+未処理のユーザーだけが付与され、二重付与は起きません。
+
+使い方:
+    python batch_points.py                          # 先週（直近の完了した週）を対象に実行
+    python batch_points.py --week 2025-10-06 --chunk-size 2000 --workers 4
+"""
+import argparse
+import datetime
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import SessionLocal, engine
+from models import PointsLedgerEntry, User, WeeklyPointAward, week_key_of, week_key_to_monday
+from points_ledger import WEEKLY_REDUCTION, record_weekly_points_bulk
+from request_log import get_logger
+from rollups import get_points_window_totals_for_users
+from services import compute_weekly_award
+from sharding import map_shards
+
+logger = get_logger("batch_points")
+
+# --- 対象週の決め方 ---
+
+def last_completed_week_key(now: Optional[datetime.datetime] = None) -> int:
+    """now の時点で最後に終わった週（先週）の週キーを返す。"""
+    return week_key_of(now or datetime.datetime.now()) - 1
+
+def _evaluation_time(week_key: int) -> datetime.datetime:
+    """
+    週を評価する基準日時（その週の日曜日）を返す。
+    ユーザーが日曜日に /api/calculate_weekly_points を呼んだ場合と同じ期間で集計されます。
+    """
+    sunday = week_key_to_monday(week_key) + datetime.timedelta(days=6)
+    return datetime.datetime.combine(sunday, datetime.time())
+
+# --- チャンク単位の処理（ワーカープロセスで実行） ---
+
+def award_user_range(first_user_id: int, last_user_id: int, week_key: int) -> Tuple[int, int, int]:
+    """
+    user_id が first_user_id〜last_user_id のユーザーについて、指定週のポイントを付与する。
+    範囲内の処理は1トランザクションで、既に付与済みのユーザーは飛ばす。
+
+    Returns:
+        (評価したユーザー数, ポイントを付与したユーザー数, 付与したポイントの合計)
+    """
+    evaluated_at = _evaluation_time(week_key)
+    totals: Dict[int, Tuple[float, float, float]] = {}
+    # 日次集計行はユーザーのシャードにあるので、範囲内のユーザーを全シャードから並列に集める
+    for shard_totals in map_shards(
+        lambda shard_db: get_points_window_totals_for_users(shard_db, first_user_id, last_user_id, evaluated_at)
+    ):
+        totals.update(shard_totals)
+
+    db = SessionLocal()
+    try:
+        already_awarded = set(db.scalars(
+            select(WeeklyPointAward.user_id)
+            .where(WeeklyPointAward.week_key == week_key)
+            .where(WeeklyPointAward.user_id.between(first_user_id, last_user_id))
+        ))
+
+        awards: List[Dict[str, Any]] = []
+        for user_id, (this_week, last_week, past_four_weeks) in totals.items():
+            if user_id in already_awarded:
+                continue
+            result = compute_weekly_award(this_week, last_week, past_four_weeks)
+            awards.append({"user_id": user_id, "week_key": week_key, **result})
+        if not awards:
+            return 0, 0, 0
+
+        # ポイントは台帳に記帳できた分だけ残高に加算する（二重付与は台帳の一意制約で防ぐ）
+        credited = record_weekly_points_bulk(
+            db, week_key, WEEKLY_REDUCTION,
+            {award["user_id"]: award["points_added"] for award in awards if award["points_added"] > 0},
+        )
+        # 実績には実際に記帳した分を残す（/api/calculate_weekly_points で記帳済みの週は 0 になり、台帳と食い違わない）
+        for award in awards:
+            award["points_added"] = credited.get(award["user_id"], 0)
+        # 同じ範囲を別のワーカーが同時に処理していても失敗しないよう、既にある実績は飛ばす
+        db.execute(sqlite_insert(WeeklyPointAward).on_conflict_do_nothing(), awards)
+        db.commit()
+        return len(awards), len(credited), sum(credited.values())
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# --- バッチ全体 ---
+
+def _user_id_ranges(chunk_size: int) -> Tuple[List[Tuple[int, int]], int]:
+    """全ユーザーIDを chunk_size 件ずつの (最初のID, 最後のID) の範囲に分ける。"""
+    db = SessionLocal()
+    try:
+        user_ids = list(db.scalars(select(User.id).order_by(User.id)))
+    finally:
+        db.close()
+    ranges = [
+        (user_ids[i], user_ids[min(i + chunk_size, len(user_ids)) - 1])
+        for i in range(0, len(user_ids), chunk_size)
+    ]
+    return ranges, len(user_ids)
+
+def run_weekly_points_batch(week_key: Optional[int] = None, chunk_size: int = 1000, workers: int = 1) -> Dict[str, Any]:
+    """
+    全ユーザーについて指定週（省略時は先週）のポイントを付与する。
+
+    Args:
+        week_key: 対象週の週キー
+        chunk_size: 1トランザクションで処理するユーザー数
+        workers: ワーカープロセス数（1ならこのプロセス内で順に処理する）
+
+    Returns:
+        処理件数とスループット（users_per_sec）をまとめた辞書
+    """
+    if week_key is None:
+        week_key = last_completed_week_key()
+
+    started = time.perf_counter()
+    ranges, user_count = _user_id_ranges(chunk_size)
+    if workers > 1 and len(ranges) > 1:
+        # スレッド（アプリ内スケジューラ）から呼ばれても安全なよう、ワーカーは spawn で起動する
+        # （各ワーカーは database モジュールを読み込み直し、自前の接続を持つ）
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(award_user_range, *zip(*ranges), [week_key] * len(ranges)))
+    else:
+        results = [award_user_range(first, last, week_key) for first, last in ranges]
+    elapsed = time.perf_counter() - started
+
+    return {
+        "week_start": week_key_to_monday(week_key).strftime('%Y-%m-%d'),
+        "users": user_count,
+        "evaluated_users": sum(r[0] for r in results),
+        "rewarded_users": sum(r[1] for r in results),
+        "points_added": sum(r[2] for r in results),
+        "seconds": round(elapsed, 3),
+        "users_per_sec": round(user_count / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+# --- アプリ内スケジューラ ---
+
+class WeeklyPointsScheduler(threading.Thread):
+    """
+    週の境界（月曜日の run_at 時刻）ごとに、終わった週の一括付与を実行するデーモンスレッド。
+    起動直後にも先週分を一度実行するため、停止中に境界をまたいでも取りこぼしません（付与は冪等）。
+    """
+
+    def __init__(self, run_at: datetime.time = datetime.time(0, 5), chunk_size: int = 1000, workers: int = 1):
+        super().__init__(name="weekly-points-scheduler", daemon=True)
+        self.run_at = run_at
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self._stop_event = threading.Event()
+
+    def next_run(self, now: datetime.datetime) -> datetime.datetime:
+        """now より後の、最初の月曜日 run_at の日時を返す。"""
+        monday = week_key_to_monday(week_key_of(now))
+        candidate = datetime.datetime.combine(monday, self.run_at)
+        if candidate <= now:
+            candidate += datetime.timedelta(weeks=1)
+        return candidate
+
+    def run_once(self):
+        try:
+            report = run_weekly_points_batch(chunk_size=self.chunk_size, workers=self.workers)
+            logger.info("weekly_points_batch_finished", extra={"fields": report})
+        except Exception:
+            logger.exception("weekly_points_batch_failed")
+
+    def run(self):
+        self.run_once()
+        while not self._stop_event.is_set():
+            wait_seconds = (self.next_run(datetime.datetime.now()) - datetime.datetime.now()).total_seconds()
+            if self._stop_event.wait(max(wait_seconds, 0)):
+                break
+            self.run_once()
+
+    def stop(self):
+        self._stop_event.set()
+
+def start_weekly_scheduler(**kwargs) -> WeeklyPointsScheduler:
+    """スケジューラスレッドを起動して返す。"""
+    scheduler = WeeklyPointsScheduler(**kwargs)
+    scheduler.start()
+    return scheduler
+
+def main():
+    parser = argparse.ArgumentParser(description="全ユーザーの週次ポイント一括付与")
+    parser.add_argument("--week", help="対象週に含まれる日付 (YYYY-MM-DD)。省略時は先週")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="1トランザクションで処理するユーザー数")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="ワーカープロセス数")
+    args = parser.parse_args()
+
+    # アプリ（init_db）を一度も起動していないDBでも実行できるようにする
+    WeeklyPointAward.__table__.create(bind=engine, checkfirst=True)
+    PointsLedgerEntry.__table__.create(bind=engine, checkfirst=True)
+
+    week_key = None
+    if args.week:
+        week_key = week_key_of(datetime.datetime.strptime(args.week, '%Y-%m-%d').date())
+
+    report = run_weekly_points_batch(week_key, chunk_size=args.chunk_size, workers=args.workers)
+    print(f"Week of {report['week_start']}: evaluated {report['evaluated_users']} / {report['users']} users, "
+          f"rewarded {report['rewarded_users']} users with {report['points_added']} points "
+          f"in {report['seconds']}s ({report['users_per_sec']} users/sec)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+# benchmark.py
+"""
+サービス層のマイクロベンチマーク。
+
+規模ごとに新しい SQLite データベースを作り、よく呼ばれる関数の実行時間（p50/p95）と
+1回あたりのクエリ数を計測して JSON で出力します。保存しておいた結果と比較して、
+デプロイ前に性能の劣化（リグレッション）を検出できます。
+
+使い方:
+    python benchmark.py --scales small,medium --output bench.json
+    python benchmark.py --scales small --compare baseline.json --tolerance 0.2
+    python benchmark.py --scales large --workdir /var/tmp/bench --reuse     # 作成済みのDBを使い回す
+
+1回あたりのクエリ数が QUERY_BUDGETS の上限を超えたケースがあれば、終了コード 1 で終了します。
+比較モードでは、p50 が基準値の (1 + tolerance) 倍を超えた場合や、クエリ数が増えた場合にも
+終了コード 1 で終了します。
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+import services
+import stats_engine
+from database import DEFAULT_LOSS_REASONS, create_db_engine, seed_loss_reasons
+from models import Base, FoodLossRecord, User, day_key_of, week_key_of
+from reason_registry import reason_registry
+from rollups import rebuild_rollups
+
+# 規模ごとのユーザー数と記録数
+SCALES = {
+    "small": {"users": 10, "records": 1_000},
+    "medium": {"users": 1_000, "records": 100_000},
+    "large": {"users": 100_000, "records": 10_000_000},
+}
+
+# 記録を散らばらせる期間（日）
+HISTORY_DAYS = 120
+
+# ケースごとの1回あたりのクエリ数の上限。記録数に比例してクエリが増える（N+1）と、
+# どの規模でもこの上限を超えるので、ベンチマークは終了コード 1 で失敗する
+QUERY_BUDGETS = {
+    "get_weekly_stats": 1,
+    "get_weekly_stats_window": 1,
+    "get_range_stats": 1,
+    "calculate_weekly_statistics": 1,
+    "get_total_grams_for_weeks": 1,
+    "get_all_loss_reasons": 1,  # 初回のみ理由を読み込む
+    "list_loss_records": 1,  # 理由のテキストはレジストリから引く
+    "calculate_weekly_points_logic": 3,  # 集計1回 + 付与する場合は台帳の記帳と残高の更新
+    "add_new_loss_record_direct": 5,  # 記録の INSERT + 日次・週次集計の UPSERT + refresh
+}
+
+# --- データセットの作成 ---
+
+def build_dataset(engine: Engine, users: int, records: int, seed: int = 0, chunk_size: int = 50_000) -> None:
+    """空のDBにテーブルを作り、ユーザーと廃棄記録をランダムに投入してロールアップを作る。"""
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        seed_loss_reasons(db)
+    reason_count = len(DEFAULT_LOSS_REASONS)
+
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    history_seconds = HISTORY_DAYS * 24 * 60 * 60
+
+    # 大量行の投入は ORM を通さず、DB-API の executemany で行う
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.executemany(
+            f"INSERT INTO {User.__tablename__} (id, username, password, email, total_points) VALUES (?, ?, ?, ?, 0)",
+            ((i, f"bench_user_{i}", "x", f"bench_user_{i}@example.com") for i in range(1, users + 1)),
+        )
+        inserted = 0
+        while inserted < records:
+            batch = min(chunk_size, records - inserted)
+            rows = []
+            for _ in range(batch):
+                recorded_at = now - datetime.timedelta(seconds=rng.randrange(history_seconds))
+                rows.append((
+                    rng.randint(1, users),
+                    "bench_item",
+                    round(rng.uniform(10.0, 500.0), 1),
+                    rng.randint(1, reason_count),
+                    recorded_at.isoformat(),
+                    recorded_at.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                    day_key_of(recorded_at),
+                    week_key_of(recorded_at),
+                ))
+            cursor.executemany(
+                f"INSERT INTO {FoodLossRecord.__tablename__} "
+                f"(user_id, item_name, weight_grams, loss_reason_id, record_date, recorded_at, day_key, week_key) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            raw.commit()
+            inserted += batch
+        cursor.close()
+    finally:
+        raw.close()
+    rebuild_rollups(engine)
+
+def open_dataset(workdir: str, scale: str, reuse: bool) -> tuple[Engine, float]:
+    """規模に対応するDBを開く（無ければ作る）。作成にかかった秒数も返す（使い回した場合は 0）。"""
+    path = os.path.join(workdir, f"bench_{scale}.db")
+    if os.path.exists(path) and not reuse:
+        os.remove(path)
+    existed = os.path.exists(path)
+    engine = create_db_engine(f"sqlite:///{path}")
+    if existed:
+        return engine, 0.0
+    started = time.perf_counter()
+    build_dataset(engine, **SCALES[scale])
+    return engine, time.perf_counter() - started
+
+# --- 計測 ---
+
+class QueryCounter:
+    """エンジンで実行された SQL 文の数を数える。"""
+
+    def __init__(self, engine: Engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """ソート済みの値から最近傍順位法でパーセンタイルを求める。"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def _cases(today: datetime.date) -> Dict[str, Callable[[Session, int], Any]]:
+    """計測対象の関数。各関数は (セッション, ユーザーID) を受け取る。"""
+    return {
+        "get_weekly_stats": lambda db, user_id: stats_engine.get_weekly_stats(db, user_id, today),
+        "get_weekly_stats_window": lambda db, user_id: stats_engine.get_weekly_stats_window(db, user_id, today, 1, 1),
+        "get_range_stats": lambda db, user_id: stats_engine.get_range_stats(
+            db, user_id, today - datetime.timedelta(days=HISTORY_DAYS), today, "week", "reason"),
+        "calculate_weekly_points_logic": lambda db, user_id: services.calculate_weekly_points_logic(db, user_id),
+        "add_new_loss_record_direct": lambda db, user_id: services.add_new_loss_record_direct(db, {
+            "user_id": user_id, "item_name": "bench_item", "weight_grams": 123.0, "reason_text": "食べ残し",
+        }),
+        "calculate_weekly_statistics": lambda db, user_id: stats_engine.calculate_weekly_statistics(db, user_id),
+        "get_total_grams_for_weeks": lambda db, user_id: stats_engine.get_total_grams_for_weeks(db, user_id, 4),
+        "get_all_loss_reasons": lambda db, user_id: services.get_all_loss_reasons(db),
+        "list_loss_records": lambda db, user_id: services.list_loss_records(db, user_id),
+    }
+
+def run_scale(engine: Engine, users: int, iterations: int, warmup: int, seed: int = 0) -> Dict[str, Any]:
+    """1つのDBに対して全ケースを計測する。"""
+    SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    counter = QueryCounter(engine)
+    rng = random.Random(seed)
+    # 別のDBを計測した後かもしれないので、理由のキャッシュを読み直させる
+    reason_registry.invalidate()
+
+    results = {}
+    for name, func in _cases(datetime.date.today()).items():
+        timings = []
+        queries = 0
+        max_queries = 0
+        for i in range(warmup + iterations):
+            user_id = rng.randint(1, users)
+            # 本番の1リクエストと同じく、呼び出しごとに新しいセッションを使う
+            with SessionFactory() as db:
+                before = counter.count
+                started = time.perf_counter()
+                func(db, user_id)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+            if i >= warmup:
+                timings.append(elapsed_ms)
+                queries += counter.count - before
+                max_queries = max(max_queries, counter.count - before)
+        timings.sort()
+        results[name] = {
+            "iterations": iterations,
+            "p50_ms": round(percentile(timings, 50), 4),
+            "p95_ms": round(percentile(timings, 95), 4),
+            "mean_ms": round(sum(timings) / len(timings), 4),
+            "queries_per_call": round(queries / iterations, 2),
+            "max_queries_per_call": max_queries,
+        }
+    return results
+
+# --- 基準値との比較 ---
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_delta_ms: float = 0.05) -> List[str]:
+    """
+    基準値と比べて劣化したケースの説明のリストを返す（空なら劣化なし）。
+    p50 の差が min_delta_ms 未満のものは計測誤差とみなして劣化に数えない。
+    """
+    regressions = []
+    print(f"{'scale':<8} {'case':<32} {'base p50':>10} {'now p50':>10} {'ratio':>7} {'queries':>12}", file=sys.stderr)
+    for scale, scale_result in current["scales"].items():
+        base_scale = baseline.get("scales", {}).get(scale)
+        if not base_scale:
+            continue
+        for case, result in scale_result["cases"].items():
+            base = base_scale["cases"].get(case)
+            if not base:
+                continue
+            ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] else 1.0
+            queries = f"{base['queries_per_call']}->{result['queries_per_call']}"
+            print(f"{scale:<8} {case:<32} {base['p50_ms']:>10.3f} {result['p50_ms']:>10.3f} {ratio:>7.2f} {queries:>12}",
+                  file=sys.stderr)
+            if ratio > 1 + tolerance and result["p50_ms"] - base["p50_ms"] >= min_delta_ms:
+                regressions.append(f"{scale}/{case}: p50 {base['p50_ms']}ms -> {result['p50_ms']}ms (x{ratio:.2f})")
+            if result["queries_per_call"] > base["queries_per_call"]:
+                regressions.append(f"{scale}/{case}: queries {base['queries_per_call']} -> {result['queries_per_call']}")
+    return regressions
+
+def check_query_budgets(report: Dict[str, Any]) -> List[str]:
+    """QUERY_BUDGETS を超えたケースの説明のリストを返す（空なら全て上限内）。"""
+    violations = []
+    for scale, scale_result in report["scales"].items():
+        for case, result in scale_result["cases"].items():
+            budget = QUERY_BUDGETS.get(case)
+            if budget is not None and result["max_queries_per_call"] > budget:
+                violations.append(f"{scale}/{case}: {result['max_queries_per_call']} queries per call (budget {budget})")
+    return violations
+
+def main():
+    parser = argparse.ArgumentParser(description="サービス層のマイクロベンチマーク")
+    parser.add_argument("--scales", default="small,medium", help=f"カンマ区切りの規模 ({', '.join(SCALES)})")
+    parser.add_argument("--iterations", type=int, default=200, help="1ケースあたりの計測回数")
+    parser.add_argument("--warmup", type=int, default=5, help="計測前に捨てる呼び出し回数")
+    parser.add_argument("--workdir", default=None, help="ベンチマーク用DBを置くディレクトリ（省略時は一時ディレクトリ）")
+    parser.add_argument("--reuse", action="store_true", help="workdir に作成済みのDBがあれば使い回す")
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル（省略時は標準出力）")
+    parser.add_argument("--compare", default=None, help="比較する基準の JSON ファイル")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p50 の許容増加率（0.2 = 20%%）")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="劣化とみなす p50 の最小の差（ミリ秒）")
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        parser.error(f"不明な規模です: {unknown}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="food_loss_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    report: Dict[str, Any] = {
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scales": {},
+    }
+    for scale in scales:
+        engine, build_seconds = open_dataset(workdir, scale, args.reuse)
+        print(f"[{scale}] dataset ready in {build_seconds:.1f}s ({workdir})", file=sys.stderr)
+        try:
+            cases = run_scale(engine, SCALES[scale]["users"], args.iterations, args.warmup)
+        finally:
+            engine.dispose()
+        report["scales"][scale] = {**SCALES[scale], "build_seconds": round(build_seconds, 2), "cases": cases}
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    violations = check_query_budgets(report)
+    if violations:
+        print("Query budget exceeded:", file=sys.stderr)
+        for line in violations:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("Regressions detected:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
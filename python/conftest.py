@@ -0,0 +1,19 @@
+# conftest.py
+"""
+テスト共通の設定。
+
+テストがアプリのDB（db/food_loss.db）に触れないよう、アプリのモジュールを import する前に
+一時ディレクトリのDBを指すようにします（シャードのファイルも同じディレクトリに作られます）。
+"""
+import os
+import shutil
+import tempfile
+
+_TEST_DB_DIR = tempfile.mkdtemp(prefix="food_loss_test_")
+os.environ["FOOD_LOSS_DB_PATH"] = os.path.join(_TEST_DB_DIR, "food_loss.db")
+os.environ["FOOD_LOSS_SHARDS"] = "1"
+os.environ["FOOD_LOSS_SCHEMA_BOOTSTRAP"] = "auto"
+os.environ.pop("WEEKLY_POINTS_SCHEDULER", None)
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_TEST_DB_DIR, ignore_errors=True)
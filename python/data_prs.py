@@ -11,6 +11,7 @@ import json
 import os
 import datetime
 import pickle
+import numpy as np
 
 #  データの前処理
 
@@ -61,33 +62,129 @@ def get_jsondata(url:str):
     return None
 
   #  データの統計
+  # food_loss_records を NumPy 配列に一括で読み込み、日・月・理由ごとの合計をベクトル演算で求める
+  # (day_key は 0001-01-01 を 1 とする通し日数。1970-01-01 は 719163)
+_EPOCH_DAY_KEY = 719163
+
+def _read_records(engine,user_id=None,chunk_size:int=500_000):
+    """engine のDBファイルにある記録を (user_id, day_key, weight_grams, loss_reason_id) の2次元配列で返す。"""
+    sql="SELECT user_id, day_key, weight_grams, COALESCE(loss_reason_id, 0) FROM food_loss_records WHERE day_key IS NOT NULL"
+    params=()
+    if user_id is not None:
+        sql+=" AND user_id = ?"
+        params=(user_id,)
+    chunks=[]
+    raw=engine.raw_connection()
+    try:
+        cursor=raw.cursor()
+        cursor.execute(sql,params)
+        while True:
+            rows=cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows,dtype=np.float64).reshape(-1,4))
+        cursor.close()
+    finally:
+        raw.close()
+    return np.concatenate(chunks) if chunks else np.zeros((0,4))
+
 class dataStat():
     def __init__(self):
         #当日の日付を取得
         self.current_time =datetime.datetime.now()
-        #月毎(1~12)の廃棄量のリスト
-        self.m_datas=[]
-        #日毎(1~31)の廃棄量のリスト
-        self.d_datas=[]
-        #当日の廃棄量のリスト
-        self.t_datas=[]
+        #月毎(1~12)の廃棄量（current_time の年）
+        self.m_datas=np.zeros(12)
+        #日毎(1~31)の廃棄量（current_time の月）
+        self.d_datas=np.zeros(31)
+        #当日の廃棄量の配列
+        self.t_datas=np.zeros(0)
+        #理由ID毎の廃棄量（添字が loss_reason_id）
+        self.r_datas=np.zeros(0)
+
+        #読み込んだ記録（1記録1要素の配列）
+        self.user_ids=np.zeros(0,dtype=np.int64)
+        self.day_keys=np.zeros(0,dtype=np.int64)
+        self.weights=np.zeros(0,dtype=np.float64)
+        self.reason_ids=np.zeros(0,dtype=np.int64)
+
+    def load(self,engine=None,user_id=None,chunk_size:int=500_000):
+        """
+        1ユーザー（user_id 指定時）または全ユーザーの記録を配列に読み込む。
+        engine を省略すると、シャーディング中（sharding.py）でも記録のあるシャードから読む
+        （user_id 指定時はそのユーザーのシャード、全ユーザーなら全シャードを並列に読んで連結する）。
+        engine を渡した場合は、そのDBファイルにある記録だけを読む。
+        day_key が未設定（バックフィル前）の行は読み込まない。
+        """
+        if engine is not None:
+            data=_read_records(engine,user_id,chunk_size)
+        else:
+            from models import FoodLossRecord
+            from sharding import map_shards, shard_for
+            if user_id is not None:
+                data=_read_records(shard_for(user_id).read_engine,user_id,chunk_size)
+            else:
+                data=np.concatenate(map_shards(lambda db:_read_records(db.get_bind(FoodLossRecord),None,chunk_size)))
+        self.user_ids=data[:,0].astype(np.int64)
+        self.day_keys=data[:,1].astype(np.int64)
+        self.weights=data[:,2]
+        self.reason_ids=data[:,3].astype(np.int64)
+        return self
+
+    def _dates(self):
+        #日キーを numpy の日付（datetime64[D]）に変換
+        return (self.day_keys-_EPOCH_DAY_KEY).astype('datetime64[D]')
 
-        
     def monthly_data(self):
-        #合計を計算する
-        self.m_datas[int(self.current_time.month)-1]=self.t_datas.sum()
-        pass
+        #current_time の年について、月毎の合計を計算する
+        months=self._dates().astype('datetime64[M]').astype(np.int64)  # 1970-01 からの月数
+        year_start=(self.current_time.year-1970)*12
+        in_year=(months>=year_start)&(months<year_start+12)
+        self.m_datas=np.bincount(months[in_year]-year_start,weights=self.weights[in_year],minlength=12)
+        return self.m_datas
+
     def daily_data(self):
-        #合計を計算する
-        self.d_datas[int(self.current_time.day)-1]=self.t_datas.sum()
-        pass
+        #current_time の月について、日毎の合計と当日の廃棄量を計算する
+        today_key=self.current_time.toordinal()
+        month_start_key=today_key-(self.current_time.day-1)
+        in_month=self._dates().astype('datetime64[M]')==np.datetime64(self.current_time.date(),'M')
+        self.d_datas=np.bincount(self.day_keys[in_month]-month_start_key,weights=self.weights[in_month],minlength=31)
+        self.t_datas=self.weights[self.day_keys==today_key]
+        return self.d_datas
+
+    def reason_data(self):
+        #理由ID毎の合計を計算する
+        self.r_datas=np.bincount(self.reason_ids,weights=self.weights)
+        return self.r_datas
+
+    def monthly_report(self):
+        """
+        読み込んだ全期間の月毎の合計を {'YYYY-MM': 合計} で返す。
+        月でソートしてから reduceat で区間和を取るため、行数に比例した1回の走査で済む。
+        """
+        if self.weights.size==0:
+            return {}
+        months=self._dates().astype('datetime64[M]')
+        order=np.argsort(months,kind='stable')
+        sorted_months=months[order]
+        starts=np.flatnonzero(np.r_[True,sorted_months[1:]!=sorted_months[:-1]])
+        totals=np.add.reduceat(self.weights[order],starts)
+        return {str(month):round(float(total),1) for month,total in zip(sorted_months[starts],totals)}
+
+    def compute(self):
+        #全ての統計をまとめて計算する
+        self.monthly_data()
+        self.daily_data()
+        self.reason_data()
+        return self
 
  #廃棄データの統計をjsonファイルに保存
 def  datastat_write(datastat:dataStat):
     data ={
-        "monthly_data":datastat.m_datas,
-        "daily_data":datastat.d_datas,
-        
+        "monthly_data":[round(float(v),1) for v in datastat.m_datas],
+        "daily_data":[round(float(v),1) for v in datastat.d_datas],
+        "today_data":[round(float(v),1) for v in datastat.t_datas],
+        "reason_data":{str(i):round(float(v),1) for i,v in enumerate(datastat.r_datas) if v},
+        "monthly_report":datastat.monthly_report(),
     }
     filename =f"data_stat.json"
     try:
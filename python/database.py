@@ -1,55 +1,249 @@
 # database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, User, LossReason, FoodLossRecord
+from migrations import ensure_record_time_columns
+from rollups import rollups_need_rebuild
+from reason_registry import reason_registry
 import os
+import zlib
 
 # データベースファイルへのパスを定義
 # os.path.dirname(__file__) は現在のファイルのディレクトリパス (例: C:/.../social-implementation/python)
 # os.path.dirname(os.path.dirname(__file__)) で一つ上の親ディレクトリに移動
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
-DATABASE_PATH = os.path.join(PROJECT_ROOT, 'db', 'food_loss.db')
+# 環境変数 FOOD_LOSS_DB_PATH で別のファイルを使える（テストなど。シャードのファイルも同じディレクトリに置かれる）
+DATABASE_PATH = os.environ.get("FOOD_LOSS_DB_PATH") or os.path.join(PROJECT_ROOT, 'db', 'food_loss.db')
 DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+# 読み取り専用で開く URL（mode=ro の接続からは書き込めない）
+READ_DATABASE_URL = f"sqlite:///file:{DATABASE_PATH}?mode=ro&uri=true"
 
-# データベースエンジンを作成
-engine = create_engine(DATABASE_URL)
+# --- エンジン設定（本番向けプロファイル） ---
+# 環境変数で上書きできます。既定値は複数の Flask ワーカーから同時に読み書きする前提の設定です。
+#   WAL: 読み取りが書き込みにブロックされない / busy_timeout: ロック中は即エラーにせず待つ
+ENGINE_PROFILE = {
+    "journal_mode": os.environ.get("FOOD_LOSS_DB_JOURNAL_MODE", "WAL").upper(),
+    "synchronous": os.environ.get("FOOD_LOSS_DB_SYNCHRONOUS", "NORMAL").upper(),
+    "busy_timeout_ms": int(os.environ.get("FOOD_LOSS_DB_BUSY_TIMEOUT_MS", "5000")),
+    # 負の値は KiB 単位の指定（-65536 = 64MiB）
+    "cache_size": int(os.environ.get("FOOD_LOSS_DB_CACHE_SIZE", "-65536")),
+    "mmap_size": int(os.environ.get("FOOD_LOSS_DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.environ.get("FOOD_LOSS_DB_TEMP_STORE", "MEMORY").upper(),
+    "pool_size": int(os.environ.get("FOOD_LOSS_DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.environ.get("FOOD_LOSS_DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.environ.get("FOOD_LOSS_DB_POOL_TIMEOUT", "30")),
+}
+
+# 読み取り専用エンジンのプロファイル。WAL では読み取りは互いにも書き込みにもブロックされないので、
+# 書き込み用より大きなプールを持たせる
+READ_ENGINE_PROFILE = {
+    **ENGINE_PROFILE,
+    "pool_size": int(os.environ.get("FOOD_LOSS_DB_READ_POOL_SIZE", "10")),
+    "max_overflow": int(os.environ.get("FOOD_LOSS_DB_READ_MAX_OVERFLOW", "20")),
+}
+# off にすると読み取りも書き込み用のエンジンで行う
+READ_ENGINE_MODES = ("on", "off")
+READ_ENGINE = os.environ.get("FOOD_LOSS_DB_READ_ENGINE", "on").lower()
+
+# PRAGMA には値をバインドできないため、文字列で渡す設定は許可リストで検証する
+_ALLOWED_PRAGMA_VALUES = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+}
+
+def create_db_engine(url: str = DATABASE_URL, profile: dict = ENGINE_PROFILE, read_only: bool = False) -> Engine:
+    """
+    プロファイルに従って SQLite エンジンを作成する。
+    接続ごとに PRAGMA を設定し、コネクションプールの大きさも profile から決める。
+    read_only=True の場合は journal_mode を変更せず（DBファイルへの書き込みになるため）、
+    query_only を有効にする。
+    """
+    for key, allowed in _ALLOWED_PRAGMA_VALUES.items():
+        if profile[key] not in allowed:
+            raise ValueError(f"{key} に指定できない値です: {profile[key]} (指定可能: {sorted(allowed)})")
+
+    new_engine = create_engine(
+        url,
+        pool_size=profile["pool_size"],
+        max_overflow=profile["max_overflow"],
+        pool_timeout=profile["pool_timeout"],
+        # Python 側のロック待ち（秒）も busy_timeout に揃える
+        connect_args={"timeout": profile["busy_timeout_ms"] / 1000.0, "check_same_thread": False},
+    )
+
+    @event.listens_for(new_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+            else:
+                cursor.execute(f"PRAGMA journal_mode={profile['journal_mode']}")
+            cursor.execute(f"PRAGMA synchronous={profile['synchronous']}")
+            cursor.execute(f"PRAGMA busy_timeout={int(profile['busy_timeout_ms'])}")
+            cursor.execute(f"PRAGMA cache_size={int(profile['cache_size'])}")
+            cursor.execute(f"PRAGMA mmap_size={int(profile['mmap_size'])}")
+            cursor.execute(f"PRAGMA temp_store={profile['temp_store']}")
+        finally:
+            cursor.close()
+
+    return new_engine
+
+def describe_engine(target_engine: Engine, profile: dict = ENGINE_PROFILE) -> str:
+    """実際に接続して読み出した PRAGMA の値とプール設定を、起動ログ用の1行にまとめる。"""
+    with target_engine.connect() as conn:
+        pragmas = {
+            name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+            for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store")
+        }
+    pool = target_engine.pool
+    pool_info = f"pool={type(pool).__name__}"
+    if hasattr(pool, "size"):
+        pool_info += f" pool_size={pool.size()} max_overflow={profile['max_overflow']} pool_timeout={pool.timeout()}"
+    settings = " ".join(f"{name}={value}" for name, value in pragmas.items())
+    return f"SQLite engine ({target_engine.url.database}): {settings} {pool_info}"
+
+# --- スキーマのバージョン ---
+# init_db はモデル定義から計算したバージョンを PRAGMA user_version に記録し、
+# 次回以降の起動で一致すれば create_all・列の確認・初期データの投入を省きます（ワーカーの起動を速くする）。
+# 環境変数 FOOD_LOSS_SCHEMA_BOOTSTRAP=always で毎回行うようにできます。
+# skip はスキーマの確認を別のプロセスが済ませている場合（server.py のワーカー）で、DBへの接続も開きません。
+SCHEMA_BOOTSTRAP_MODES = ("auto", "always", "skip")
+SCHEMA_BOOTSTRAP = os.environ.get("FOOD_LOSS_SCHEMA_BOOTSTRAP", "auto").lower()
+
+def schema_version(metadata=Base.metadata, tables=None) -> int:
+    """
+    テーブル・列・インデックス・制約の定義から計算したバージョン（user_version に入る31ビットの整数）。
+    tables を渡すと、そのテーブルだけから計算する（シャードのファイルなど）。
+    """
+    parts = []
+    for table in sorted(metadata.tables.values() if tables is None else tables, key=lambda t: t.name):
+        parts.append(table.name)
+        parts += [f"{c.name}:{c.type}:{c.nullable}:{c.primary_key}" for c in table.columns]
+        parts += sorted(f"{i.name}:{[str(e) for e in i.expressions]}:{i.unique}" for i in table.indexes)
+        parts += sorted(f"{c.name}:{[col.name for col in c.columns]}" for c in table.constraints if c.name)
+    return zlib.crc32("|".join(parts).encode()) & 0x7FFFFFFF
+
+# データベースエンジンを作成（engine が書き込み用、read_engine が読み取り専用）
+if READ_ENGINE not in READ_ENGINE_MODES:
+    raise ValueError(f"FOOD_LOSS_DB_READ_ENGINE に指定できない値です: {READ_ENGINE} (指定可能: {list(READ_ENGINE_MODES)})")
+engine = create_db_engine()
+read_engine = create_db_engine(READ_DATABASE_URL, READ_ENGINE_PROFILE, read_only=True) if READ_ENGINE == "on" else engine
 
 # データベースセッションを作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
-def get_db():
-    db = SessionLocal()
+# --- 読み取り・書き込みの振り分け ---
+# サービス関数は @reads / @writes でどちらのエンジンが必要かを宣言します。
+# get_db / get_request_db に呼び出すサービス関数を渡すと、全てが @reads なら読み取り専用のセッションを返すので、
+# 読み取りだけのページが書き込み用の接続（コミットのたびに直列化される）を待つことはありません。
+# 宣言のない関数は書き込みとして扱います。
+READ = "read"
+WRITE = "write"
+
+def reads(func):
+    """DBを読むだけのサービス関数であることを宣言する。"""
+    func.db_access = READ
+    return func
+
+def writes(func):
+    """DBに書き込むサービス関数であることを宣言する。"""
+    func.db_access = WRITE
+    return func
+
+def access_for(*services) -> str:
+    """呼び出すサービス関数の組に必要なアクセス（全てが @reads なら READ、それ以外は WRITE）を返す。"""
+    if services and all(getattr(service, "db_access", WRITE) == READ for service in services):
+        return READ
+    return WRITE
+
+def session_factory(access: str = WRITE) -> sessionmaker:
+    """アクセスに応じたセッションの作成元を返す。"""
+    return ReadSessionLocal if access == READ else SessionLocal
+
+def get_db(*services):
+    db = session_factory(access_for(*services))()
     try:
         yield db
     finally:
         db.close()
 
-def init_db():
+# loss_reasons の初期データ
+DEFAULT_LOSS_REASONS = ["期限切れ", "食べ残し", "傷んだ", "調理失敗", "買いすぎ"]
+
+def seed_loss_reasons(db) -> bool:
+    """
+    loss_reasons が空なら初期データを投入する。
+    init_db のほか、ベンチマーク用DBなど別エンジンのセッションからも使う。
+
+    Returns:
+        投入した場合は True
+    """
+    if db.query(LossReason).first():
+        return False
+    db.add_all([LossReason(reason_text=text) for text in DEFAULT_LOSS_REASONS])
+    db.commit()
+    reason_registry.invalidate()
+    return True
+
+def init_db(bootstrap: str = SCHEMA_BOOTSTRAP) -> bool:
+    """
+    スキーマを用意して初期データを投入する。
+    bootstrap="auto" なら、DBに記録されたスキーマのバージョンが現在のモデル定義と一致するときは何もしない。
+    bootstrap="skip" なら、DBに触れずに何もしない。
+
+    Returns:
+        スキーマの作成・確認を行った場合は True（省いた場合は False）
+    """
+    if bootstrap not in SCHEMA_BOOTSTRAP_MODES:
+        raise ValueError(f"FOOD_LOSS_SCHEMA_BOOTSTRAP に指定できない値です: {bootstrap} (指定可能: {list(SCHEMA_BOOTSTRAP_MODES)})")
+    if bootstrap == "skip":
+        return False
+
     # データベースディレクトリが存在しなければ作成
     db_dir = os.path.dirname(DATABASE_PATH)
     if not os.path.exists(db_dir):
         os.makedirs(db_dir)
         
+    print(describe_engine(engine))
+    version = schema_version()
+    if bootstrap == "auto":
+        with engine.connect() as conn:
+            if conn.exec_driver_sql("PRAGMA user_version").scalar() == version:
+                print(f"Database schema is up to date (version {version}).")
+                if read_engine is not engine:
+                    print(describe_engine(read_engine, READ_ENGINE_PROFILE))
+                return False
+
     Base.metadata.create_all(bind=engine)
+    # 既存DBに後から追加された列・インデックスを反映（データのバックフィルは migrations.py で実行）
+    added_columns = ensure_record_time_columns(engine)
+    if added_columns:
+        print(f"Added columns to food_loss_records: {added_columns}. Run 'python migrations.py backfill'.")
     print("Database tables created successfully!")
 
     # 初期データを投入
     db = SessionLocal()
     try:
         # loss_reasonsテーブルに初期データがなければ追加
-        if not db.query(LossReason).first():
-            reasons = [
-                LossReason(reason_text="期限切れ"),
-                LossReason(reason_text="食べ残し"),
-                LossReason(reason_text="傷んだ"),
-                LossReason(reason_text="調理失敗"),
-                LossReason(reason_text="買いすぎ")
-            ]
-            db.add_all(reasons)
-            db.commit()
+        if seed_loss_reasons(db):
             print("Loss reasons added.")
+        # 集計テーブルを後から追加した既存DBでは、記録から作り直す必要がある
+        if rollups_need_rebuild(db):
+            print("Rollup tables are empty. Run 'python migrations.py rollups'.")
     finally:
         db.close()
 
+    # 次回以降の起動ではここまでを省く
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+    # 読み取り専用の接続は DB ファイルができてからでないと開けないので、ここで確認する
+    if read_engine is not engine:
+        print(describe_engine(read_engine, READ_ENGINE_PROFILE))
+    return True
+
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
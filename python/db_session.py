@@ -0,0 +1,142 @@
+# db_session.py
+"""
+リクエスト単位のDBセッション管理と、コネクションプールの計測。
+
+ルートでは get_request_db() を呼ぶだけでセッションが手に入ります。
+呼び出すサービス関数を get_request_db(get_weekly_stats) のように渡すと、全てが @reads の場合は
+読み取り専用エンジンのセッションになります（database.py の「読み取り・書き込みの振り分け」を参照）。
+シャーディング中（sharding.py）は、ログイン中のユーザーの記録があるシャードのセッションになります。
+ログインしていないリクエストのセッションは共通のDBだけを使うので、記録のテーブルには触れないでください。
+セッションは最初に呼ばれたときに作られ（DBを使わないページでは作られない）、
+リクエストの終わりに必ずロールバック（未コミット分があれば）してから閉じられます。
+"""
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from flask import Flask, g, has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import READ, access_for, engine, read_engine, session_factory
+from request_log import get_logger
+from sharding import shard_for, shards
+
+logger = get_logger("db")
+
+# 1リクエストが接続を握り続けてよい時間（ミリ秒）。超えると警告を出す
+SLOW_CONNECTION_HOLD_MS = float(os.environ.get("FOOD_LOSS_DB_SLOW_HOLD_MS", "500"))
+
+# --- コネクションプールの計測 ---
+
+_stats_lock = threading.Lock()
+# エンジンごとの累計カウンタ
+_pool_counters: Dict[Engine, Dict[str, Any]] = {}
+
+def instrument_pool(target_engine: Engine) -> None:
+    """エンジンのプールにイベントリスナーを付け、貸し出し・返却の回数と保持時間を数える。"""
+    counters = _pool_counters[target_engine] = {
+        "checkouts": 0,
+        "checkins": 0,
+        "connects": 0,
+        "slow_holds": 0,
+        "max_hold_ms": 0.0,
+    }
+
+    @event.listens_for(target_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        with _stats_lock:
+            counters["connects"] += 1
+
+    @event.listens_for(target_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+        with _stats_lock:
+            counters["checkouts"] += 1
+
+    @event.listens_for(target_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        held_ms = (time.perf_counter() - checked_out_at) * 1000 if checked_out_at is not None else 0.0
+        with _stats_lock:
+            counters["checkins"] += 1
+            counters["max_hold_ms"] = max(counters["max_hold_ms"], round(held_ms, 2))
+            if held_ms > SLOW_CONNECTION_HOLD_MS:
+                counters["slow_holds"] += 1
+        if held_ms > SLOW_CONNECTION_HOLD_MS:
+            # 返却のたびに通る経路なので、書き出しはログのキューに任せる
+            logger.warning("slow_connection_hold", extra={"fields": {
+                "held_ms": round(held_ms, 2),
+                "threshold_ms": SLOW_CONNECTION_HOLD_MS,
+                "engine": target_engine.url.database,
+                "where": f"{request.method} {request.path}" if has_request_context() else "background",
+            }})
+
+def pool_stats(target_engine: Engine = engine) -> Dict[str, Any]:
+    """現在のプールの状態と累計カウンタを返す。"""
+    pool = target_engine.pool
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_pool_counters.get(target_engine, {}))
+    stats["pool"] = type(pool).__name__
+    if hasattr(pool, "checkedout"):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            # プールの既定サイズを超えて貸し出している接続数（負の値は未作成の枠）
+            "overflow": pool.overflow(),
+        })
+    return stats
+
+instrument_pool(engine)
+if read_engine is not engine:
+    instrument_pool(read_engine)
+if len(shards) > 1:
+    for _shard in shards:
+        instrument_pool(_shard.engine)
+
+def read_pool_stats() -> Dict[str, Any]:
+    """読み取り専用エンジンのプールの状態を返す。"""
+    return pool_stats(read_engine)
+
+def shard_pool_stats() -> Dict[str, Any]:
+    """シャードごとの書き込み用プールの状態を shard{番号}_{項目} の形で返す。"""
+    return {
+        f"shard{shard.index}_{key}": value
+        for shard in shards
+        for key, value in pool_stats(shard.engine).items()
+    }
+
+# --- リクエスト単位のセッション ---
+
+def get_request_db(*services) -> Session:
+    """
+    現在のリクエスト用のセッションを返す（初回呼び出し時に作成する）。
+    services（このセッションで呼ぶサービス関数）が全て @reads なら読み取り専用のセッション、
+    省略時や書き込みを含む場合は書き込み用のセッションを返す。
+    """
+    access = access_for(*services)
+    key = "read_db" if access == READ else "db"
+    if key not in g:
+        user_id = session.get("user_id")
+        factory = shard_for(user_id).session_factory(access) if user_id is not None else session_factory(access)
+        setattr(g, key, factory())
+    return g.get(key)
+
+def _close_request_db(exception=None) -> None:
+    for key in ("db", "read_db"):
+        db = g.pop(key, None)
+        if db is None:
+            continue
+        try:
+            # コミットされずに残った変更（例外で抜けた場合など）は必ず捨てる
+            db.rollback()
+        finally:
+            db.close()
+
+def init_app(app: Flask) -> None:
+    """アプリにセッションの後始末を登録する。"""
+    # teardown_request はリクエストコンテキストが残っている間に呼ばれるので、警告にパスを出せる
+    app.teardown_request(_close_request_db)
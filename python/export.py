@@ -0,0 +1,162 @@
+# export.py
+"""
+廃棄記録のエクスポート（分析担当者へのデータ受け渡し用）。
+
+food_loss_records を yield_per でサーバー側カーソルから少しずつ読み（廃棄理由のテキストはレジストリから引く）、
+CSV または NDJSON（1行1 JSON）を逐次書き出します。必要なら gzip で圧縮します。
+全件をメモリに載せないので、1千行でも5千万行でもメモリ使用量は変わりません。
+
+使い方:
+    python export.py --format csv --output records.csv
+    python export.py --format ndjson --gzip --output records.ndjson.gz
+    python export.py --user-id 3 --format csv              # 1ユーザー分を標準出力へ
+    python export.py --db /tmp/load_test.db --format csv --gzip --output all.csv.gz
+
+--db を省略すると、シャーディング中（FOOD_LOSS_SHARDS > 1）は全シャードの記録をシャード順に出力します。
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import zlib
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import READ, READ_ENGINE_PROFILE, create_db_engine, reads
+from models import FoodLossRecord
+from reason_registry import reason_registry
+
+EXPORT_FORMATS = ("csv", "ndjson")
+
+# 出力する列（CSV のヘッダー、NDJSON のキー）
+EXPORT_COLUMNS = ("id", "user_id", "record_date", "item_name", "weight_grams", "reason")
+
+# サーバー側カーソルから1回に取り出す行数
+DEFAULT_CHUNK_SIZE = 10_000
+
+@reads
+def iter_export_rows(db: Session, user_id: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[Any, ...]]:
+    """記録を id 順に EXPORT_COLUMNS の並びのタプルで返す（user_id 省略時は、このセッションのDBにいる全ユーザー）。"""
+    query = db.query(
+            FoodLossRecord.id,
+            FoodLossRecord.user_id,
+            FoodLossRecord.record_date,
+            FoodLossRecord.item_name,
+            FoodLossRecord.weight_grams,
+            FoodLossRecord.loss_reason_id,
+        )
+    if user_id is not None:
+        query = query.filter(FoodLossRecord.user_id == user_id)
+    # yield_per で chunk_size 行ずつ取り出し、ORM に全件を溜め込ませない
+    for *columns, reason_id in query.order_by(FoodLossRecord.id).yield_per(chunk_size):
+        yield (*columns, reason_registry.text_for(db, reason_id))
+
+def iter_csv(rows: Iterable[Tuple[Any, ...]], rows_per_chunk: int = 1000) -> Iterator[str]:
+    """行をヘッダー付きの CSV にして、rows_per_chunk 行ごとの文字列で返す。"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+def iter_ndjson(rows: Iterable[Tuple[Any, ...]], rows_per_chunk: int = 1000) -> Iterator[str]:
+    """行を1行1つの JSON オブジェクトにして、rows_per_chunk 行ごとの文字列で返す。"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """バイト列のチャンクを gzip 形式で逐次圧縮する。"""
+    # wbits=31 で gzip のヘッダー・トレーラー付きになる
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@reads
+def iter_export(db: Session, fmt: str = "csv", compress: bool = False, user_id: Optional[int] = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    エクスポートの本体。HTTP レスポンスやファイルにそのまま流せるバイト列のチャンクを返す。
+
+    Raises:
+        ValueError: fmt が EXPORT_FORMATS に無い場合
+    """
+    return encode_export(iter_export_rows(db, user_id, chunk_size), fmt, compress)
+
+def encode_export(rows: Iterable[Tuple[Any, ...]], fmt: str = "csv", compress: bool = False) -> Iterator[bytes]:
+    """
+    行を fmt の形式のバイト列のチャンクにする（compress なら gzip で圧縮する）。
+
+    Raises:
+        ValueError: fmt が EXPORT_FORMATS に無い場合
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format は {', '.join(EXPORT_FORMATS)} のいずれかです: {fmt}")
+    text_chunks = iter_csv(rows) if fmt == "csv" else iter_ndjson(rows)
+    chunks = (chunk.encode("utf-8") for chunk in text_chunks)
+    return iter_gzip(chunks) if compress else chunks
+
+def export_filename(fmt: str, compress: bool, user_id: Optional[int] = None) -> str:
+    """ダウンロード時のファイル名を返す。"""
+    name = f"food_loss_records_user{user_id}" if user_id is not None else "food_loss_records"
+    return f"{name}.{fmt}" + (".gz" if compress else "")
+
+def main():
+    parser = argparse.ArgumentParser(description="廃棄記録のエクスポート")
+    parser.add_argument("--db", default=None, help="読み出す SQLite ファイル（既定は db/food_loss.db と全シャード）")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv", help="出力形式")
+    parser.add_argument("--user-id", type=int, default=None, help="1ユーザー分だけ出力する（省略時は全ユーザー）")
+    parser.add_argument("--output", default=None, help="出力先ファイル（省略時は標準出力）")
+    parser.add_argument("--gzip", action="store_true", help="gzip で圧縮する")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="カーソルから1回に取り出す行数")
+    args = parser.parse_args()
+
+    engine = None
+    if args.db is not None:
+        engine = create_db_engine(f"sqlite:///file:{args.db}?mode=ro&uri=true", READ_ENGINE_PROFILE, read_only=True)
+        sessions = [Session(engine)]
+    else:
+        import sharding
+        if args.user_id is not None:
+            sessions = [sharding.session_for_user(args.user_id, READ)]
+        else:
+            sessions = [shard.session_factory(READ)() for shard in sharding.shards]
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    written = 0
+    try:
+        rows = itertools.chain.from_iterable(
+            iter_export_rows(db, args.user_id, args.chunk_size) for db in sessions
+        )
+        for chunk in encode_export(rows, args.format, args.gzip):
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if args.output:
+            out.close()
+        for db in sessions:
+            db.close()
+        if engine is not None:
+            engine.dispose()
+    print(f"Exported {written:,} bytes ({args.format}{', gzip' if args.gzip else ''})", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
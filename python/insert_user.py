@@ -1,76 +1,209 @@
-# insert_test_data.py
+# insert_user.py
+"""
+開発・負荷試験用の合成データ生成ツール。
 
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, User, LossReason, FoodLossRecord # 必要なモデルをインポート
+N 人のユーザーと、1人あたり M 件の廃棄記録を生成して投入します。
+曜日ごとの偏り（週末に多い）、食事の時間帯、品目ごとの典型的な重量、
+seed 済みの loss_reasons から選ぶ廃棄理由、数か月にわたる日付の分布を再現します。
+同じ seed なら同じデータが生成されます。
+既定の db/food_loss.db に投入する場合、シャーディング中（FOOD_LOSS_SHARDS > 1）は記録と集計を
+各ユーザーのシャードのファイルに入れます（--db で別のファイルを指定した場合は、そのファイルに全て入れます）。
+
+使い方:
+    python insert_user.py                                   # test_user + 100人 × 200件
+    python insert_user.py --users 10000 --records-per-user 500 --months 12 --seed 7
+    python insert_user.py --db /tmp/load_test.db --users 100000 --records-per-user 100
+"""
+import argparse
 import datetime
 import hashlib
+import os
+import random
+import time
+from contextlib import ExitStack
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from database import DATABASE_PATH, create_db_engine, seed_loss_reasons
+from migrations import ensure_record_time_columns
+from models import Base, User, LossReason, FoodLossRecord, day_key_of, week_key_of # 必要なモデルをインポート
+from rollups import rebuild_rollups
+from sharding import init_shards, shard_index, shards
 
-# --- データベース接続設定 (database.pyと同じロジックを使用) ---
-# os.path.dirname(__file__) は現在のファイルのディレクトリ (例: C:/.../social-implementation/python)
-# os.path.dirname(os.path.dirname(__file__)) で一つ上の親ディレクトリ (例: C:/.../social-implementation) に移動
-PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
-DATABASE_PATH = os.path.join(PROJECT_ROOT, 'db', 'food_loss.db')
-DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
-
-# データベースエンジンとセッションを作成
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-
-def add_test_data():
-    session = Session()
-    try:
-        # 1. ユーザーの取得または作成 (今回は既存の'test_user'を使用)
-        test_user = session.query(User).filter_by(username="test_user").first()
-        
-        if not test_user:
-            # もしユーザーが存在しなければ新規作成
-            hashed_password = hashlib.sha256("testpass".encode()).hexdigest()
-            test_user = User(
-                username="test_user", 
-                password=hashed_password, 
-                email="test@example.com"
-            )
-            session.add(test_user)
-            session.commit()
-            print("Test user created.")
-
-        # 2. 廃棄理由（「期限切れ」）のIDを取得
-        # ※ init_db()で初期データが投入されていることを前提とします
-        expired_reason = session.query(LossReason).filter_by(reason_text="期限切れ").first()
-        eaten_reason = session.query(LossReason).filter_by(reason_text="食べ残し").first()
-        
-        if not expired_reason or not eaten_reason:
-            print("Error: Loss reasons not found. Please run database initialization.")
-            return
-
-        # 3. 新しいフードロス記録を作成
-        record1 = FoodLossRecord(
-            user_id=test_user.id,
-            item_name="牛乳 (期限切れ)",
-            weight_grams=1000.0,
-            loss_reason_id=expired_reason.id
-            # record_dateはモデルのdefault設定により自動挿入される
-        )
-        
-        record2 = FoodLossRecord(
-            user_id=test_user.id,
-            item_name="カレーの食べ残し",
-            weight_grams=350.5,
-            loss_reason_id=eaten_reason.id
-        )
-
-        # 4. セッションに追加し、コミット
-        session.add_all([record1, record2])
+# --- 分布の定義 ---
+
+# (品目名, 典型的な重量[g]) — 重量はこの値を中心にばらつかせる
+ITEMS: List[Tuple[str, float]] = [
+    ("牛乳", 400.0), ("食パン", 120.0), ("ご飯", 150.0), ("カレー", 250.0), ("味噌汁", 180.0),
+    ("サラダ", 80.0), ("キャベツ", 200.0), ("にんじん", 90.0), ("バナナ", 100.0), ("りんご", 150.0),
+    ("ヨーグルト", 100.0), ("豆腐", 150.0), ("納豆", 45.0), ("卵", 60.0), ("鶏肉", 200.0),
+    ("豚肉", 180.0), ("焼き魚", 120.0), ("おにぎり", 110.0), ("パスタ", 220.0), ("弁当の残り", 160.0),
+]
+
+# 曜日ごとの記録の出やすさ（月〜日）。買い出し後や外食の多い週末に廃棄が増える想定
+WEEKDAY_WEIGHTS = [1.0, 0.9, 0.9, 1.0, 1.2, 1.5, 1.6]
+
+# 記録される時刻帯（開始時, 終了時, 重み）— 朝食・昼食・夕食・片付け
+MEAL_WINDOWS = [(7, 9, 0.2), (12, 14, 0.25), (18, 21, 0.45), (21, 23, 0.1)]
+
+# 廃棄理由ごとの重み（seed 済みの理由の並び順に対応。足りない分は 1.0）
+REASON_WEIGHTS = [0.35, 0.25, 0.2, 0.1, 0.1]
+
+# --- 生成 ---
+
+def ensure_test_user(session) -> int:
+    """ログイン確認用の test_user が無ければ作成し、そのIDを返す。"""
+    test_user = session.query(User).filter_by(username="test_user").first()
+    if not test_user:
+        hashed_password = hashlib.sha256("testpass".encode()).hexdigest()
+        test_user = User(username="test_user", password=hashed_password, email="test@example.com")
+        session.add(test_user)
         session.commit()
-        print("Food loss test data added successfully for test_user!")
-        
-    except Exception as e:
-        session.rollback()
-        print(f"Error adding test data: {e}")
-    finally:
-        session.close()
+        print("Test user created.")
+    return test_user.id
+
+def _record_rows(rng: random.Random, user_id: int, count: int, days: List[datetime.date],
+                 day_weights: List[float], reason_ids: List[int], reason_weights: List[float]) -> List[dict]:
+    """1ユーザー分の記録行（Core の INSERT に渡す辞書）を作る。"""
+    picked_days = rng.choices(days, weights=day_weights, k=count)
+    picked_windows = rng.choices(MEAL_WINDOWS, weights=[w for _, _, w in MEAL_WINDOWS], k=count)
+    picked_items = rng.choices(ITEMS, k=count)
+    picked_reasons = rng.choices(reason_ids, weights=reason_weights, k=count)
+
+    rows = []
+    for day, (start_hour, end_hour, _), (item_name, typical_grams), reason_id in zip(
+            picked_days, picked_windows, picked_items, picked_reasons):
+        seconds = rng.randrange(start_hour * 3600, end_hour * 3600)
+        recorded_at = datetime.datetime(day.year, day.month, day.day, seconds // 3600, seconds // 60 % 60, seconds % 60)
+        rows.append({
+            "user_id": user_id,
+            "item_name": item_name,
+            # 典型値の 30%〜150% の範囲で、少なめの量が多くなるようにばらつかせる
+            "weight_grams": round(typical_grams * rng.triangular(0.3, 1.5, 0.6), 1),
+            "loss_reason_id": reason_id,
+            "record_date": recorded_at.isoformat(),
+            "recorded_at": recorded_at,
+            "day_key": day_key_of(recorded_at),
+            "week_key": week_key_of(recorded_at),
+        })
+    return rows
+
+def generate(database_path: str, users: int, records_per_user: int, months: int, seed: int,
+             chunk_size: int = 50_000, transaction_rows: int = 1_000_000, with_rollups: bool = True) -> dict:
+    """
+    ユーザーと記録を生成して database_path に投入する。
+
+    記録は chunk_size 行ずつ Core の executemany で挿入し、
+    transaction_rows 行ごとにコミットする（大きなトランザクションで fsync の回数を抑える）。
+
+    Returns:
+        投入件数と所要時間
+    """
+    engine = create_db_engine(f"sqlite:///{database_path}")
+    Base.metadata.create_all(bind=engine)
+    ensure_record_time_columns(engine)
+    # アプリが読むのと同じ場所に入れる（記録と集計はユーザーのシャード、ユーザーは共通のDB）
+    if os.path.abspath(database_path) == os.path.abspath(DATABASE_PATH) and len(shards) > 1:
+        init_shards(bootstrap="auto")
+        record_engines = [shard.engine for shard in shards]
+    else:
+        record_engines = [engine]
+
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        seed_loss_reasons(session)
+        ensure_test_user(session)
+        reason_ids = [reason_id for (reason_id,) in session.query(LossReason.id).order_by(LossReason.id)]
+        first_user_id = (session.scalar(select(func.max(User.id))) or 0) + 1
+
+    rng = random.Random(seed)
+    reason_weights = [REASON_WEIGHTS[i] if i < len(REASON_WEIGHTS) else 1.0 for i in range(len(reason_ids))]
+    today = datetime.date.today()
+    days = [today - datetime.timedelta(days=offset) for offset in range(months * 30)]
+    day_weights = [WEEKDAY_WEIGHTS[day.weekday()] for day in days]
+    # seed が同じなら同じデータになるよう、パスワードは固定値のハッシュ
+    password = hashlib.sha256(f"synthetic-{seed}".encode()).hexdigest()
+
+    started = time.perf_counter()
+    inserted = 0
+    with ExitStack() as stack:
+        conn = stack.enter_context(engine.connect())
+        record_conns = [conn if record_engine is engine else stack.enter_context(record_engine.connect())
+                        for record_engine in record_engines]
+        # 生成データの投入なので、コミットごとの fsync は省く
+        for record_conn in {conn, *record_conns}:
+            record_conn.exec_driver_sql("PRAGMA synchronous=OFF")
+            record_conn.commit()
+
+        user_ids = list(range(first_user_id, first_user_id + users))
+        for start in range(0, users, chunk_size):
+            conn.execute(insert(User.__table__), [
+                {"id": user_id, "username": f"synthetic_{seed}_{user_id}", "password": password,
+                 "email": f"synthetic_{seed}_{user_id}@example.com", "total_points": 0}
+                for user_id in user_ids[start:start + chunk_size]
+            ])
+        conn.commit()
+
+        # シャードごとに chunk_size 行たまったら挿入する
+        pending: Dict[int, List[dict]] = {index: [] for index in range(len(record_conns))}
+        uncommitted = 0
+        for user_id in user_ids:
+            index = shard_index(user_id, len(record_conns))
+            pending[index].extend(_record_rows(rng, user_id, records_per_user, days, day_weights, reason_ids, reason_weights))
+            if len(pending[index]) >= chunk_size:
+                record_conns[index].execute(insert(FoodLossRecord.__table__), pending[index])
+                inserted += len(pending[index])
+                uncommitted += len(pending[index])
+                pending[index] = []
+                if uncommitted >= transaction_rows:
+                    for record_conn in record_conns:
+                        record_conn.commit()
+                    uncommitted = 0
+                    elapsed = time.perf_counter() - started
+                    print(f"Inserted {inserted} records ({inserted / elapsed * 60:,.0f} rows/min)")
+        for index, rows in pending.items():
+            if rows:
+                record_conns[index].execute(insert(FoodLossRecord.__table__), rows)
+                inserted += len(rows)
+        for record_conn in {conn, *record_conns}:
+            record_conn.commit()
+    elapsed = time.perf_counter() - started
+
+    if with_rollups:
+        for record_engine in record_engines:
+            rebuild_rollups(record_engine)
+    for record_engine in {engine, *record_engines}:
+        record_engine.dispose()
+
+    return {
+        "users": users,
+        "records": inserted,
+        "seconds": round(elapsed, 2),
+        "rows_per_minute": round(inserted / elapsed * 60) if elapsed > 0 else 0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="合成データの生成")
+    parser.add_argument("--db", default=DATABASE_PATH, help="投入先の SQLite ファイル（既定は db/food_loss.db）")
+    parser.add_argument("--users", type=int, default=100, help="生成するユーザー数")
+    parser.add_argument("--records-per-user", type=int, default=200, help="1ユーザーあたりの記録数")
+    parser.add_argument("--months", type=int, default=6, help="記録を散らばらせる期間（月）")
+    parser.add_argument("--seed", type=int, default=42, help="乱数の seed")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="1回の executemany で挿入する行数")
+    parser.add_argument("--transaction-rows", type=int, default=1_000_000, help="1トランザクションで挿入する行数")
+    parser.add_argument("--skip-rollups", action="store_true", help="投入後に集計テーブルを作り直さない")
+    args = parser.parse_args()
+
+    db_dir = os.path.dirname(os.path.abspath(args.db))
+    os.makedirs(db_dir, exist_ok=True)
+
+    report = generate(args.db, args.users, args.records_per_user, args.months, args.seed,
+                      chunk_size=args.chunk_size, transaction_rows=args.transaction_rows,
+                      with_rollups=not args.skip_rollups)
+    print(f"Generated {report['records']} records for {report['users']} users "
+          f"in {report['seconds']}s ({report['rows_per_minute']:,} rows/min)")
 
 if __name__ == "__main__":
-    add_test_data()
\ No newline at end of file
+    main()
@@ -0,0 +1,143 @@
+# leaderboard.py
+"""
+ポイントのランキング（上位K人の一覧と、自分の順位）。
+
+ポイントを持つ（0 でない）ユーザーの残高を user_id → 残高の辞書と、残高の昇順に並べたリストでメモリに持ち、
+順位は「自分より残高の多いユーザー数 + 1」を二分探索（bisect）で求めます（1回あたり O(log n)）。
+ポイントが 0 のユーザーは順位を持ちません（rank は None）。
+
+ポイントの増減は必ず points_ledger に追記されるので、points_ledger の最大ID（主キーの末尾を読むだけ）を
+版として持ち、版が進んだときは前回の版より後の台帳の行だけを読んで残高とリストを更新します。
+変わったユーザーが多い場合（週次ポイントの一括付与の直後など）や版が戻った場合は、users から読み直します。
+期首残高（opening_balance）の記帳は users.total_points を変えないので、差分には含めません。
+各プロセスのメモリはポイントを持つユーザーの数に比例します。
+
+台帳を通さずに users.total_points を書き換えた場合（points_ledger.py rebuild など）は、
+leaderboard.invalidate() を呼ぶかプロセスを再起動してください。
+"""
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from database import reads
+from models import PointsLedgerEntry, User
+from points_ledger import OPENING_BALANCE
+
+# キャッシュする上位の人数（/api/leaderboard の limit の上限）
+TOP_K = int(os.environ.get("FOOD_LOSS_LEADERBOARD_TOP_K", "100"))
+
+class Leaderboard:
+    """ポイントを持つユーザーの残高と上位K人を、points_ledger の版に合わせてキャッシュする。"""
+
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        # キャッシュを作った時点の台帳の最大ID（None なら未読み込み）
+        self._version: Optional[int] = None
+        # user_id → 残高（0 のユーザーは持たない）
+        self._points: Dict[int, int] = {}
+        # _points の値を昇順に並べたもの
+        self._sorted_points: List[int] = []
+        self._top: Optional[List[Dict[str, Any]]] = None
+
+    def invalidate(self) -> None:
+        """キャッシュを破棄する。次のアクセスで users テーブルから読み直される。"""
+        with self._lock:
+            self._version = None
+
+    def _ledger_version(self, db: Session) -> int:
+        return db.scalar(select(func.max(PointsLedgerEntry.id))) or 0
+
+    def _reload(self, db: Session) -> None:
+        self._points = dict(db.execute(select(User.id, User.total_points).where(User.total_points != 0)).all())
+        self._sorted_points = sorted(self._points.values())
+
+    def _apply_delta(self, user_id: int, delta: int) -> None:
+        old = self._points.get(user_id, 0)
+        new = old + delta
+        if old:
+            del self._sorted_points[bisect_left(self._sorted_points, old)]
+        if new:
+            insort(self._sorted_points, new)
+            self._points[user_id] = new
+        else:
+            self._points.pop(user_id, None)
+
+    def _sync(self, db: Session) -> None:
+        """
+        台帳が前回から増えていれば、増えた分を残高に反映する（呼び出し側でロックを持つこと）。
+        版と差分は同じトランザクション（同じスナップショット）で読むので、取りこぼしは起きない。
+        """
+        version = self._ledger_version(db)
+        if version == self._version:
+            return
+        if self._version is None or version < self._version:
+            self._reload(db)
+        else:
+            deltas = db.execute(
+                select(PointsLedgerEntry.user_id, func.sum(PointsLedgerEntry.delta))
+                .where(PointsLedgerEntry.id > self._version, PointsLedgerEntry.id <= version)
+                .where(PointsLedgerEntry.reason != OPENING_BALANCE)
+                .group_by(PointsLedgerEntry.user_id)
+            ).all()
+            # リストの挿入・削除は1件ごとに要素をずらすので、大量に変わったときは並べ直したほうが速い
+            if len(deltas) > max(1000, len(self._points) // 8):
+                self._reload(db)
+            else:
+                for user_id, delta in deltas:
+                    if delta:
+                        self._apply_delta(user_id, delta)
+        self._top = None
+        self._version = version
+
+    def _rank_for(self, points: int) -> Optional[int]:
+        """残高 points のユーザーの順位（自分より多いユーザー数 + 1。同点は同順位。0 なら None）。"""
+        if not points:
+            return None
+        return len(self._sorted_points) - bisect_right(self._sorted_points, points) + 1
+
+    @reads
+    def top(self, db: Session, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        ポイントを持つユーザーの上位 limit 人を {rank, user_id, username, total_points} のリストで返す。
+
+        Raises:
+            ValueError: limit が 1〜top_k の範囲外の場合
+        """
+        if not 1 <= limit <= self.top_k:
+            raise ValueError(f"limit は 1 〜 {self.top_k} で指定してください。")
+        with self._lock:
+            self._sync(db)
+            if self._top is None:
+                rows = db.execute(
+                    select(User.id, User.username, User.total_points)
+                    .where(User.total_points != 0)
+                    .order_by(User.total_points.desc(), User.id)
+                    .limit(self.top_k)
+                ).all()
+                self._top = [
+                    {"rank": self._rank_for(points), "user_id": user_id, "username": username, "total_points": points}
+                    for user_id, username, points in rows
+                ]
+            return [dict(entry) for entry in self._top[:limit]]
+
+    @reads
+    def rank_of(self, db: Session, user_id: int) -> Dict[str, Any]:
+        """ユーザーの残高と順位を返す（ポイントが 0 のユーザーの rank は None）。"""
+        with self._lock:
+            self._sync(db)
+            points = self._points.get(user_id, 0)
+            return {
+                "user_id": user_id,
+                "total_points": points,
+                "rank": self._rank_for(points),
+                # ポイントを持っている（0 でない）ユーザーの数
+                "ranked_users": len(self._sorted_points),
+            }
+
+# アプリ全体で共有するランキング
+leaderboard = Leaderboard()
@@ -0,0 +1,210 @@
+# metrics.py
+"""
+アプリの計測（Prometheus のテキスト形式で /metrics に出力する）。
+
+- リクエストごとに、エンドポイント別のレイテンシのヒストグラムとステータスコード別の件数を記録します。
+- エンジンの before_cursor_execute / after_cursor_execute イベントで SQL の実行回数と時間を数え、
+  リクエストの中で実行されたものはそのリクエストのエンドポイントにも加算します。
+
+記録は数値の加算とロック1回だけなので、常時有効にしておけます。
+エンドポイントのラベルにはURLではなくルールの文字列（/api/add_loss_record/pending/<pending_id> など）を使い、
+どのルールにも一致しなかったリクエストは "unmatched" にまとめるので、系列の数は増え続けません。
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+
+from flask import Flask, Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from request_log import get_logger
+
+logger = get_logger("metrics")
+
+# レイテンシのヒストグラムの境界（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 1リクエストあたりのクエリ数のヒストグラムの境界
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Prometheus のテキスト形式の Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class Histogram:
+    """ラベルの組ごとに、境界ごとの件数・合計・件数を持つヒストグラム。"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        # [境界ごとの件数..., +Inf の件数, 合計]
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, name: str, label_names: Tuple[str, ...]) -> List[str]:
+        lines = []
+        for labels, series in sorted(self._series.items()):
+            base = ",".join(f'{key}="{value}"' for key, value in zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{base}}} {series[-1]:.6f}")
+            lines.append(f"{name}_count{{{base}}} {cumulative}")
+        return lines
+
+class Metrics:
+    """リクエストと SQL の計測値を保持する。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self._latency = Histogram(LATENCY_BUCKETS)
+        self._queries_per_request = Histogram(QUERY_COUNT_BUCKETS)
+        self._responses: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self._request_sql_seconds: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._sql_queries = 0
+        self._sql_seconds = 0.0
+        self._sql_errors = 0
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, Any]]]] = []
+
+    # --- 記録 ---
+
+    def observe_request(self, method: str, endpoint: str, status: int, seconds: float,
+                        sql_queries: int, sql_seconds: float) -> None:
+        labels = (method, endpoint)
+        with self._lock:
+            self._latency.observe(labels, seconds)
+            self._queries_per_request.observe(labels, sql_queries)
+            self._responses[(method, endpoint, str(status))] += 1
+            self._request_sql_seconds[labels] += sql_seconds
+
+    def observe_sql(self, seconds: float) -> None:
+        with self._lock:
+            self._sql_queries += 1
+            self._sql_seconds += seconds
+
+    def observe_sql_error(self) -> None:
+        with self._lock:
+            self._sql_errors += 1
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict[str, Any]]) -> None:
+        """
+        /metrics の出力時に呼ばれる関数を登録する。
+        返された辞書の数値の項目が food_loss_{prefix}_{キー} として出力される。
+        """
+        self._collectors.append((prefix, collect))
+
+    # --- 出力 ---
+
+    def render(self) -> str:
+        lines = [
+            "# HELP food_loss_process_start_time_seconds プロセスの起動時刻（UNIX 時間）",
+            "# TYPE food_loss_process_start_time_seconds gauge",
+            f"food_loss_process_start_time_seconds {self.started_at:.3f}",
+        ]
+        with self._lock:
+            lines += [
+                "# HELP food_loss_http_request_duration_seconds エンドポイント別のレイテンシ",
+                "# TYPE food_loss_http_request_duration_seconds histogram",
+                *self._latency.render("food_loss_http_request_duration_seconds", ("method", "endpoint")),
+                "# HELP food_loss_http_request_sql_queries エンドポイント別の1リクエストあたりの SQL 文の数",
+                "# TYPE food_loss_http_request_sql_queries histogram",
+                *self._queries_per_request.render("food_loss_http_request_sql_queries", ("method", "endpoint")),
+                "# HELP food_loss_http_responses_total エンドポイント・ステータスコード別のレスポンス数",
+                "# TYPE food_loss_http_responses_total counter",
+                *(f'food_loss_http_responses_total{{method="{method}",endpoint="{endpoint}",status="{status}"}} {count}'
+                  for (method, endpoint, status), count in sorted(self._responses.items())),
+                "# HELP food_loss_http_request_sql_seconds_total エンドポイント別の SQL 実行時間の合計",
+                "# TYPE food_loss_http_request_sql_seconds_total counter",
+                *(f'food_loss_http_request_sql_seconds_total{{method="{method}",endpoint="{endpoint}"}} {seconds:.6f}'
+                  for (method, endpoint), seconds in sorted(self._request_sql_seconds.items())),
+                "# HELP food_loss_sql_queries_total 実行された SQL 文の数（バックグラウンド処理を含む）",
+                "# TYPE food_loss_sql_queries_total counter",
+                f"food_loss_sql_queries_total {self._sql_queries}",
+                "# HELP food_loss_sql_seconds_total SQL の実行時間の合計（バックグラウンド処理を含む）",
+                "# TYPE food_loss_sql_seconds_total counter",
+                f"food_loss_sql_seconds_total {self._sql_seconds:.6f}",
+                "# HELP food_loss_sql_errors_total 失敗した SQL 文の数",
+                "# TYPE food_loss_sql_errors_total counter",
+                f"food_loss_sql_errors_total {self._sql_errors}",
+            ]
+        for prefix, collect in self._collectors:
+            try:
+                values = collect()
+            except Exception:
+                logger.exception("collector_failed", extra={"fields": {"collector": prefix}})
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE food_loss_{prefix}_{key} untyped")
+                lines.append(f"food_loss_{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+# アプリ全体で共有する計測値
+metrics = Metrics()
+
+# --- SQLAlchemy のイベント ---
+
+def instrument_engine(target_engine: Engine) -> None:
+    """エンジンで実行される SQL の回数と時間を数える。"""
+
+    @event.listens_for(target_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(target_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_started_at"].pop()
+        metrics.observe_sql(seconds)
+        if has_request_context() and "metrics_started_at" in g:
+            g.metrics_sql_queries += 1
+            g.metrics_sql_seconds += seconds
+
+    @event.listens_for(target_engine, "handle_error")
+    def _on_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started_at"):
+            connection.info["query_started_at"].pop()
+        metrics.observe_sql_error()
+
+# --- Flask のフック ---
+
+def _start_request() -> None:
+    g.metrics_started_at = time.perf_counter()
+    g.metrics_sql_queries = 0
+    g.metrics_sql_seconds = 0.0
+
+def _remember_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+def _finish_request(exception=None) -> None:
+    started_at = g.pop("metrics_started_at", None)
+    if started_at is None:
+        return
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    # 例外で抜けた場合は after_request が呼ばれないので 500 として数える
+    metrics.observe_request(
+        request.method, endpoint, g.pop("metrics_status", 500), time.perf_counter() - started_at,
+        g.metrics_sql_queries, g.metrics_sql_seconds,
+    )
+
+def init_app(app: Flask, target_engine: Engine) -> None:
+    """アプリにリクエストの計測フックと /metrics を登録し、エンジンの SQL を計測する。"""
+    instrument_engine(target_engine)
+    app.before_request(_start_request)
+    app.after_request(_remember_status)
+    # teardown_request はストリーミングのレスポンスを送り終えてから呼ばれるので、送信時間も含まれる
+    app.teardown_request(_finish_request)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        return Response(metrics.render(), content_type=CONTENT_TYPE)
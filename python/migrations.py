@@ -0,0 +1,140 @@
+# migrations.py
+"""
+既存の food_loss.db を現在のモデル定義に追従させるためのマイグレーション。
+
+使い方:
+    python migrations.py                  # 列・インデックスの追加、バックフィル、集計の再構築をまとめて実行
+    python migrations.py backfill --chunk-size 5000 --pause 0.05
+    python migrations.py rollups          # user_day_totals / user_week_totals を記録テーブルから作り直す
+    python migrations.py ledger           # 台帳導入前のポイントを points_ledger に期首残高として記帳する
+
+バックフィルは小さなトランザクションに分けてコミットするため、
+アプリを停止せずに（書き込みを受け付けたまま）実行できます。
+"""
+import argparse
+import datetime
+import time
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from models import FoodLossRecord, User, day_key_of, week_key_of
+
+# food_loss_records に後から追加された列 (列名, SQLiteの型)
+RECORD_TIME_COLUMNS = [
+    ("recorded_at", "DATETIME"),
+    ("day_key", "INTEGER"),
+    ("week_key", "INTEGER"),
+]
+
+def ensure_record_time_columns(engine: Engine) -> list[str]:
+    """
+    food_loss_records に日時関連の列と、food_loss_records・users のインデックスが無ければ追加する。
+    ALTER TABLE ADD COLUMN は既存行を書き換えないため、大きなテーブルでも一瞬で終わります。
+
+    Returns:
+        追加した列名のリスト
+    """
+    existing = {col["name"] for col in inspect(engine).get_columns(FoodLossRecord.__tablename__)}
+    added = []
+    with engine.begin() as conn:
+        for name, sql_type in RECORD_TIME_COLUMNS:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {FoodLossRecord.__tablename__} ADD COLUMN {name} {sql_type}"))
+                added.append(name)
+        for index in (*FoodLossRecord.__table__.indexes, *User.__table__.indexes):
+            index.create(bind=conn, checkfirst=True)
+    return added
+
+def backfill_record_time_columns(engine: Engine, chunk_size: int = 5000, pause: float = 0.0) -> int:
+    """
+    record_date（ISO 8601 文字列）から recorded_at / day_key / week_key を埋める。
+    id 順に chunk_size 行ずつ処理し、チャンクごとにコミットして書き込みロックをすぐに手放す。
+    途中で止めても、再実行すれば未処理の行（day_key が NULL の行）から再開します。
+    record_date を日時として読めない行は飛ばし（day_key は NULL のまま）、最後にその id を表示します。
+
+    Returns:
+        更新した行数
+    """
+    table = FoodLossRecord.__tablename__
+    select_chunk = text(
+        f"SELECT id, record_date FROM {table} "
+        f"WHERE id > :last_id AND day_key IS NULL ORDER BY id LIMIT :limit"
+    )
+    update_row = text(
+        f"UPDATE {table} SET recorded_at = :recorded_at, day_key = :day_key, week_key = :week_key "
+        f"WHERE id = :id"
+    )
+
+    last_id = 0
+    updated = 0
+    skipped_ids = []
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select_chunk, {"last_id": last_id, "limit": chunk_size}).all()
+            if not rows:
+                break
+            params = []
+            for row_id, record_date in rows:
+                try:
+                    recorded_at = datetime.datetime.fromisoformat(record_date)
+                except (TypeError, ValueError):
+                    # 1行の不正な値でバックフィル全体を止めない
+                    skipped_ids.append(row_id)
+                    continue
+                params.append({
+                    "id": row_id,
+                    # DateTime 列と同じ 'YYYY-MM-DD HH:MM:SS.ffffff' 形式で保存する
+                    "recorded_at": recorded_at.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                    "day_key": day_key_of(recorded_at),
+                    "week_key": week_key_of(recorded_at),
+                })
+            if params:
+                conn.execute(update_row, params)
+        last_id = rows[-1][0]
+        updated += len(params)
+        print(f"Backfilled {updated} rows (last id: {last_id})")
+        if pause:
+            # 他のワーカーの書き込みが割り込めるよう、チャンク間で少し待つ
+            time.sleep(pause)
+    if skipped_ids:
+        print(f"Skipped {len(skipped_ids)} rows with an unreadable record_date (ids: {skipped_ids})")
+    return updated
+
+def main():
+    from database import engine
+    from sharding import shards
+
+    parser = argparse.ArgumentParser(description="food_loss.db のマイグレーション")
+    parser.add_argument("command", nargs="?", default="all", choices=["all", "schema", "backfill", "rollups", "ledger"])
+    parser.add_argument("--chunk-size", type=int, default=5000, help="1トランザクションで更新する行数")
+    parser.add_argument("--pause", type=float, default=0.0, help="チャンク間の待ち時間（秒）")
+    args = parser.parse_args()
+
+    # 記録と集計テーブルはシャードごとのファイルにある（シャード数1なら共通のDB）
+    record_engines = [shard.engine for shard in shards]
+
+    if args.command in ("all", "schema"):
+        # シャードのファイルは init_shards が現在のモデル定義で作るので、列の追加が要るのは共通のDBだけ
+        added = ensure_record_time_columns(engine)
+        print(f"Schema is up to date (added columns: {added or 'none'})")
+    if args.command in ("all", "backfill"):
+        total = sum(
+            backfill_record_time_columns(record_engine, chunk_size=args.chunk_size, pause=args.pause)
+            for record_engine in record_engines
+        )
+        print(f"Backfill finished: {total} rows updated.")
+    if args.command in ("all", "rollups"):
+        from rollups import rebuild_rollups
+        total = sum(rebuild_rollups(record_engine) for record_engine in record_engines)
+        print(f"Rollups rebuilt: {total} daily rows.")
+    if args.command in ("all", "ledger"):
+        from database import SessionLocal
+        from models import PointsLedgerEntry
+        from points_ledger import record_opening_balances
+        PointsLedgerEntry.__table__.create(bind=engine, checkfirst=True)
+        with SessionLocal() as db:
+            print(f"Opening balances recorded for {record_opening_balances(db)} users.")
+
+if __name__ == "__main__":
+    main()
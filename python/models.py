@@ -1,12 +1,59 @@
 # models.py
 import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, REAL, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, REAL, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base 
 
 # データベースモデルの基底クラスを定義します
 Base = declarative_base()
 
+# --- 日付キーのヘルパー ---
+# day_key は date.toordinal() の値（0001-01-01 を 1 とする通し日数）です。
+# 0001-01-01 は月曜日なので、(day_key - 1) // 7 がそのまま「月曜始まり」の週番号になります。
+def day_key_of(value: datetime.date) -> int:
+    """日付（または日時）を整数の日キーに変換する。"""
+    return value.toordinal()
+
+def week_key_of(value: datetime.date) -> int:
+    """日付（または日時）を月曜始まりの整数の週キーに変換する。"""
+    return (value.toordinal() - 1) // 7
+
+def day_key_to_date(day_key: int) -> datetime.date:
+    """日キーを date オブジェクトに戻す。"""
+    return datetime.date.fromordinal(day_key)
+
+def week_key_to_monday(week_key: int) -> datetime.date:
+    """週キーをその週の月曜日の date オブジェクトに戻す。"""
+    return datetime.date.fromordinal(week_key * 7 + 1)
+
+def record_time_fields(recorded_at: datetime.datetime) -> dict:
+    """
+    記録日時から food_loss_records の日時関連カラム一式を作る。
+    Core の一括INSERTなど、カラムのデフォルト値に頼らない経路で使用する。
+    """
+    return {
+        "record_date": recorded_at.isoformat(),
+        "recorded_at": recorded_at,
+        "day_key": day_key_of(recorded_at),
+        "week_key": week_key_of(recorded_at),
+    }
+
+# --- food_loss_records の日時カラムのデフォルト値 ---
+# INSERT 時にはカラム定義順（record_date → recorded_at → day_key → week_key）に評価されるため、
+# 後のカラムは先に決まった値から導出します。
+def _default_record_date(context) -> str:
+    recorded_at = context.get_current_parameters().get('recorded_at')
+    return (recorded_at or datetime.datetime.now()).isoformat()
+
+def _default_recorded_at(context) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(context.get_current_parameters()['record_date'])
+
+def _default_day_key(context) -> int:
+    return day_key_of(context.get_current_parameters()['recorded_at'])
+
+def _default_week_key(context) -> int:
+    return week_key_of(context.get_current_parameters()['recorded_at'])
+
 # ユーザーテーブルに対応するクラスを定義します
 class User(Base):
     __tablename__ = 'users'
@@ -19,6 +66,9 @@ class User(Base):
 
     # このユーザーに関連するフードロス記録を定義します
     records = relationship("FoodLossRecord", back_populates="user")
+
+# ランキング（leaderboard.py）の上位K人を、ポイントの多い順・登録順にインデックスを先頭から読むだけで取得する
+Index('ix_users_total_points', User.total_points.desc(), User.id)
     
 # 廃棄理由テーブルに対応するクラスを定義します
 class LossReason(Base):
@@ -44,8 +94,92 @@ class FoodLossRecord(Base):
     loss_reason_id = Column(Integer, ForeignKey('loss_reasons.id'))
     # record_date の定義を修正
     # ただし、データベースには 'TEXT'型として定義されているため、以下のように 'String' 型を維持しつつ値を設定するのが簡単です。
-    record_date = Column(String(255), nullable=False, default=lambda: datetime.datetime.now().isoformat())
+    record_date = Column(String(255), nullable=False, default=_default_record_date)
+    # 集計・範囲検索用の型付き日時と、そこから導出した整数キー
+    # 既存DBでは migrations.py で列追加とバックフィルを行います
+    recorded_at = Column(DateTime, default=_default_recorded_at)
+    day_key = Column(Integer, default=_default_day_key)
+    week_key = Column(Integer, default=_default_week_key)
+
+    # ユーザーごとの日付範囲検索（週次集計など）をインデックスの範囲走査にする
+    __table_args__ = (
+        Index('ix_food_loss_records_user_day', 'user_id', 'day_key'),
+        # 記録履歴の一覧（/api/records）を (record_date, id) のキーセットで辿る
+        Index('ix_food_loss_records_user_record_date', 'user_id', 'record_date', 'id'),
+    )
     
     # ユーザーと廃棄理由への関係性を定義します
     user = relationship("User", back_populates="records")
-    reason = relationship("LossReason", back_populates="records")
\ No newline at end of file
+    reason = relationship("LossReason", back_populates="records")
+
+# --- 集計用ロールアップテーブル ---
+# food_loss_records への書き込みと同じトランザクションで更新され（rollups.py）、
+# 週次ポイントや週間グラフは生の記録ではなくこれらの集計行から読み出します。
+
+# ユーザーごと・日ごとの合計廃棄量
+class UserDayTotal(Base):
+    __tablename__ = 'user_day_totals'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    day_key = Column(Integer, primary_key=True)
+    total_grams = Column(REAL, nullable=False, default=0.0)
+    record_count = Column(Integer, nullable=False, default=0)
+
+# ユーザーごと・週（月曜始まり）ごとの合計廃棄量
+class UserWeekTotal(Base):
+    __tablename__ = 'user_week_totals'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    week_key = Column(Integer, primary_key=True)
+    total_grams = Column(REAL, nullable=False, default=0.0)
+    record_count = Column(Integer, nullable=False, default=0)
+
+# 書き込みキュー（write_behind.py の async モード）で受け付けた記録の処理結果。
+# 記録と同じシャードに、記録の INSERT と同じトランザクションで書かれるため、
+# 受け付けたのとは別のワーカーからも /api/add_loss_record/pending/<id> で結果を確かめられます。
+class PendingWrite(Base):
+    __tablename__ = 'pending_writes'
+
+    pending_id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # committed / failed（コミット前の記録には行がない）
+    status = Column(String(16), nullable=False)
+    record_id = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.now)
+
+    # 古い結果の削除（write_behind.py）を created_at の範囲で行う
+    __table_args__ = (
+        Index('ix_pending_writes_created_at', 'created_at'),
+    )
+
+# 一括ポイント付与（batch_points.py）の実績。(user_id, week_key) ごとに1行だけ作られるため、
+# ジョブを再実行しても同じ週のポイントが二重に付与されることはありません。
+class WeeklyPointAward(Base):
+    __tablename__ = 'weekly_point_awards'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    week_key = Column(Integer, primary_key=True)
+    points_added = Column(Integer, nullable=False)
+    final_reduction_rate = Column(REAL, nullable=False)
+    rate_last_week = Column(REAL, nullable=False)
+    rate_baseline = Column(REAL, nullable=False)
+    awarded_at = Column(DateTime, nullable=False, default=datetime.datetime.now)
+
+# ポイントの増減の台帳（追記のみ）。users.total_points は台帳の delta の合計と一致し、
+# points_ledger.py の rebuild_points_balances で台帳から作り直せます。
+# (user_id, week_key, reason) が一意なので、同じ週・同じ理由の付与は何度実行しても1回だけになります。
+# （週に結び付かない手動の調整は week_key を NULL にして記録するため、一意制約の対象外）
+class PointsLedgerEntry(Base):
+    __tablename__ = 'points_ledger'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    week_key = Column(Integer)
+    reason = Column(String(64), nullable=False)
+    delta = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'week_key', 'reason', name='uq_points_ledger_award'),
+    )
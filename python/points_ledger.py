@@ -0,0 +1,153 @@
+# points_ledger.py
+"""
+ポイント台帳（points_ledger）への記帳と、users.total_points の更新。
+
+ポイントの増減は必ずこのモジュールを通します。台帳への INSERT と
+UPDATE users SET total_points = total_points + :delta を同じトランザクションで行うため、
+ユーザー行を読み込んで Python 側で加算する場合のように、同時実行で更新が失われることはありません。
+同じ付与を複数のワーカーが同時に処理しても、一意制約 (user_id, week_key, reason) によって
+記帳できるのは1回だけで、残高の加算も記帳できた側だけが行います。
+
+使い方:
+    python points_ledger.py opening   # 台帳の導入前に付与済みのポイントを期首残高として記帳する
+    python points_ledger.py rebuild   # users.total_points を台帳の合計から作り直す
+"""
+import argparse
+import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import func, literal, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import writes
+from models import PointsLedgerEntry, User
+
+# 台帳の reason に記録する値
+WEEKLY_REDUCTION = "weekly_reduction"  # 週次の削減ポイント（週ごとに1回）
+ADJUSTMENT = "adjustment"              # 手動の調整（week_key は NULL）
+OPENING_BALANCE = "opening_balance"    # 台帳導入前の残高（week_key は 0）
+
+def _balance_from_ledger():
+    """users の各行について、台帳の delta の合計を返す相関サブクエリ。"""
+    return select(func.coalesce(func.sum(PointsLedgerEntry.delta), 0)) \
+        .where(PointsLedgerEntry.user_id == User.id) \
+        .scalar_subquery()
+
+@writes
+def record_points(db: Session, user_id: int, delta: int, reason: str, week_key: Optional[int] = None) -> bool:
+    """
+    台帳に1件記帳し、記帳できた場合だけユーザーの残高を加算する（コミットは呼び出し側で行う）。
+
+    Returns:
+        記帳した場合は True。同じ (user_id, week_key, reason) の記帳が既にあれば False
+
+    Raises:
+        ValueError: ユーザーが存在しない場合
+    """
+    inserted = db.execute(
+        sqlite_insert(PointsLedgerEntry)
+        .values(user_id=user_id, week_key=week_key, reason=reason, delta=delta, created_at=datetime.datetime.now())
+        .on_conflict_do_nothing()
+    ).rowcount
+    if not inserted:
+        return False
+    updated = db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(total_points=User.total_points + delta),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if not updated:
+        raise ValueError(f"ユーザーが見つかりません: {user_id}")
+    return True
+
+@writes
+def record_weekly_points_bulk(db: Session, week_key: int, reason: str, deltas: Dict[int, int]) -> Dict[int, int]:
+    """
+    複数ユーザーの同じ週・同じ理由のポイントをまとめて記帳し、記帳できた分の残高を1回の UPDATE で加算する
+    （コミットは呼び出し側で行う）。
+
+    Returns:
+        実際に記帳した {user_id: delta}（他のワーカーが先に記帳したユーザーは含まれない）
+    """
+    if not deltas:
+        return {}
+    now = datetime.datetime.now()
+    rows = db.execute(
+        sqlite_insert(PointsLedgerEntry)
+        .on_conflict_do_nothing()
+        .returning(PointsLedgerEntry.user_id, PointsLedgerEntry.delta),
+        [
+            {"user_id": user_id, "week_key": week_key, "reason": reason, "delta": delta, "created_at": now}
+            for user_id, delta in deltas.items()
+        ],
+    ).all()
+    credited = {user_id: delta for user_id, delta in rows}
+    if credited:
+        delta_subquery = select(PointsLedgerEntry.delta) \
+            .where(PointsLedgerEntry.user_id == User.id) \
+            .where(PointsLedgerEntry.week_key == week_key) \
+            .where(PointsLedgerEntry.reason == reason) \
+            .scalar_subquery()
+        db.execute(
+            update(User)
+            .where(User.id.in_(list(credited)))
+            .values(total_points=User.total_points + delta_subquery),
+            execution_options={"synchronize_session": False},
+        )
+    return credited
+
+@writes
+def record_opening_balances(db: Session) -> int:
+    """
+    台帳の合計と users.total_points の差（台帳の導入前に付与されたポイント）を期首残高として記帳する。
+    1ユーザーにつき1回だけ記帳される（再実行しても増えない）。
+
+    Returns:
+        記帳したユーザー数
+    """
+    difference = User.total_points - _balance_from_ledger()
+    stmt = sqlite_insert(PointsLedgerEntry).from_select(
+        ["user_id", "week_key", "reason", "delta", "created_at"],
+        select(User.id, literal(0), literal(OPENING_BALANCE), difference, literal(datetime.datetime.now()))
+        .where(difference != 0),
+    ).on_conflict_do_nothing()
+    count = db.execute(stmt).rowcount
+    db.commit()
+    return count
+
+@writes
+def rebuild_points_balances(db: Session) -> int:
+    """
+    users.total_points を台帳の delta の合計で作り直す。
+
+    Returns:
+        残高が台帳とずれていて書き換えたユーザー数
+    """
+    balance = _balance_from_ledger()
+    count = db.execute(
+        update(User)
+        .where(User.total_points != balance)
+        .values(total_points=balance),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    db.commit()
+    return count
+
+def main():
+    from database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="ポイント台帳の保守")
+    parser.add_argument("command", choices=["opening", "rebuild"])
+    args = parser.parse_args()
+
+    PointsLedgerEntry.__table__.create(bind=engine, checkfirst=True)
+    with SessionLocal() as db:
+        if args.command == "opening":
+            print(f"Recorded opening balances for {record_opening_balances(db)} users.")
+        else:
+            print(f"Rebuilt balances for {rebuild_points_balances(db)} users.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# reason_registry.py
+"""
+廃棄理由（loss_reasons）のプロセス内レジストリ。
+
+loss_reasons は init_db で投入される小さな、ほぼ変化しない表なので、
+初回アクセス時に一度だけ読み込み、テキスト↔ID の対応をメモリに保持します。
+理由を追加・変更したコードは、コミット後に reason_registry.invalidate() を呼んでください。
+"""
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import LossReason
+
+class LossReasonRegistry:
+    """廃棄理由のテキスト↔IDの対応をキャッシュする。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._texts: Optional[List[str]] = None
+        self._id_by_text: Dict[str, int] = {}
+        self._text_by_id: Dict[int, str] = {}
+        self._etag = ""
+
+    def _ensure_loaded(self, db: Session) -> None:
+        if self._texts is not None:
+            return
+        with self._lock:
+            if self._texts is not None:
+                return
+            rows = db.query(LossReason.id, LossReason.reason_text).order_by(LossReason.id).all()
+            self._id_by_text = {text: reason_id for reason_id, text in rows}
+            self._text_by_id = {reason_id: text for reason_id, text in rows}
+            # 内容から作るので、どのワーカープロセスでも同じ内容なら同じ ETag になる
+            self._etag = hashlib.sha1(repr(rows).encode()).hexdigest()[:16]
+            self._texts = [text for _, text in rows]
+
+    def invalidate(self) -> None:
+        """キャッシュを破棄する。次のアクセスでDBから読み直される。"""
+        with self._lock:
+            self._texts = None
+
+    def texts(self, db: Session) -> List[str]:
+        """全ての理由テキストを id 順で返す。"""
+        self._ensure_loaded(db)
+        return list(self._texts)
+
+    def id_for(self, db: Session, reason_text: str) -> Optional[int]:
+        """理由テキストに対応するIDを返す。登録されていなければ None。"""
+        self._ensure_loaded(db)
+        return self._id_by_text.get(reason_text)
+
+    def text_for(self, db: Session, reason_id: int) -> Optional[str]:
+        """IDに対応する理由テキストを返す。登録されていなければ None。"""
+        self._ensure_loaded(db)
+        return self._text_by_id.get(reason_id)
+
+    def etag(self, db: Session) -> str:
+        """現在の理由一覧のバージョン（HTTP の ETag に使う）を返す。"""
+        self._ensure_loaded(db)
+        return self._etag
+
+# アプリ全体で共有するレジストリ
+reason_registry = LossReasonRegistry()
@@ -0,0 +1,170 @@
+# request_log.py
+"""
+構造化ログ（1行1 JSON）とアクセスログ。
+
+ログは logging の QueueHandler で有界キューに積むだけで、整形と書き出しは専用スレッド（QueueListener）が行います。
+リクエストを処理するスレッドがコンソールやファイルへの書き込みで待たされることはなく、
+キューが一杯のときはそのログを捨てて件数だけ数えます。
+
+リクエストごとに、エンドポイント・ステータス・レイテンシ・DB時間・クエリ数を持つアクセスログを1行出力します。
+件数の多いルートはサンプリングでき、エラー（5xx）と遅いリクエストはサンプリングに関係なく必ず出力します。
+
+環境変数:
+    FOOD_LOSS_LOG_LEVEL          DEBUG / INFO（既定）/ WARNING / ERROR
+    FOOD_LOSS_LOG_SAMPLING       ルールごとのアクセスログの出力率。例: "/metrics=0,/api/weekly_stats=0.1,*=1"
+    FOOD_LOSS_LOG_SLOW_MS        サンプリングせずに必ず出力するレイテンシ（既定 1000）
+    FOOD_LOSS_LOG_QUEUE_SIZE     キューの上限（既定 10000）
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from flask import Flask, g, request, session
+
+LOGGER_NAME = "food_loss"
+
+LOG_LEVEL = os.environ.get("FOOD_LOSS_LOG_LEVEL", "INFO").upper()
+LOG_SAMPLING = os.environ.get("FOOD_LOSS_LOG_SAMPLING", "/metrics=0,*=1")
+SLOW_REQUEST_MS = float(os.environ.get("FOOD_LOSS_LOG_SLOW_MS", "1000"))
+LOG_QUEUE_SIZE = int(os.environ.get("FOOD_LOSS_LOG_QUEUE_SIZE", "10000"))
+
+# --- 整形と書き出し（専用スレッド側） ---
+
+class JsonLinesFormatter(logging.Formatter):
+    """ログレコードを1行の JSON にする。extra={"fields": {...}} の内容はそのままキーとして出力する。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """キューが一杯なら待たずにログを捨て、捨てた件数を数える QueueHandler。"""
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 整形は書き出しスレッドで行う（リクエストのスレッドでは文字列を作らない）
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_configure_lock = threading.Lock()
+_queue_handler: Optional[DroppingQueueHandler] = None
+
+def configure_logging(level: str = LOG_LEVEL, stream=None, queue_size: int = LOG_QUEUE_SIZE) -> logging.Logger:
+    """
+    food_loss ロガーにキュー経由の JSON Lines 出力を設定する（2回目以降の呼び出しでは何もしない）。
+    書き出しスレッドはプロセス終了時に残りを書き切ってから止まる。
+    """
+    global _queue_handler
+    logger = logging.getLogger(LOGGER_NAME)
+    with _configure_lock:
+        if _queue_handler is not None:
+            return logger
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonLinesFormatter())
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+        _queue_handler = DroppingQueueHandler(log_queue)
+        listener = logging.handlers.QueueListener(log_queue, output)
+        listener.start()
+        atexit.register(listener.stop)
+
+        logger.addHandler(_queue_handler)
+        logger.setLevel(level)
+        # ルートロガー（Flask / werkzeug の出力先）には流さない
+        logger.propagate = False
+    return logger
+
+def get_logger(name: str) -> logging.Logger:
+    """food_loss 配下のロガーを返す（例: get_logger("auth") -> food_loss.auth）。"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+def log_stats() -> Dict[str, Any]:
+    """キューに溜まっている件数と、捨てた件数を返す。"""
+    if _queue_handler is None:
+        return {}
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped}
+
+# --- アクセスログ ---
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """
+    "ルール=出力率,..." の指定を辞書にする。ルールは Flask の URL ルール（/api/records など）、
+    * はそれ以外の全てのルール。出力率は 0〜1。
+
+    Raises:
+        ValueError: 書式や出力率が不正な場合
+    """
+    rates: Dict[str, float] = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        rule, sep, rate = item.strip().rpartition("=")
+        if not sep or not rule:
+            raise ValueError(f"FOOD_LOSS_LOG_SAMPLING の書式が不正です: {item}")
+        rates[rule] = float(rate)
+        if not 0.0 <= rates[rule] <= 1.0:
+            raise ValueError(f"出力率は 0〜1 で指定してください: {item}")
+    return rates
+
+access_logger = get_logger("access")
+
+def init_app(app: Flask, sampling: str = LOG_SAMPLING) -> None:
+    """
+    リクエストごとのアクセスログを登録する。
+    レイテンシと DB 時間は metrics.py の計測値を使うので、metrics.init_app の後に呼ぶこと
+    （teardown は登録と逆順に呼ばれるため、metrics が値を片付ける前に読める）。
+    """
+    configure_logging()
+    rates = parse_sampling(sampling)
+    default_rate = rates.get("*", 1.0)
+
+    def _log_request(exception=None) -> None:
+        started_at = g.get("metrics_started_at")
+        if started_at is None or not access_logger.isEnabledFor(logging.INFO):
+            return
+        latency_ms = (time.perf_counter() - started_at) * 1000
+        status = g.get("metrics_status", 500)
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        # エラーと遅いリクエストは必ず残し、それ以外はルールごとの出力率で間引く
+        if status < 500 and latency_ms < SLOW_REQUEST_MS:
+            rate = rates.get(endpoint, default_rate)
+            if rate < 1.0 and random.random() >= rate:
+                return
+        access_logger.log(logging.ERROR if status >= 500 else logging.INFO, "request", extra={"fields": {
+            "method": request.method,
+            "endpoint": endpoint,
+            "path": request.path,
+            "status": status,
+            "latency_ms": round(latency_ms, 2),
+            "db_ms": round(g.get("metrics_sql_seconds", 0.0) * 1000, 2),
+            "db_queries": g.get("metrics_sql_queries", 0),
+            # セッションの中身は出さず、ユーザーIDだけを残す
+            "user_id": session.get("user_id"),
+            "error": repr(exception) if exception is not None else None,
+        }})
+
+    app.teardown_request(_log_request)
@@ -0,0 +1,197 @@
+# rollups.py
+"""
+ユーザーごとの日次・週次の合計廃棄量（user_day_totals / user_week_totals）を管理する。
+
+記録の追加・削除・編集を行う経路は、同じセッション（トランザクション）の中で
+apply_record_to_rollups を呼び出し、コミットは呼び出し側で行います。
+集計行が生の記録とずれた場合は、rebuild_rollups で記録テーブルから作り直せます。
+
+使い方:
+    python rollups.py            # ロールアップを全件作り直す
+"""
+import datetime
+from collections import defaultdict
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import case, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import FoodLossRecord, UserDayTotal, UserWeekTotal, day_key_of, week_key_of
+
+# --- 書き込み側 ---
+
+def _upsert_total(db: Session, model, key_column: str, user_id: int, key: int, grams: float, count: int) -> None:
+    """集計行が無ければ作成し、あれば加算する（SQLite の INSERT ... ON CONFLICT DO UPDATE）。"""
+    stmt = sqlite_insert(model).values(
+        user_id=user_id, **{key_column: key}, total_grams=grams, record_count=count
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', key_column],
+        set_={
+            'total_grams': model.total_grams + stmt.excluded.total_grams,
+            'record_count': model.record_count + stmt.excluded.record_count,
+        },
+    )
+    db.execute(stmt)
+
+def apply_record_to_rollups(db: Session, user_id: int, recorded_at: datetime.datetime,
+                            weight_grams: float, sign: int = 1) -> None:
+    """
+    1件の記録を日次・週次の集計行に反映する。
+
+    Args:
+        db: データベースセッション（コミットは呼び出し側で行う）
+        user_id: 記録のユーザーID
+        recorded_at: 記録日時
+        weight_grams: 廃棄重量
+        sign: 追加なら 1、削除なら -1（編集は旧値で -1、新値で 1 を呼ぶ）
+    """
+    grams = weight_grams * sign
+    _upsert_total(db, UserDayTotal, 'day_key', user_id, day_key_of(recorded_at), grams, sign)
+    _upsert_total(db, UserWeekTotal, 'week_key', user_id, week_key_of(recorded_at), grams, sign)
+
+def apply_records_to_rollups(db: Session, records: Iterable[Tuple[int, datetime.datetime, float]]) -> None:
+    """
+    複数の記録 (user_id, recorded_at, weight_grams) をまとめて集計行に反映する。
+    同じ日・同じ週の記録は先に足し合わせ、集計行1行につき1回の UPSERT（executemany）で済ませる。
+    """
+    day_totals: Dict[Tuple[int, int], list] = defaultdict(lambda: [0.0, 0])
+    week_totals: Dict[Tuple[int, int], list] = defaultdict(lambda: [0.0, 0])
+    for user_id, recorded_at, weight_grams in records:
+        for totals, key in ((day_totals, day_key_of(recorded_at)), (week_totals, week_key_of(recorded_at))):
+            totals[(user_id, key)][0] += weight_grams
+            totals[(user_id, key)][1] += 1
+
+    for model, key_column, totals in ((UserDayTotal, 'day_key', day_totals), (UserWeekTotal, 'week_key', week_totals)):
+        if not totals:
+            continue
+        stmt = sqlite_insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', key_column],
+            set_={
+                'total_grams': model.total_grams + stmt.excluded.total_grams,
+                'record_count': model.record_count + stmt.excluded.record_count,
+            },
+        )
+        db.execute(stmt, [
+            {'user_id': user_id, key_column: key, 'total_grams': grams, 'record_count': count}
+            for (user_id, key), (grams, count) in totals.items()
+        ])
+
+def rebuild_rollups(engine: Engine) -> int:
+    """
+    food_loss_records から集計行を全件作り直す。
+    day_key が未設定の行（バックフィル前の行）は集計されないため、先に migrations.py を実行してください。
+
+    Returns:
+        作成した日次集計行の数
+    """
+    records = FoodLossRecord.__tablename__
+    with engine.begin() as conn:
+        for model in (UserDayTotal, UserWeekTotal):
+            model.__table__.create(bind=conn, checkfirst=True)
+        conn.execute(text(f"DELETE FROM {UserDayTotal.__tablename__}"))
+        conn.execute(text(f"DELETE FROM {UserWeekTotal.__tablename__}"))
+        day_rows = conn.execute(text(
+            f"INSERT INTO {UserDayTotal.__tablename__} (user_id, day_key, total_grams, record_count) "
+            f"SELECT user_id, day_key, SUM(weight_grams), COUNT(*) FROM {records} "
+            f"WHERE user_id IS NOT NULL AND day_key IS NOT NULL GROUP BY user_id, day_key"
+        )).rowcount
+        conn.execute(text(
+            f"INSERT INTO {UserWeekTotal.__tablename__} (user_id, week_key, total_grams, record_count) "
+            f"SELECT user_id, week_key, SUM(weight_grams), COUNT(*) FROM {records} "
+            f"WHERE user_id IS NOT NULL AND week_key IS NOT NULL GROUP BY user_id, week_key"
+        ))
+    return day_rows
+
+def rollups_need_rebuild(db: Session) -> bool:
+    """記録はあるのに集計行が1件も無い（テーブルを後から追加した）場合に True を返す。"""
+    has_records = db.query(FoodLossRecord.id).filter(FoodLossRecord.day_key.isnot(None)).first() is not None
+    has_totals = db.query(UserDayTotal.user_id).first() is not None
+    return has_records and not has_totals
+
+# --- 読み出し側 ---
+
+def get_week_total(db: Session, user_id: int, week_key: int) -> float:
+    """月曜始まりの1週間の合計廃棄量を集計行1行から取得する。"""
+    total = db.query(UserWeekTotal.total_grams) \
+              .filter(UserWeekTotal.user_id == user_id, UserWeekTotal.week_key == week_key) \
+              .scalar()
+    return total or 0.0
+
+def get_total_grams_between_days(db: Session, user_id: int, start_day_key: int, end_day_key: int) -> float:
+    """日キーの範囲（両端を含む）の合計廃棄量を日次集計行から取得する。"""
+    total = db.query(func.sum(UserDayTotal.total_grams)) \
+              .filter(UserDayTotal.user_id == user_id) \
+              .filter(UserDayTotal.day_key.between(start_day_key, end_day_key)) \
+              .scalar()
+    return total or 0.0
+
+def get_day_totals(db: Session, user_id: int, start_day_key: int, end_day_key: int) -> Dict[int, float]:
+    """日キーの範囲（両端を含む）の日別合計を {day_key: total_grams} で返す。記録の無い日は含まない。"""
+    rows = db.query(UserDayTotal.day_key, UserDayTotal.total_grams) \
+             .filter(UserDayTotal.user_id == user_id) \
+             .filter(UserDayTotal.day_key.between(start_day_key, end_day_key)) \
+             .all()
+    return {row.day_key: row.total_grams for row in rows}
+
+def _points_window_columns(today: datetime.datetime) -> Tuple[list, int, int]:
+    """
+    週次ポイント計算用の CASE 集計列（今週・先週・直近28日間）と、対象となる日キーの範囲を返す。
+    週は月曜始まりで、today を含む週を「今週」とする。
+    直近28日間は従来の「28日前〜現在」に合わせ、今日の記録も含める。
+    """
+    today_key = day_key_of(today)
+    this_monday_key = today_key - today.weekday()
+    last_monday_key = this_monday_key - 7
+    baseline_start_key = today_key - 28
+
+    def bucket(start_key: int, end_key: int):
+        return func.coalesce(func.sum(case(
+            (UserDayTotal.day_key.between(start_key, end_key), UserDayTotal.total_grams),
+            else_=0.0,
+        )), 0.0)
+
+    columns = [
+        bucket(this_monday_key, this_monday_key + 6),
+        bucket(last_monday_key, this_monday_key - 1),
+        bucket(baseline_start_key, today_key),
+    ]
+    return columns, baseline_start_key, this_monday_key + 6
+
+def get_points_window_totals(db: Session, user_id: int, today: datetime.datetime) -> Tuple[float, float, float]:
+    """
+    週次ポイント計算に必要な3つの合計を、日次集計行への1回のクエリで取得する。
+
+    Returns:
+        (今週の合計, 先週の合計, 今日を含む直近28日間の合計)
+        週は月曜始まりで、today を含む週を「今週」とする。
+    """
+    columns, start_key, end_key = _points_window_columns(today)
+    row = db.query(*columns) \
+            .filter(UserDayTotal.user_id == user_id) \
+            .filter(UserDayTotal.day_key.between(start_key, end_key)) \
+            .one()
+    return row[0], row[1], row[2]
+
+def get_points_window_totals_for_users(db: Session, first_user_id: int, last_user_id: int,
+                                       today: datetime.datetime) -> Dict[int, Tuple[float, float, float]]:
+    """
+    get_points_window_totals の複数ユーザー版。user_id の範囲（両端を含む）を1回の GROUP BY で集計する。
+    対象期間に記録が1件も無いユーザーは結果に含まれない。
+    """
+    columns, start_key, end_key = _points_window_columns(today)
+    rows = db.query(UserDayTotal.user_id, *columns) \
+             .filter(UserDayTotal.user_id.between(first_user_id, last_user_id)) \
+             .filter(UserDayTotal.day_key.between(start_key, end_key)) \
+             .group_by(UserDayTotal.user_id) \
+             .all()
+    return {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+if __name__ == "__main__":
+    from sharding import shards
+
+    total = sum(rebuild_rollups(shard.engine) for shard in shards)
+    print(f"Rollups rebuilt: {total} daily rows.")
@@ -0,0 +1,395 @@
+# server.py
+"""
+本番用の起動コマンド（複数ワーカープロセス + ワーカーごとのスレッドプール）。
+
+マスタープロセスが待ち受けソケットを作り、同じソケットを引き継いだワーカープロセスを複数起動します。
+各ワーカーは app を読み込んでウォームアップ（コネクションプールを開く・廃棄理由とテンプレートを読み込む）を
+終えてから accept を始めるので、起動直後のリクエストが初回の読み込みを待つことはありません。
+HTTP サーバーは Flask に同梱の werkzeug を使い、追加の依存はありません。
+
+使い方:
+    python server.py                                  # CPU コア数のワーカー、各8スレッド、127.0.0.1:5000
+    python server.py --bind 0.0.0.0:8000 --workers 4 --threads 16
+
+マスターへのシグナル:
+    SIGTERM / SIGINT  新しい接続の受付を止め、処理中のリクエストを待ってから終了する（最大 --graceful-timeout 秒）
+    SIGHUP            ワーカーを1つずつ入れ替える（新しいワーカーのウォームアップが終わってから古いワーカーを止める）
+    SIGUSR1           マスターと各ワーカーの統計を出力する
+
+環境変数:
+    FOOD_LOSS_BIND               待ち受けるアドレス（既定 127.0.0.1:5000）
+    FOOD_LOSS_WORKERS            ワーカープロセス数（既定 CPU コア数）
+    FOOD_LOSS_THREADS            ワーカーごとの同時処理数（既定 8）
+    FOOD_LOSS_GRACEFUL_TIMEOUT   停止・入れ替え時に処理中のリクエストを待つ秒数（既定 30）
+
+ワーカーは1接続1リクエスト（HTTP/1.0）で応答するので、アイドルな keep-alive 接続がスレッドを占有しません。
+keep-alive やTLSは前段のリバースプロキシで扱ってください。
+WEEKLY_POINTS_SCHEDULER=1 の場合、スケジューラはワーカー0でだけ動かします。
+スキーマの確認・作成は、起動時と SIGHUP のたびに短命の子プロセス（python server.py --bootstrap）で1回だけ行い
+（SIGHUP では新しいコードのモデル定義で確認される）、ワーカーは FOOD_LOSS_SCHEMA_BOOTSTRAP=skip で起動します。
+マスター自身はDBに接続しません。
+"""
+import argparse
+import os
+import resource
+import select
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+BIND = os.environ.get("FOOD_LOSS_BIND", "127.0.0.1:5000")
+WORKERS = int(os.environ.get("FOOD_LOSS_WORKERS", str(os.cpu_count() or 1)))
+THREADS = int(os.environ.get("FOOD_LOSS_THREADS", "8"))
+GRACEFUL_TIMEOUT = float(os.environ.get("FOOD_LOSS_GRACEFUL_TIMEOUT", "30"))
+# ワーカーのウォームアップを待つ最大秒数
+READY_TIMEOUT = 60.0
+# 異常終了したワーカーを起動し直す最短の間隔（秒）
+RESPAWN_INTERVAL = 1.0
+# 全スレッドが使用中のとき、空きを待ってから待ち受けループ（停止の指示の確認）に戻るまでの秒数
+SLOT_WAIT_SECONDS = 0.1
+
+def parse_bind(bind: str) -> Tuple[str, int]:
+    """
+    "host:port" を (host, port) にする。
+
+    Raises:
+        ValueError: 書式が不正な場合
+    """
+    host, sep, port = bind.rpartition(":")
+    if not sep or not host or not port.isdigit():
+        raise ValueError(f"待ち受けるアドレスは host:port で指定してください: {bind}")
+    return host.strip("[]"), int(port)
+
+# --- ワーカー ---
+
+class _RequestHandler(WSGIRequestHandler):
+    # 1接続1リクエスト（keep-alive でスレッドを占有しない）
+    protocol_version = "HTTP/1.0"
+
+    def log_request(self, code="-", size="-") -> None:
+        # アクセスログは request_log.py が出力する
+        pass
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    接続を固定サイズのスレッドプールで処理する werkzeug のサーバー。
+    空きスレッドを確保してから accept するので、全てのスレッドが使用中の間は接続が待ち受けソケットのキューに残り、
+    空いている他のワーカーが受け取る（どのワーカーも空いていなければ、カーネルの backlog で待つ）。
+    """
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int):
+        super().__init__(host, port, app, handler=_RequestHandler, fd=fd)
+        # 他のワーカーが先に accept した場合に accept で止まらないよう、待ち受けソケットはノンブロッキングにする
+        self.socket.setblocking(False)
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(threads)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="http")
+        self._stats_lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _handle_request_noblock(self) -> None:
+        # socketserver.BaseServer の実装に、accept 前の空きスレッドの確保を加えたもの
+        if not self._slots.acquire(timeout=SLOT_WAIT_SECONDS):
+            return
+        try:
+            request, client_address = self.get_request()
+        except OSError:
+            # 他のワーカーが先に accept した
+            self._slots.release()
+            return
+        if not self.verify_request(request, client_address):
+            self.shutdown_request(request)
+            self._slots.release()
+            return
+        try:
+            self.process_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+        except BaseException:
+            self.shutdown_request(request)
+            raise
+
+    def process_request(self, request, client_address) -> None:
+        # 空きスレッドは _handle_request_noblock で確保済み（処理が終わったら _process で返す）
+        with self._stats_lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            self._executor.submit(self._process, request, client_address)
+        except BaseException:
+            with self._stats_lock:
+                self.in_flight -= 1
+            self._slots.release()
+            raise
+
+    def _process(self, request, client_address) -> None:
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+                self.requests += 1
+            self._slots.release()
+
+    def drain(self, timeout: float) -> bool:
+        """処理中のリクエストが終わるまで最大 timeout 秒待つ。全て終われば True。"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self.in_flight
+
+    def stats_line(self, index: int, generation: int) -> str:
+        # Linux の ru_maxrss は KiB 単位
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return (f"worker {index} (pid {os.getpid()}, generation {generation}): "
+                f"requests={self.requests} in_flight={self.in_flight}/{self.threads} peak={self.peak_in_flight} "
+                f"uptime={time.time() - self.started_at:.0f}s max_rss={max_rss_mb:.1f}MB")
+
+def warm_up(flask_app) -> None:
+    """コネクションプール（共通DBと各シャードの、書き込み用・読み取り専用）を開き、廃棄理由とテンプレートを読み込んでおく。"""
+    from database import ReadSessionLocal
+    from reason_registry import reason_registry
+    from sharding import all_engines
+
+    for target_engine in all_engines():
+        connections = [target_engine.connect() for _ in range(target_engine.pool.size())]
+        for connection in connections:
+            connection.close()
+    with ReadSessionLocal() as db:
+        reason_registry.texts(db)
+    for name in flask_app.jinja_env.list_templates():
+        flask_app.jinja_env.get_template(name)
+
+def run_worker(index: int, generation: int, fd: int, ready_fd: int, host: str, port: int,
+               threads: int, graceful_timeout: float) -> int:
+    """ワーカープロセスの本体。ウォームアップ後に ready_fd へ1バイト書いてから accept を始める。"""
+    started_at = time.perf_counter()
+    from app import app
+
+    warm_up(app)
+    server = PooledWSGIServer(host, port, app, threads, fd)
+
+    def _shutdown(signum, frame):
+        # serve_forever と同じスレッドからは shutdown() を呼べない
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: print(server.stats_line(index, generation), flush=True))
+
+    print(f"Worker {index} (pid {os.getpid()}, generation {generation}) ready in "
+          f"{(time.perf_counter() - started_at) * 1000:.0f}ms", flush=True)
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+
+    server.serve_forever(poll_interval=0.5)
+    drained = server.drain(graceful_timeout)
+    print(server.stats_line(index, generation) + ("" if drained else " (処理中のリクエストを打ち切りました)"), flush=True)
+    if not drained:
+        sys.stdout.flush()
+        os._exit(1)
+    return 0
+
+# --- マスター ---
+
+class Worker:
+    """マスターから見たワーカープロセス。"""
+
+    def __init__(self, index: int, generation: int, process: subprocess.Popen, ready_fd: int):
+        self.index = index
+        self.generation = generation
+        self.process = process
+        self.ready_fd = ready_fd
+        self.started_at = time.time()
+
+    def wait_ready(self, timeout: float = READY_TIMEOUT) -> bool:
+        """ウォームアップの完了を待つ。ワーカーが先に終了した場合や時間切れの場合は False。"""
+        if self.ready_fd < 0:
+            return True
+        readable, _, _ = select.select([self.ready_fd], [], [], timeout)
+        ready = bool(readable) and os.read(self.ready_fd, 1) == b"1"
+        os.close(self.ready_fd)
+        self.ready_fd = -1
+        return ready
+
+    def signal(self, signum: int) -> None:
+        if self.process.poll() is None:
+            self.process.send_signal(signum)
+
+class Arbiter:
+    """ワーカーの起動・監視・入れ替え・停止を行う。"""
+
+    def __init__(self, bind: str = BIND, workers: int = WORKERS, threads: int = THREADS,
+                 graceful_timeout: float = GRACEFUL_TIMEOUT):
+        if workers < 1 or threads < 1:
+            raise ValueError("ワーカー数とスレッド数は1以上で指定してください。")
+        self.host, self.port = parse_bind(bind)
+        self.worker_count = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.generation = 0
+        self.restarts = 0
+        self.workers: Dict[int, Worker] = {}
+        self._signals: List[int] = []
+        self._last_spawn: Dict[int, float] = {}
+        self._socket: Optional[socket.socket] = None
+
+    def _spawn(self, index: int, generation: int) -> Worker:
+        ready_read, ready_write = os.pipe()
+        env = dict(os.environ)
+        # スキーマはマスターが _bootstrap で確認済みなので、ワーカーでは確認しない
+        env["FOOD_LOSS_SCHEMA_BOOTSTRAP"] = "skip"
+        if index != 0:
+            env.pop("WEEKLY_POINTS_SCHEDULER", None)
+        command = [
+            sys.executable, os.path.abspath(__file__), "--worker",
+            "--bind", f"{self.host}:{self.port}", "--threads", str(self.threads),
+            "--graceful-timeout", str(self.graceful_timeout),
+            "--worker-index", str(index), "--worker-generation", str(generation),
+            "--worker-fd", str(self._socket.fileno()), "--worker-ready-fd", str(ready_write),
+        ]
+        process = subprocess.Popen(command, env=env, pass_fds=(self._socket.fileno(), ready_write),
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        os.close(ready_write)
+        self._last_spawn[index] = time.monotonic()
+        return Worker(index, generation, process, ready_read)
+
+    def _stop_workers(self, workers: List[Worker]) -> None:
+        """ワーカーに SIGTERM を送り、猶予を過ぎても終わらなければ SIGKILL する。"""
+        for worker in workers:
+            worker.signal(signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        for worker in workers:
+            try:
+                worker.process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                print(f"Worker {worker.index} (pid {worker.process.pid}) did not stop in time; killing it.")
+                worker.process.kill()
+                worker.process.wait()
+            if worker.ready_fd >= 0:
+                os.close(worker.ready_fd)
+                worker.ready_fd = -1
+
+    def _bootstrap(self) -> bool:
+        """子プロセスでスキーマの確認・作成を行う（マスターに古いモデル定義やDBの接続を残さない）。"""
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--bootstrap"],
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.returncode == 0
+
+    def reload(self) -> None:
+        """ワーカーを1つずつ入れ替える。新しいワーカーが起動できなければ古いワーカーを残して中断する。"""
+        if not self._bootstrap():
+            print("Schema bootstrap failed; keeping the old workers.", flush=True)
+            return
+        self.generation += 1
+        print(f"Reloading workers (generation {self.generation})", flush=True)
+        for index in sorted(self.workers):
+            new_worker = self._spawn(index, self.generation)
+            if not new_worker.wait_ready():
+                print(f"Worker {index} of generation {self.generation} failed to start; keeping the old workers.")
+                self._stop_workers([new_worker])
+                return
+            old_worker = self.workers[index]
+            self.workers[index] = new_worker
+            self._stop_workers([old_worker])
+
+    def print_stats(self) -> None:
+        print(f"master (pid {os.getpid()}): listening on {self.host}:{self.port}, workers={len(self.workers)} "
+              f"threads={self.threads} generation={self.generation} restarts={self.restarts}", flush=True)
+        for worker in self.workers.values():
+            # 各ワーカーの処理件数などは、ワーカー自身が SIGUSR1 を受けて出力する
+            worker.signal(signal.SIGUSR1)
+
+    def _reap(self) -> None:
+        """異常終了したワーカーを起動し直す。"""
+        for index, worker in list(self.workers.items()):
+            if worker.process.poll() is None:
+                continue
+            if time.monotonic() - self._last_spawn.get(index, 0) < RESPAWN_INTERVAL:
+                continue
+            print(f"Worker {index} (pid {worker.process.pid}) exited with code {worker.process.returncode}; restarting.")
+            self.restarts += 1
+            if worker.ready_fd >= 0:
+                os.close(worker.ready_fd)
+                worker.ready_fd = -1
+            self.workers[index] = self._spawn(index, self.generation)
+
+    def run(self) -> None:
+        # スキーマの確認・作成はワーカーの起動前に1回だけ行う（同時に作成しようとして競合しない）
+        if not self._bootstrap():
+            raise SystemExit("Schema bootstrap failed.")
+
+        self._socket = socket.create_server((self.host, self.port), backlog=2048)
+        self._socket.set_inheritable(True)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+
+        started_at = time.perf_counter()
+        self.workers = {index: self._spawn(index, self.generation) for index in range(self.worker_count)}
+        # ウォームアップは並行して進むので、全員の完了を順に待てばよい
+        if not all([worker.wait_ready() for worker in self.workers.values()]):
+            print("Some workers failed to start.")
+        print(f"Listening on http://{self.host}:{self.port} with {self.worker_count} workers x {self.threads} threads "
+              f"(ready in {(time.perf_counter() - started_at) * 1000:.0f}ms)", flush=True)
+
+        try:
+            while True:
+                while self._signals:
+                    signum = self._signals.pop(0)
+                    if signum in (signal.SIGTERM, signal.SIGINT):
+                        return
+                    if signum == signal.SIGHUP:
+                        self.reload()
+                    elif signum == signal.SIGUSR1:
+                        self.print_stats()
+                self._reap()
+                time.sleep(0.2)
+        finally:
+            print("Shutting down: draining workers...", flush=True)
+            self._stop_workers(list(self.workers.values()))
+            self._socket.close()
+            print("Shutdown complete.", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="本番用の起動コマンド（複数ワーカー）")
+    parser.add_argument("--bind", default=BIND, help="待ち受けるアドレス (host:port)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="ワーカープロセス数")
+    parser.add_argument("--threads", type=int, default=THREADS, help="ワーカーごとの同時処理数")
+    parser.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT, help="処理中のリクエストを待つ秒数")
+    # 以下はマスターがワーカーを起動するときに使う
+    parser.add_argument("--bootstrap", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-index", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-generation", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-fd", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-ready-fd", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bootstrap:
+        from database import init_db
+        from sharding import init_shards
+        init_db()
+        init_shards()
+        return
+    if args.worker:
+        host, port = parse_bind(args.bind)
+        sys.exit(run_worker(args.worker_index, args.worker_generation, args.worker_fd, args.worker_ready_fd,
+                            host, port, args.threads, args.graceful_timeout))
+    Arbiter(args.bind, args.workers, args.threads, args.graceful_timeout).run()
+
+if __name__ == "__main__":
+    main()
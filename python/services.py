@@ -1,19 +1,19 @@
 # services.py (冒頭部分の修正案)
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from models import User, FoodLossRecord, LossReason
-from schemas import LossRecordInput
+from sqlalchemy import func, insert, tuple_
+from models import User, FoodLossRecord, LossReason, PendingWrite, week_key_of, record_time_fields
+from database import reads, writes
+import base64
 import hashlib 
+import json
 from datetime import datetime, timedelta 
 from typing import Dict, Any, List, Optional, Tuple # Tuple, List, Optional を忘れずにインポート
-from statistics import (
-    get_week_boundaries,
-    get_total_grams_for_week,
-    get_total_grams_for_weeks,
-    get_last_two_weeks, # ★ この行を追加 ★
-    # calculate_weekly_statistics (※統計表示用なのでservicesでは不要)
-)
+from points_ledger import WEEKLY_REDUCTION, record_points
+from reason_registry import reason_registry
+from stats_cache import weekly_stats_cache
+from rollups import apply_record_to_rollups, apply_records_to_rollups, get_points_window_totals
 
+@writes
 def register_new_user(db: Session, username: str, email: str, password: str) -> int:
     """
     新しいユーザーをデータベースに登録する。
@@ -38,18 +38,21 @@ def register_new_user(db: Session, username: str, email: str, password: str) ->
     
     return new_user.id
 
+@reads
 def get_user_by_username(db: Session, username: str) -> User | None:
     """
     ユーザー名でユーザーオブジェクトを取得する。
     """
     return db.query(User).filter_by(username=username).first()
 
+@reads
 def get_user_by_id(db: Session, user_id: int) -> User | None:
     """
     IDでユーザーオブジェクトを取得する。
     """
     return db.query(User).get(user_id)
 
+@writes
 def add_new_loss_record(db: Session, record_data: Dict[str, Any]) -> int:
     """
     検証済みの廃棄記録データ（辞書形式）をデータベースに挿入する。
@@ -57,83 +60,40 @@ def add_new_loss_record(db: Session, record_data: Dict[str, Any]) -> int:
     # 🚨 Pydanticによる二重チェックのロジックを完全に削除
     
     # 2. 外部キー（LossReason）の存在チェックとID取得
-    # record_data['reason_text'] を使って検索
-    reason = db.query(LossReason).filter_by(reason_text=record_data['reason_text']).first()
+    # record_data['reason_text'] をメモリ上のレジストリで引く（SELECT は発行しない）
+    reason_id = reason_registry.id_for(db, record_data['reason_text'])
     
-    if not reason:
+    if reason_id is None:
         # このエラーは app.py 側の Pydantic バリデーションで捕捉されるはずですが、DB側のチェックとして残します。
         raise ValueError(f"無効な廃棄理由: {record_data['reason_text']}")
 
     # 3. データベースへの挿入
     # 渡された辞書データ（record_data）をそのまま利用
+    recorded_at = datetime.now()
     new_record = FoodLossRecord(
         user_id=record_data['user_id'],
         item_name=record_data['item_name'],
         weight_grams=record_data['weight_grams'],
-        loss_reason_id=reason.id, # 外部キーIDを使用
+        loss_reason_id=reason_id, # 外部キーIDを使用
+        **record_time_fields(recorded_at),
         # notes=record_data.get('notes') # notes があればここに追加
     )
     
     db.add(new_record)
+    # 日次・週次の集計行も同じトランザクションで更新する
+    apply_record_to_rollups(db, new_record.user_id, recorded_at, new_record.weight_grams)
     db.commit()
+    # その週の /api/weekly_stats のキャッシュを捨てる
+    weekly_stats_cache.invalidate(new_record.user_id, recorded_at.date())
     db.refresh(new_record)
     
     return new_record.id
 
-def get_total_grams_for_week(db: Session, user_id: int, start_date: datetime, end_date: datetime) -> float:
+def compute_weekly_award(this_week_grams: float, last_week_grams: float, past_four_weeks_grams: float) -> Dict[str, Any]:
     """
-    指定された「月〜日」の一週間の合計廃棄重量を取得する。（ポイント計算用）
-    これは、以前の statistics.py から移動・修正した関数です。
-    """
-    # データベースのレコード日付は文字列（ISO 8601）として保存されているため、文字列形式に変換
-    start_str = start_date.isoformat()
-    end_str = end_date.isoformat()
-    
-    total_grams = db.query(func.sum(FoodLossRecord.weight_grams)) \
-                      .filter(FoodLossRecord.user_id == user_id) \
-                      .filter(FoodLossRecord.record_date >= start_str) \
-                      .filter(FoodLossRecord.record_date <= end_str) \
-                      .scalar()
-                      
-    return total_grams or 0.0
-
-def get_total_grams_for_weeks(db: Session, user_id: int, weeks_ago: int) -> float:
-    """
-    ★この関数が statistics.py から移動する関数です★
-    過去 N 週間分の合計廃棄重量（グラム）を取得する。
-    """
-    # ... (ロジックは statistics.py のものと同じものをここに貼り付け) ...
-    today = datetime.now()
-    start_point = today - timedelta(weeks=weeks_ago) 
-    start_str = start_point.isoformat()
-    
-    total_grams = db.query(func.sum(FoodLossRecord.weight_grams)) \
-                      .filter(FoodLossRecord.user_id == user_id) \
-                      .filter(FoodLossRecord.record_date >= start_str) \
-                      .filter(FoodLossRecord.record_date < today.isoformat()) \
-                      .scalar()
-                      
-    return total_grams or 0.0
-
-def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
-    """
-    ユーザーの週次廃棄量を評価し、ポイントを計算・付与するメインロジック。
+    週間の合計廃棄量から削減率と付与ポイントを計算する（DBには触れない純粋な計算）。
     「先週比」と「過去4週間平均比」の低い方の削減率を採用し、10%あたり1ポイント付与する。
     """
-    
-    today = datetime.now()
-    # 既存のヘルパー関数（statistics.pyから移動した関数）を使って週の境界を取得
-    # NOTE: get_last_two_weeks がこのファイル内、またはインポート済みである前提
-    week_boundaries = get_last_two_weeks(today) 
-
-    # --- 1. 週間の合計廃棄量を取得 ---
-    this_week_grams = get_total_grams_for_week(db, user_id, *week_boundaries["this_week"])
-    last_week_grams = get_total_grams_for_week(db, user_id, *week_boundaries["last_week"])
-    
-    # 過去4週間（先々週以前）の合計と平均を取得
-    # get_total_grams_for_weeks も利用可能である前提
-    past_four_weeks_grams = get_total_grams_for_weeks(db, user_id, 4) 
-    
     # ベースライン（過去4週間の平均）を計算
     # (先週の量 + その前3週間の合計) / 4 として計算します
     base_line_grams = (last_week_grams + past_four_weeks_grams) / 4.0
@@ -176,12 +136,6 @@ def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
         # 最大100ポイントの制限を適用
         points_to_add = min(calculated_points, 100)
 
-    # 4. ポイントをデータベースに更新
-    user = db.query(User).get(user_id)
-    if user:
-        user.total_points += points_to_add
-        db.commit() # ★ Services層でDBコミットを実行 ★
-        
     return {
         "points_added": points_to_add,
         "final_reduction_rate": round(final_reduction_rate * 100, 2),
@@ -189,16 +143,38 @@ def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
         "rate_baseline": round(rate_baseline * 100, 2)
     }
 
+@writes
+def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
+    """
+    ユーザーの週次廃棄量を評価し、ポイントを計算・付与するメインロジック。
+    今週・先週・過去4週間の合計を1回の集計クエリで取得し、付与はポイント台帳への記帳と残高の UPDATE で行う。
+    付与は週に1回までで、同じ週に再度呼ばれた場合は already_awarded を True にして 0 ポイントを返す。
+    """
+    # --- 1. 週間の合計廃棄量を1往復で取得 ---
+    now = datetime.now()
+    this_week_grams, last_week_grams, past_four_weeks_grams = get_points_window_totals(db, user_id, now)
+
+    # --- 2, 3. 削減率とポイントの決定 ---
+    result = compute_weekly_award(this_week_grams, last_week_grams, past_four_weeks_grams)
+
+    # 4. 台帳に記帳し、同じトランザクションで残高を加算する（今週分を付与済みなら何もしない）
+    if result["points_added"]:
+        if not record_points(db, user_id, result["points_added"], WEEKLY_REDUCTION, week_key_of(now)):
+            result["points_added"] = 0
+            result["already_awarded"] = True
+        db.commit() # ★ Services層でDBコミットを実行 ★
+        
+    return result
+
+@reads
 def get_all_loss_reasons(db: Session) -> List[str]:
     """
     データベースに登録されている全ての廃棄理由のテキストをリストで取得する。
     """
-    # LossReasonモデルから reason_text の値のみをすべて取得
-    reasons = db.query(LossReason.reason_text).order_by(LossReason.id).all()
-    
-    # [('理由1',), ('理由2',)...] -> ['理由1', '理由2', ...] の形式に変換
-    return [r[0] for r in reasons]
+    # 初回のみDBから読み込み、以降はレジストリのキャッシュを返す
+    return reason_registry.texts(db)
 
+@reads
 def get_user_profile(db: Session, user_id: int) -> Dict[str, Any] | None:
     """
     ユーザーIDから表示に必要な情報（ユーザー名、ポイント）を取得する。
@@ -214,6 +190,7 @@ def get_user_profile(db: Session, user_id: int) -> Dict[str, Any] | None:
         }
     return None
 
+@writes
 def add_new_loss_record_direct(db: Session, record_data: Dict[str, Any]) -> int:
     """
     検証済みの廃棄記録データ（辞書形式）をデータベースに挿入する純粋なロジック。
@@ -228,81 +205,156 @@ def add_new_loss_record_direct(db: Session, record_data: Dict[str, Any]) -> int:
     
     # 1. 外部キー（LossReason）の存在チェックとID取得
     # このチェックは、データがDBに存在する理由テキストを参照しているか確認するために必要
-    reason = db.query(LossReason).filter_by(reason_text=record_data['reason_text']).first()
+    # (理由の一覧はレジストリにキャッシュされているため、SELECT は発行しない)
+    reason_id = reason_registry.id_for(db, record_data['reason_text'])
     
-    if not reason:
+    if reason_id is None:
         # 理由が見つからない場合、外部キー制約違反になるため、エラーを発生させる
         raise ValueError(f"無効な廃棄理由: {record_data['reason_text']}")
 
     # 2. データベースへの挿入（SQLAlchemyモデルのインスタンス化）
+    recorded_at = datetime.now()
     new_record = FoodLossRecord(
         user_id=record_data['user_id'],
         item_name=record_data['item_name'],
         weight_grams=record_data['weight_grams'],
-        loss_reason_id=reason.id, # 外部キーIDを使用
-        # record_date は models.py の設定により自動挿入される
+        loss_reason_id=reason_id, # 外部キーIDを使用
+        # 集計行の更新にも使うため、日時関連のカラムはここで確定させる
+        **record_time_fields(recorded_at),
     )
     
     db.add(new_record)
+    # 3. 日次・週次の集計行を同じトランザクションで更新
+    apply_record_to_rollups(db, new_record.user_id, recorded_at, new_record.weight_grams)
     db.commit() # 変更を永続化
+    # その週の /api/weekly_stats のキャッシュを捨てる
+    weekly_stats_cache.invalidate(new_record.user_id, recorded_at.date())
     db.refresh(new_record) # 挿入されたレコードのIDなどを取得
     
     return new_record.id
 
-def get_start_and_end_of_week(target_date: datetime.date) -> Tuple[datetime.date, datetime.date]:
-    """与えられた日付を含む週の日曜と土曜を返す (日曜日を週の始まりとする)。"""
-    # target_date.weekday() は月曜(0)から日曜(6)
-    start_of_week = target_date - datetime.timedelta(days=(target_date.weekday() + 1) % 7)
-    end_of_week = start_of_week + datetime.timedelta(days=6)
-    return start_of_week, end_of_week
-
-def get_weekly_stats(db: Session, user_id: int, target_date: datetime.date) -> Dict[str, Any]:
+@writes
+def add_new_loss_records_bulk(db: Session, records: List[Dict[str, Any]], pending_ids: Optional[List[str]] = None) -> List[int]:
     """
-    指定された日付を含む週の統計データ（グラフ用、表用）を取得し、JSが期待する形式に整形する。
-    """
-    start_of_week, end_of_week = get_start_and_end_of_week(target_date)
+    検証済みの廃棄記録データのリストを、1回の executemany と1回のコミットでまとめて挿入する。
     
-    # 1. 週間記録を全て取得
-    records = db.query(FoodLossRecord, LossReason.reason_text) \
-        .join(LossReason) \
-        .filter(
-            FoodLossRecord.user_id == user_id,
-            FoodLossRecord.record_date.between(start_of_week, end_of_week)
-        ) \
-        .order_by(FoodLossRecord.record_date) \
-        .all()
+    Args:
+        db: データベースセッション
+        records: add_new_loss_record_direct と同じ形式のデータ辞書のリスト
+        pending_ids: 書き込みキューの保留ID（records と同じ順序）。渡すと、同じトランザクションで
+            pending_writes に committed の結果を書く
         
-    dish_table_data = [
+    Returns:
+        挿入されたレコードのIDのリスト（records と同じ順序）
+    """
+    if not records:
+        return []
+
+    # 1. 廃棄理由のIDをレジストリから取得
+    reason_ids = {
+        text: reason_registry.id_for(db, text)
+        for text in {record['reason_text'] for record in records}
+    }
+    missing = {text for text, reason_id in reason_ids.items() if reason_id is None}
+    if missing:
+        raise ValueError(f"無効な廃棄理由: {', '.join(sorted(missing))}")
+
+    # 2. 1つの INSERT 文を全行分のパラメータで実行（executemany）
+    recorded_at = datetime.now()
+    time_fields = record_time_fields(recorded_at)
+    rows = [
         {
-            "date": rec.FoodLossRecord.record_date.strftime('%m/%d'),
-            "dish_name": rec.FoodLossRecord.item_name,
-            "weight_grams": rec.FoodLossRecord.weight_grams,
-            "reason": rec.reason_text
+            "user_id": record['user_id'],
+            "item_name": record['item_name'],
+            "weight_grams": record['weight_grams'],
+            "loss_reason_id": reason_ids[record['reason_text']],
+            **time_fields,
         }
-        for rec in records
+        for record in records
     ]
-    
-    # 2. 日別合計グラム数を計算 (グラフデータ用)
-    daily_grams = {day: 0.0 for day in ['日', '月', '火', '水', '木', '金', '土']}
-    
-    # データを集計
-    for rec in records:
-        day_of_week_index = (rec.FoodLossRecord.record_date.weekday() + 1) % 7 # 0=日, 1=月...
-        day_name = ['日', '月', '火', '水', '木', '金', '土'][day_of_week_index]
-        daily_grams[day_name] += rec.FoodLossRecord.weight_grams
-        
-    daily_graph_data = [
-        {"day": day, "total_grams": daily_grams[day]}
-        for day in daily_grams.keys()
-    ]
-    
-    # 3. 最終的なレスポンス形式に整形
-    is_data_present = len(records) > 0
+    record_ids = db.scalars(
+        insert(FoodLossRecord).returning(FoodLossRecord.id, sort_by_parameter_order=True),
+        rows,
+    ).all()
+
+    # 3. 日次・週次の集計行を同じトランザクションで更新
+    apply_records_to_rollups(db, [(row["user_id"], recorded_at, row["weight_grams"]) for row in rows])
+    # 4. 保留IDの結果も同じトランザクションで書く（記録だけがコミットされることはない）
+    if pending_ids:
+        db.execute(insert(PendingWrite), [
+            {"pending_id": pending_id, "user_id": row["user_id"], "status": "committed",
+             "record_id": record_id, "created_at": recorded_at}
+            for pending_id, row, record_id in zip(pending_ids, rows, record_ids)
+        ])
+    db.commit() # 全件を1回でコミット（fsync も1回）
+    for user_id in {row["user_id"] for row in rows}:
+        weekly_stats_cache.invalidate(user_id, recorded_at.date())
+
+    return list(record_ids)
+
+# --- 記録履歴の一覧 ---
+
+def _encode_record_cursor(record_date: str, record_id: int) -> str:
+    """一覧の続きの位置 (record_date, id) を、クライアントが中身を気にしなくてよい文字列にする。"""
+    raw = json.dumps([record_date, record_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_record_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        record_date, record_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("cursor が不正です。")
+    if not isinstance(record_date, str) or not isinstance(record_id, int):
+        raise ValueError("cursor が不正です。")
+    return record_date, record_id
+
+@reads
+def list_loss_records(db: Session, user_id: int, limit: int = 50, cursor: Optional[str] = None,
+                      reason_text: Optional[str] = None, item_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    ユーザーの記録を新しい順に limit 件ずつ返す。
+    OFFSET ではなく前ページ最後の (record_date, id) より前の行から読むキーセット方式なので、
+    (user_id, record_date, id) インデックスのおかげで何ページ目でも1ページ目と同じコストで済む。
+
+    Returns:
+        記録のリストと、続きがあれば次ページの cursor（無ければ None）
+    """
+    query = db.query(
+            FoodLossRecord.id,
+            FoodLossRecord.record_date,
+            FoodLossRecord.item_name,
+            FoodLossRecord.weight_grams,
+            FoodLossRecord.loss_reason_id,
+        ) \
+        .filter(FoodLossRecord.user_id == user_id)
+
+    if reason_text is not None:
+        reason_id = reason_registry.id_for(db, reason_text)
+        if reason_id is None:
+            raise ValueError(f"無効な廃棄理由: {reason_text}")
+        query = query.filter(FoodLossRecord.loss_reason_id == reason_id)
+    if item_name is not None:
+        query = query.filter(FoodLossRecord.item_name == item_name)
+    if cursor:
+        last_date, last_id = _decode_record_cursor(cursor)
+        query = query.filter(tuple_(FoodLossRecord.record_date, FoodLossRecord.id) < tuple_(last_date, last_id))
+
+    # 1件多く取って、次のページがあるかを判定する
+    rows = query.order_by(FoodLossRecord.record_date.desc(), FoodLossRecord.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = _encode_record_cursor(page[-1].record_date, page[-1].id) if len(rows) > limit else None
 
     return {
-        "is_data_present": is_data_present,
-        "week_start": start_of_week.strftime('%Y-%m-%d'),
-        "daily_graph_data": daily_graph_data,
-        "dish_table": dish_table_data
+        "records": [
+            {
+                "id": row.id,
+                "record_date": row.record_date,
+                "item_name": row.item_name,
+                "weight_grams": row.weight_grams,
+                "reason": reason_registry.text_for(db, row.loss_reason_id),
+            }
+            for row in page
+        ],
+        "next_cursor": next_cursor,
     }
-
@@ -0,0 +1,298 @@
+# sharding.py
+"""
+廃棄記録のシャーディング（user_id で複数の SQLite ファイルに分ける）。
+
+SQLite の書き込みは1ファイルにつき1つずつしか進まないため、ユーザーごとのデータ
+（food_loss_records と集計テーブル user_day_totals / user_week_totals、書き込みキューの結果 pending_writes）を user_id % シャード数 で
+別々のファイルに置き、ユーザーの異なる書き込みが並行してコミットできるようにします。
+users・loss_reasons・ポイント関係（points_ledger など）は全ユーザー共通のまま db/food_loss.db に残ります。
+
+- シャードのセッションは、シャード対象のモデルだけをそのシャードのエンジンに、それ以外を共通のエンジンに
+  振り分けます（Session の binds）。サービス関数はそのまま使えます。
+- リクエストでは db_session.get_request_db() がログイン中のユーザーのシャードのセッションを返します。
+- 全ユーザーにまたがる処理（週次ポイントの一括付与など）は map_shards() で全シャードに並列に問い合わせます。
+- 記録のIDはシャードごとに振られます（1ユーザーの記録は1つのシャードにあるので、ユーザー内では一意）。
+- シャードのセッションの commit() は、共通のDBとシャードのファイルを別々にコミットします（SQLite には
+  ファイルをまたぐ2相コミットがない）。両方に書いたセッションは、途中で落ちると片方だけが残ることがあるので、
+  1トランザクションで完結させたい書き込みは片方のDBだけに閉じてください。今の書き込みはそうなっています:
+  記録の追加（集計行・pending_writes を含む）はシャードだけ、ポイント（points_ledger・users・weekly_point_awards）と
+  ユーザー登録は共通のDBだけに書き、ポイントの計算で読むシャードの集計行は読み取りだけです。
+
+環境変数:
+    FOOD_LOSS_SHARDS   シャード数（既定 1 = シャーディングしない。記録は db/food_loss.db に置く）
+
+既存のDBを分割・再分割するには、書き込みを止めてから移行ツールを実行し、FOOD_LOSS_SHARDS を変えて再起動します:
+    python sharding.py status                       # 現在の配置と、シャードごとの記録数
+    python sharding.py migrate --to 4               # 今の配置（記録のあるファイルから判定）の記録を4つのシャードに分ける
+    python sharding.py migrate --from 4 --to 8 --prune   # 4→8 に分け直し、移行元から移した記録を消す
+"""
+import argparse
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Tuple, TypeVar
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+import database
+from database import READ, READ_ENGINE_PROFILE, WRITE, create_db_engine
+from models import FoodLossRecord, PendingWrite, UserDayTotal, UserWeekTotal
+from rollups import rebuild_rollups
+
+SHARD_COUNT = int(os.environ.get("FOOD_LOSS_SHARDS", "1"))
+
+# シャードに置くモデル（user_id を持ち、1ユーザーの行だけを読み書きするもの）
+SHARDED_MODELS = (FoodLossRecord, UserDayTotal, UserWeekTotal, PendingWrite)
+
+T = TypeVar("T")
+
+def shard_index(user_id: int, count: int = SHARD_COUNT) -> int:
+    """ユーザーのデータを置くシャードの番号。"""
+    return user_id % count
+
+def shard_path(index: int, count: int = SHARD_COUNT) -> str:
+    """シャードのファイルパス。シャード数1なら共通のDBそのもの。"""
+    if count == 1:
+        return database.DATABASE_PATH
+    # 再分割の間は新旧の配置が並ぶので、ファイル名にシャード数も入れる
+    return os.path.join(os.path.dirname(database.DATABASE_PATH), f"food_loss_shard{index}_of_{count}.db")
+
+class Shard:
+    """1つのシャードのエンジン（書き込み用・読み取り専用）と、共通DBと組み合わせたセッションの作成元。"""
+
+    def __init__(self, index: int, count: int):
+        self.index = index
+        self.path = shard_path(index, count)
+        if count == 1:
+            self.engine, self.read_engine = database.engine, database.read_engine
+            self._factories = {WRITE: database.SessionLocal, READ: database.ReadSessionLocal}
+            return
+        self.engine = create_db_engine(f"sqlite:///{self.path}")
+        self.read_engine = create_db_engine(
+            f"sqlite:///file:{self.path}?mode=ro&uri=true", READ_ENGINE_PROFILE, read_only=True,
+        ) if database.read_engine is not database.engine else self.engine
+        self._factories = {
+            WRITE: sessionmaker(autocommit=False, autoflush=False, bind=database.engine,
+                                binds={model: self.engine for model in SHARDED_MODELS}),
+            READ: sessionmaker(autocommit=False, autoflush=False, bind=database.read_engine,
+                               binds={model: self.read_engine for model in SHARDED_MODELS}),
+        }
+
+    def session_factory(self, access: str = WRITE) -> sessionmaker:
+        return self._factories[access]
+
+def create_shards(count: int = SHARD_COUNT) -> List[Shard]:
+    if count < 1:
+        raise ValueError(f"FOOD_LOSS_SHARDS は1以上で指定してください: {count}")
+    return [Shard(index, count) for index in range(count)]
+
+# アプリ全体で共有するシャード
+shards = create_shards()
+
+def shard_for(user_id: int) -> Shard:
+    """ユーザーのデータがあるシャードを返す。"""
+    return shards[shard_index(user_id, len(shards))]
+
+def session_for_user(user_id: int, access: str = WRITE) -> Session:
+    """ユーザーのシャードと共通DBにまたがるセッションを作る（閉じるのは呼び出し側）。"""
+    return shard_for(user_id).session_factory(access)()
+
+def group_by_shard(items: Iterable[T], user_id_of: Callable[[T], int]) -> Dict[int, List[T]]:
+    """要素をシャード番号ごとに分ける（各グループ内の順序は保つ）。"""
+    groups: Dict[int, List[T]] = {}
+    for item in items:
+        groups.setdefault(shard_index(user_id_of(item), len(shards)), []).append(item)
+    return groups
+
+def map_shards(func: Callable[[Session], T], access: str = READ) -> List[T]:
+    """
+    全シャードで func(セッション) を並列に実行し、シャード番号順の結果のリストを返す。
+    セッションはシャードごとに作って閉じる（書き込む場合のコミットは func の中で行う）。
+    """
+    def _run(shard: Shard) -> T:
+        with shard.session_factory(access)() as db:
+            return func(db)
+
+    if len(shards) == 1:
+        return [_run(shards[0])]
+    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard") as pool:
+        return list(pool.map(_run, shards))
+
+def all_engines() -> List[Engine]:
+    """共通DBと全シャードのエンジン（重複なし）。"""
+    engines = [database.engine, database.read_engine]
+    for shard in shards:
+        engines += [shard.engine, shard.read_engine]
+    return list(dict.fromkeys(engines))
+
+def init_shards(bootstrap: str = database.SCHEMA_BOOTSTRAP) -> None:
+    """
+    シャードのファイルにシャード対象のテーブルを作る（シャード数1なら init_db で作成済み）。
+    init_db と同じく、bootstrap="auto" ならファイルごとの PRAGMA user_version がシャード対象のテーブルの
+    スキーマのバージョンと一致するファイルを飛ばし、bootstrap="skip" なら何もしない。
+    """
+    if len(shards) == 1 or bootstrap == "skip":
+        return
+    tables = [model.__table__ for model in SHARDED_MODELS]
+    version = database.schema_version(tables=tables)
+    created = []
+    for shard in shards:
+        if bootstrap == "auto":
+            with shard.engine.connect() as conn:
+                if conn.exec_driver_sql("PRAGMA user_version").scalar() == version:
+                    continue
+        database.Base.metadata.create_all(bind=shard.engine, tables=tables)
+        with shard.engine.begin() as conn:
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+        created.append(os.path.basename(shard.path))
+    print(f"Sharding enabled: {len(shards)} shards (schema version {version}, "
+          f"created or updated: {', '.join(created) if created else 'none'}).")
+
+# --- 分割・再分割 ---
+
+def _record_count(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(FoodLossRecord.__table__)).scalar()
+
+def detect_shard_count(exclude: int) -> int:
+    """
+    記録が置かれている配置のシャード数を、db/ にあるファイルから判定する（exclude のシャード数の配置は除く）。
+    FOOD_LOSS_SHARDS を移行先の値に変えてから移行ツールを実行しても、移行元を取り違えないようにするため。
+
+    Raises:
+        ValueError: 記録のある配置が見つからない、または複数ある場合
+    """
+    pattern = re.compile(r"food_loss_shard\d+_of_(\d+)\.db$")
+    counts = {1} | {
+        int(match.group(1))
+        for match in map(pattern.match, os.listdir(os.path.dirname(database.DATABASE_PATH))) if match
+    }
+    found = []
+    for count in sorted(counts - {exclude}):
+        layout = create_shards(count)
+        try:
+            if sum(_record_count(shard.engine) for shard in layout if os.path.exists(shard.path)):
+                found.append(count)
+        finally:
+            if count != 1:
+                for shard in layout:
+                    shard.engine.dispose()
+                    shard.read_engine.dispose()
+    if len(found) != 1:
+        raise ValueError(f"移行元の配置を判定できません（記録のある配置のシャード数: {found}）。--from で指定してください。")
+    return found[0]
+
+def _user_totals(engines: Iterable[Engine]) -> Dict[int, Tuple[int, float]]:
+    """ユーザーごとの (記録数, 重量の合計) を全エンジンについて合算する。"""
+    totals: Dict[int, Tuple[int, float]] = {}
+    for engine in engines:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(FoodLossRecord.user_id, func.count(), func.coalesce(func.sum(FoodLossRecord.weight_grams), 0.0))
+                .group_by(FoodLossRecord.user_id)
+            ).all()
+        for user_id, count, grams in rows:
+            previous = totals.get(user_id, (0, 0.0))
+            totals[user_id] = (previous[0] + count, previous[1] + grams)
+    return totals
+
+def migrate_shards(from_count: int, to_count: int, chunk_size: int = 5000, prune: bool = False) -> Dict[str, Any]:
+    """
+    from_count シャードの配置の記録を to_count シャードの配置にコピーし、移行先の集計テーブルを作り直す。
+    移行元と移行先の user_id ごとの記録数・重量の合計が一致することを確かめてから、
+    prune=True なら移行元から移した記録と集計行を削除する。
+    記録のIDはそのまま引き継ぎ、移行先で既に使われている場合（再分割で別のシャードと重なった場合）だけ振り直す。
+
+    Raises:
+        ValueError: シャード数が不正な場合、移行先に既に記録がある場合、移行後の検証に失敗した場合
+    """
+    if from_count < 1 or to_count < 1 or from_count == to_count:
+        raise ValueError("移行元と移行先には、異なる1以上のシャード数を指定してください。")
+    sources = create_shards(from_count)
+    targets = create_shards(to_count)
+    for source in sources:
+        if not os.path.exists(source.path):
+            raise ValueError(f"移行元のシャードがありません: {source.path}")
+    columns = [column.name for column in FoodLossRecord.__table__.columns]
+    tables = [model.__table__ for model in SHARDED_MODELS]
+
+    for target in targets:
+        database.Base.metadata.create_all(bind=target.engine, tables=tables)
+        if _record_count(target.engine):
+            raise ValueError(f"移行先に既に記録があります: {target.path}")
+    before = _user_totals(source.engine for source in sources)
+
+    copied = 0
+    for source in sources:
+        with source.engine.connect() as source_conn:
+            result = source_conn.execute(
+                select(*FoodLossRecord.__table__.columns).order_by(FoodLossRecord.id)
+            ).yield_per(chunk_size)
+            for rows in result.partitions():
+                by_target: Dict[int, List[Dict[str, Any]]] = {}
+                for row in rows:
+                    # user_id のない古い行はシャード0に置く
+                    by_target.setdefault(shard_index(row.user_id or 0, to_count), []).append(dict(zip(columns, row)))
+                for index, records in by_target.items():
+                    with targets[index].engine.begin() as conn:
+                        ids = [record["id"] for record in records]
+                        taken = set(conn.execute(select(FoodLossRecord.id).where(FoodLossRecord.id.in_(ids))).scalars())
+                        with_ids = [record for record in records if record["id"] not in taken]
+                        renumbered = [{**record, "id": None} for record in records if record["id"] in taken]
+                        if with_ids:
+                            conn.execute(sqlite_insert(FoodLossRecord.__table__), with_ids)
+                        if renumbered:
+                            conn.execute(sqlite_insert(FoodLossRecord.__table__), renumbered)
+                    copied += len(records)
+        print(f"Copied records from {os.path.basename(source.path)} ({copied} so far).")
+
+    for target in targets:
+        rebuild_rollups(target.engine)
+    after = _user_totals(target.engine for target in targets)
+    mismatched = [
+        user_id for user_id in before.keys() | after.keys()
+        if before.get(user_id, (0, 0.0))[0] != after.get(user_id, (0, 0.0))[0]
+        or abs(before.get(user_id, (0, 0.0))[1] - after.get(user_id, (0, 0.0))[1]) > 1e-6
+    ]
+    if mismatched:
+        raise ValueError(f"移行後の記録が一致しないユーザーがいます: {sorted(mismatched)[:10]}")
+
+    pruned = 0
+    if prune:
+        # 移行先と同じファイルの移行元はない（ファイル名にシャード数が入る）ので、移行元の行は全て移した行
+        for source in sources:
+            with source.engine.begin() as conn:
+                pruned += conn.execute(delete(FoodLossRecord.__table__)).rowcount
+                for model in (UserDayTotal, UserWeekTotal):
+                    conn.execute(delete(model.__table__))
+    return {"from": from_count, "to": to_count, "users": len(before), "copied": copied, "pruned": pruned}
+
+def main():
+    parser = argparse.ArgumentParser(description="廃棄記録のシャーディング")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="現在の配置とシャードごとの記録数を表示する")
+    migrate = subparsers.add_parser("migrate", help="記録を別のシャード数の配置に移す")
+    migrate.add_argument("--from", dest="from_count", type=int, default=None,
+                         help="移行元のシャード数（省略時は db/ にある記録のあるファイルから判定）")
+    migrate.add_argument("--to", dest="to_count", type=int, required=True, help="移行先のシャード数")
+    migrate.add_argument("--chunk-size", type=int, default=5000, help="1トランザクションでコピーする行数")
+    migrate.add_argument("--prune", action="store_true", help="検証後、移行元から移した記録を削除する")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for shard in shards:
+            count = _record_count(shard.engine) if os.path.exists(shard.path) else 0
+            print(f"shard {shard.index}: {shard.path} records={count}")
+        return
+    # アプリ（init_db）を一度も起動していないDBでも、最新のスキーマにしてから移す
+    database.init_db()
+    from_count = args.from_count if args.from_count is not None else detect_shard_count(exclude=args.to_count)
+    report = migrate_shards(from_count, args.to_count, args.chunk_size, args.prune)
+    print(f"Migration finished: {report}")
+    print(f"Set FOOD_LOSS_SHARDS={args.to_count} and restart the workers (python server.py: SIGHUP).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# startup.py
+"""
+起動時間の計測。
+
+app.py は読み込みの各段階（import、スキーマの確認、バックグラウンド処理の起動など）の時間を
+StartupTimer で計り、最後に起動ログ（food_loss.startup の startup_finished）を1行出力します。
+
+import にかかる時間の内訳は、別プロセスで python -X importtime を実行して集計できます:
+    python startup.py                          # app の import 時間の合計と、自身の時間が長い上位20モジュール
+    python startup.py --module services --top 40
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+class StartupTimer:
+    """mark() を呼ぶたびに、前回からの経過時間をその段階の時間として記録する。"""
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self._last = self.started_at
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((name, (now - self._last) * 1000))
+        self._last = now
+
+    def total_ms(self) -> float:
+        return (self._last - self.started_at) * 1000
+
+    def fields(self) -> Dict[str, float]:
+        """構造化ログ用に、全体と段階ごとの時間（ミリ秒）を返す。"""
+        fields = {"total_ms": round(self.total_ms(), 1)}
+        fields.update({f"{name}_ms": round(ms, 1) for name, ms in self.phases})
+        return fields
+
+    def report(self) -> str:
+        phases = ", ".join(f"{name} {ms:.1f}ms" for name, ms in self.phases)
+        return f"Startup finished in {self.total_ms():.1f}ms ({phases})"
+
+def import_time_report(module: str, top: int = 20) -> Tuple[float, List[Tuple[str, float, float]]]:
+    """
+    別プロセスで module を import し、-X importtime の出力を集計する。
+
+    Returns:
+        (import 全体の時間[ms], 自身の時間が長い順の (モジュール名, 自身の時間[ms], 累積時間[ms]) のリスト)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package" の形式
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip())
+        entries.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    # 最も浅い（直接 import された）モジュールの累積時間の合計が、import 全体の時間になる
+    min_depth = min(depth for _, _, _, depth in entries)
+    total_ms = sum(cumulative for _, _, cumulative, depth in entries if depth == min_depth)
+    slowest = sorted(((name, own, cumulative) for name, own, cumulative, _ in entries), key=lambda e: e[1], reverse=True)
+    return total_ms, slowest[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="import 時間の内訳")
+    parser.add_argument("--module", default="app", help="計測するモジュール")
+    parser.add_argument("--top", type=int, default=20, help="表示するモジュール数")
+    args = parser.parse_args()
+
+    total_ms, slowest = import_time_report(args.module, args.top)
+    print(f"import {args.module}: {total_ms:.1f}ms")
+    print(f"{'module':<48} {'self ms':>9} {'cumulative ms':>14}")
+    for name, own, cumulative in slowest:
+        print(f"{name:<48} {own:>9.1f} {cumulative:>14.1f}")
+
+if __name__ == "__main__":
+    main()
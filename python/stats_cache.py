@@ -0,0 +1,111 @@
+# stats_cache.py
+"""
+/api/weekly_stats のレスポンスキャッシュ。
+
+(user_id, 週の開始日) ごとに整形済みの週次統計と ETag / Last-Modified を保持します。
+キャッシュはプロセスごとに持ち、invalidate は書き込みを処理したプロセスのエントリしか捨てられません。
+そのため、キャッシュに入れるのは終わった週（記録は常に現在時刻で追加されるので、もう変わらない週）だけにし、
+今週以降の統計は毎回DBから作ります（ETag による 304 は今週でも使えます）。
+記録を追加・変更した経路は、念のため invalidate(user_id, 記録日) も呼んでください。
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from stats_engine import SUNDAY, week_start
+
+# 保持するエントリ数の上限（超えたら古いものから捨てる）
+MAX_ENTRIES = int(os.environ.get("FOOD_LOSS_STATS_CACHE_SIZE", "10000"))
+# エントリの有効期限（秒）
+TTL_SECONDS = float(os.environ.get("FOOD_LOSS_STATS_CACHE_TTL", "300"))
+
+def week_start_of(target_date: datetime.date) -> datetime.date:
+    """日付を含む週（日曜始まり、stats_engine.get_start_and_end_of_week と同じ）の日曜日を返す。"""
+    return week_start(target_date, SUNDAY)
+
+def week_has_ended(week_start: datetime.date, today: Optional[datetime.date] = None) -> bool:
+    """週（week_start から7日間）が today より前に終わっていれば True を返す。"""
+    return week_start + datetime.timedelta(days=6) < (today or datetime.date.today())
+
+class CachedStats:
+    """キャッシュされた1週間分のレスポンス。"""
+
+    def __init__(self, payload: Dict[str, Any]):
+        self.payload = payload
+        self.etag = hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+        # HTTP の日付は秒単位なので、比較がずれないようマイクロ秒を落としておく
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        self.expires_at = time.monotonic() + TTL_SECONDS
+
+class WeeklyStatsCache:
+    """(user_id, 週の開始日) をキーにした LRU キャッシュ。"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, datetime.date], CachedStats]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+        self._invalidations = 0
+
+    def get(self, user_id: int, week_start: datetime.date) -> Optional[CachedStats]:
+        key = (user_id, week_start)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def put(self, user_id: int, week_start: datetime.date, payload: Dict[str, Any]) -> CachedStats:
+        """レスポンスを作って返す。キャッシュに入れるのは終わった週だけ（今週以降は他のワーカーの書き込みで変わりうる）。"""
+        entry = CachedStats(payload)
+        if not week_has_ended(week_start):
+            return entry
+        with self._lock:
+            self._entries[(user_id, week_start)] = entry
+            self._entries.move_to_end((user_id, week_start))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def record_not_modified(self) -> None:
+        """304 を返せた回数を数える。"""
+        with self._lock:
+            self._not_modified += 1
+
+    def invalidate(self, user_id: int, record_date: datetime.date) -> None:
+        """記録日を含む週のエントリを捨てる。"""
+        with self._lock:
+            if self._entries.pop((user_id, week_start_of(record_date)), None) is not None:
+                self._invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "not_modified": self._not_modified,
+                "invalidations": self._invalidations,
+            }
+
+# アプリ全体で共有するキャッシュ
+weekly_stats_cache = WeeklyStatsCache()
@@ -0,0 +1,316 @@
+# stats_engine.py
+"""
+廃棄量の統計（週の境界、週次の表・グラフ、任意期間の集計、週・期間の合計）をまとめたモジュール。
+
+週の区切りは用途ごとに次の2種類で、どちらも week_start() で計算します。
+- 月曜始まり: ポイント計算の週（models.week_key_of の週キーと同じ）。
+  get_week_boundaries / get_last_two_weeks / calculate_weekly_statistics / get_last_two_weeks_grams
+- 日曜始まり: 記録ページ（log.html）の週。
+  get_start_and_end_of_week / get_weekly_stats / get_range_stats の granularity="week"
+
+各画面の統計は、記録を取得する1回のクエリ（廃棄理由のテキストはレジストリから引く）か、
+集計行を GROUP BY する1回のクエリで作ります（記録ごとの追加クエリは発行しません）。
+クエリ数の上限は benchmark.py の QUERY_BUDGETS で検査しています。
+"""
+import datetime
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import reads
+from models import FoodLossRecord, UserDayTotal, UserWeekTotal, day_key_of, day_key_to_date, week_key_of
+from reason_registry import reason_registry
+from rollups import get_total_grams_between_days, get_week_total
+
+# week_start() の first_weekday に渡す値（datetime.date.weekday() の曜日番号）
+MONDAY = 0
+SUNDAY = 6
+
+# --- 週の境界 ---
+
+def week_start(target_date: datetime.date, first_weekday: int) -> datetime.date:
+    """target_date を含む週の初日（first_weekday の曜日）を返す。"""
+    return target_date - datetime.timedelta(days=(target_date.weekday() - first_weekday) % 7)
+
+def get_week_boundaries(today: datetime.datetime) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    指定された日付を含む「月曜日から日曜日まで」の一週間の境界を計算する。
+    """
+    monday = datetime.datetime.combine(week_start(today.date(), MONDAY), datetime.time.min)
+    end_of_week = datetime.datetime.combine(monday.date() + datetime.timedelta(days=6), datetime.time.max)
+    return monday, end_of_week
+
+def get_last_two_weeks(today: datetime.datetime) -> Dict[str, Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    指定された日付を基準に、「今週」と「先週」の厳密な月曜日の開始と日曜日の終了時刻を計算する。
+    """
+    this_monday, this_sunday = get_week_boundaries(today)
+    return {
+        "this_week": (this_monday, this_sunday),
+        "last_week": (this_monday - datetime.timedelta(weeks=1), this_sunday - datetime.timedelta(weeks=1)),
+    }
+
+def get_start_and_end_of_week(target_date: datetime.date) -> Tuple[datetime.date, datetime.date]:
+    """与えられた日付を含む週の日曜と土曜を返す (日曜日を週の始まりとする)。"""
+    start_of_week = week_start(target_date, SUNDAY)
+    return start_of_week, start_of_week + datetime.timedelta(days=6)
+
+# --- 週・期間の合計（集計行から読む） ---
+
+@reads
+def get_total_grams_for_week(db: Session, user_id: int, start_date: datetime.date, end_date: datetime.date) -> float:
+    """
+    指定された「月〜日」の一週間の合計廃棄重量を取得する。（ポイント計算用）
+    """
+    # 週次集計行（user_week_totals）の1行を読むだけで済む
+    return get_week_total(db, user_id, week_key_of(start_date))
+
+@reads
+def get_total_grams_for_weeks(db: Session, user_id: int, weeks_ago: int) -> float:
+    """
+    過去 N 週間分の合計廃棄重量（グラム）を取得する。
+    （weeks_ago=4なら、28日前から今日の記録までを取得）
+    """
+    today_key = day_key_of(datetime.datetime.now())
+    # 日次集計行（最大 N*7 行）を合計する
+    return get_total_grams_between_days(db, user_id, today_key - 7 * weeks_ago, today_key)
+
+@reads
+def get_last_two_weeks_grams(db: Session, user_id: int) -> Tuple[float, float]:
+    """
+    直近の2週間分の合計廃棄重量（グラム）を取得する。
+    戻り値は (先週の合計, 今週の合計) のタプル。
+    """
+    this_week_key = week_key_of(datetime.datetime.now())
+    # 週次集計行2行を1回のクエリで読む
+    totals = dict(
+        db.query(UserWeekTotal.week_key, UserWeekTotal.total_grams)
+        .filter(UserWeekTotal.user_id == user_id)
+        .filter(UserWeekTotal.week_key.between(this_week_key - 1, this_week_key))
+        .all()
+    )
+    return totals.get(this_week_key - 1, 0.0), totals.get(this_week_key, 0.0)
+
+# --- 週次の表・グラフ ---
+
+def _fetch_records(db: Session, user_id: int, first_key: int, last_key: int) -> list:
+    """
+    期間内の記録を記録日時の順に1回のクエリで取得する。
+    廃棄理由のテキストは結合せずにレジストリから引く（シャーディング時は loss_reasons が記録と別のファイルにあるため）。
+    """
+    return db.query(
+            FoodLossRecord.id,
+            FoodLossRecord.day_key,
+            FoodLossRecord.record_date,
+            FoodLossRecord.recorded_at,
+            FoodLossRecord.item_name,
+            FoodLossRecord.weight_grams,
+            FoodLossRecord.loss_reason_id,
+        ) \
+        .filter(
+            FoodLossRecord.user_id == user_id,
+            FoodLossRecord.day_key.between(first_key, last_key)
+        ) \
+        .order_by(FoodLossRecord.recorded_at) \
+        .all()
+
+@reads
+def calculate_weekly_statistics(db: Session, user_id: int, today: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """
+    直近の「月曜日始まり、日曜日終わり」の一週間について、
+    廃棄された料理名リストと日別合計重量を計算する。
+    """
+    monday, sunday = get_week_boundaries(today or datetime.datetime.now())
+    monday_key = day_key_of(monday)
+
+    # 1. 週間の全記録を取得（日別合計も同じ記録から求めるので、クエリはこの1回だけ）
+    weekly_records = _fetch_records(db, user_id, monday_key, monday_key + 6)
+
+    if not weekly_records:
+        return {
+            "week_start": monday.strftime('%Y-%m-%d'),
+            "week_end": sunday.strftime('%Y-%m-%d'),
+            "is_data_present": False,
+            "dish_table": [],
+            "daily_graph_data": []
+        }
+
+    # 2. 廃棄された料理名リスト (表データ) と日別合計重量を、記録を1回なめて作る
+    dish_table_data = []
+    daily_summary: Dict[int, float] = defaultdict(float)
+    for record in weekly_records:
+        dish_table_data.append({
+            "id": record.id,
+            "dish_name": record.item_name,
+            "weight_grams": round(record.weight_grams, 1),
+            "reason": reason_registry.text_for(db, record.loss_reason_id) or "不明",
+            "date": record.record_date[:10] # 日付部分 'YYYY-MM-DD' のみ抽出
+        })
+        daily_summary[record.day_key] += record.weight_grams
+
+    # 3. 全曜日をカバーし、データがない日は 0 にする (棒グラフデータ)
+    daily_graph_data = []
+    for i in range(7):
+        current_date = monday + datetime.timedelta(days=i)
+        daily_graph_data.append({
+            "day": current_date.strftime('%a'), # 曜日名 (例: Mon, Tue)
+            "date": current_date.strftime('%Y-%m-%d'),
+            "total_grams": round(daily_summary.get(monday_key + i, 0.0), 1)
+        })
+
+    return {
+        "week_start": monday.strftime('%Y-%m-%d'),
+        "week_end": sunday.strftime('%Y-%m-%d'),
+        "is_data_present": True,
+        "dish_table": dish_table_data,
+        "daily_graph_data": daily_graph_data
+    }
+
+@reads
+def get_weekly_stats_window(db: Session, user_id: int, target_date: datetime.date,
+                            weeks_before: int = 0, weeks_after: int = 0) -> List[Dict[str, Any]]:
+    """
+    target_date を含む週（日曜始まり）と、その前後の週の統計データをまとめて取得する。
+    何週分でも、記録の取得1回で済む（日別合計も同じ記録から求める）。
+
+    Returns:
+        古い週から順に並んだ、get_weekly_stats と同じ形式の辞書のリスト
+    """
+    week_count = weeks_before + weeks_after + 1
+    start_of_week, _ = get_start_and_end_of_week(target_date)
+    first_key = day_key_of(start_of_week - datetime.timedelta(weeks=weeks_before))
+
+    # 1. 期間内の記録を全て取得し、週ごと・日ごとに振り分ける
+    records = _fetch_records(db, user_id, first_key, first_key + 7 * week_count - 1)
+    records_by_week: List[list] = [[] for _ in range(week_count)]
+    day_totals: Dict[int, float] = defaultdict(float)
+    for rec in records:
+        records_by_week[(rec.day_key - first_key) // 7].append(rec)
+        day_totals[rec.day_key] += rec.weight_grams
+
+    # 2. 週ごとに、最終的なレスポンス形式に整形
+    weeks = []
+    for week_index, week_records in enumerate(records_by_week):
+        # 週の開始は日曜日なので、日キーの並びがそのまま「日, 月, ..., 土」になる
+        start_key = first_key + 7 * week_index
+        dish_table_data = [
+            {
+                "date": rec.recorded_at.strftime('%m/%d'),
+                "dish_name": rec.item_name,
+                "weight_grams": rec.weight_grams,
+                "reason": reason_registry.text_for(db, rec.loss_reason_id) or "不明"
+            }
+            for rec in week_records
+        ]
+        daily_graph_data = [
+            {"day": day, "total_grams": day_totals.get(start_key + i, 0.0)}
+            for i, day in enumerate(['日', '月', '火', '水', '木', '金', '土'])
+        ]
+        weeks.append({
+            "is_data_present": len(week_records) > 0,
+            "week_start": day_key_to_date(start_key).strftime('%Y-%m-%d'),
+            "daily_graph_data": daily_graph_data,
+            "dish_table": dish_table_data
+        })
+    return weeks
+
+@reads
+def get_weekly_stats(db: Session, user_id: int, target_date: datetime.date) -> Dict[str, Any]:
+    """
+    指定された日付を含む週の統計データ（グラフ用、表用）を取得し、JSが期待する形式に整形する。
+    """
+    return get_weekly_stats_window(db, user_id, target_date)[0]
+
+# --- 任意期間の統計 ---
+
+# 集計の粒度ごとのバケット式（日キーから計算する）
+# week は日曜始まり: 日キー（0001-01-01=1 の通し日数）が7の倍数の日が日曜日
+# month は日キーをユリウス日に直して SQLite の strftime で 'YYYY-MM' にする
+_JULIAN_DAY_OFFSET = 1721424.5
+
+def _range_bucket_expr(day_key_column, granularity: str):
+    if granularity == "day":
+        return day_key_column
+    if granularity == "week":
+        return day_key_column // 7
+    return func.strftime('%Y-%m', day_key_column + _JULIAN_DAY_OFFSET)
+
+def _range_bucket_labels(from_date: datetime.date, to_date: datetime.date, granularity: str) -> List[Tuple[Any, str]]:
+    """期間内の全バケットを (SQL のバケット値, 表示用ラベル) の並びで返す（データの無いバケットも含む）。"""
+    from_key, to_key = day_key_of(from_date), day_key_of(to_date)
+    if granularity == "day":
+        return [(key, day_key_to_date(key).strftime('%Y-%m-%d')) for key in range(from_key, to_key + 1)]
+    if granularity == "week":
+        return [(week, day_key_to_date(week * 7).strftime('%Y-%m-%d')) for week in range(from_key // 7, to_key // 7 + 1)]
+    labels = []
+    year, month = from_date.year, from_date.month
+    while (year, month) <= (to_date.year, to_date.month):
+        label = f"{year:04d}-{month:02d}"
+        labels.append((label, label))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return labels
+
+@reads
+def get_range_stats(db: Session, user_id: int, from_date: datetime.date, to_date: datetime.date,
+                    granularity: str = "day", group_by: Optional[str] = None) -> Dict[str, Any]:
+    """
+    任意期間の廃棄量を日・週（日曜始まり）・月ごとに集計する。
+    バケット分けと（group_by="reason" なら）理由ごとの合計は、1回の GROUP BY クエリで行う。
+
+    Returns:
+        バケットのラベルと、それに揃えた合計値・件数の配列（データの無いバケットは 0）
+    """
+    from_key, to_key = day_key_of(from_date), day_key_of(to_date)
+    labels = _range_bucket_labels(from_date, to_date, granularity)
+    index_of = {bucket: i for i, (bucket, _) in enumerate(labels)}
+    total_grams = [0.0] * len(labels)
+    record_count = [0] * len(labels)
+
+    result: Dict[str, Any] = {
+        "from": from_date.strftime('%Y-%m-%d'),
+        "to": to_date.strftime('%Y-%m-%d'),
+        "granularity": granularity,
+        "group_by": group_by,
+        "buckets": [label for _, label in labels],
+        "total_grams": total_grams,
+        "record_count": record_count,
+    }
+
+    if group_by == "reason":
+        # 理由ごとの内訳が必要なので、(user_id, day_key) インデックスで記録を範囲走査して集計する
+        bucket = _range_bucket_expr(FoodLossRecord.day_key, granularity).label("bucket")
+        rows = db.query(
+                bucket,
+                FoodLossRecord.loss_reason_id,
+                func.sum(FoodLossRecord.weight_grams),
+                func.count(FoodLossRecord.id),
+            ) \
+            .filter(FoodLossRecord.user_id == user_id) \
+            .filter(FoodLossRecord.day_key.between(from_key, to_key)) \
+            .group_by(bucket, FoodLossRecord.loss_reason_id) \
+            .all()
+        by_reason: Dict[str, List[float]] = {}
+        for bucket_value, reason_id, grams, count in rows:
+            i = index_of[bucket_value]
+            reason_text = reason_registry.text_for(db, reason_id) or "不明"
+            by_reason.setdefault(reason_text, [0.0] * len(labels))[i] += grams
+            total_grams[i] += grams
+            record_count[i] += count
+        result["by_reason"] = {text: [round(grams, 1) for grams in series] for text, series in by_reason.items()}
+    else:
+        # 内訳が不要なら、日次集計行（1日1行）を集計するだけで済む
+        bucket = _range_bucket_expr(UserDayTotal.day_key, granularity).label("bucket")
+        rows = db.query(bucket, func.sum(UserDayTotal.total_grams), func.sum(UserDayTotal.record_count)) \
+            .filter(UserDayTotal.user_id == user_id) \
+            .filter(UserDayTotal.day_key.between(from_key, to_key)) \
+            .group_by(bucket) \
+            .all()
+        for bucket_value, grams, count in rows:
+            i = index_of[bucket_value]
+            total_grams[i] += grams
+            record_count[i] += count
+
+    result["total_grams"] = [round(grams, 1) for grams in total_grams]
+    return result
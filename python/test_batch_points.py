@@ -0,0 +1,92 @@
+# test_batch_points.py
+"""
+週次ポイントの一括付与（batch_points.run_weekly_points_batch）のテスト。
+
+同じ週に2回実行しても、2回目は何も付与されず、残高・台帳・付与実績が変わらないことを確かめます。
+DBは conftest.py が用意する一時ファイルです。
+
+使い方:
+    python -m pytest python/test_batch_points.py
+"""
+import datetime
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from batch_points import last_completed_week_key, run_weekly_points_batch
+from database import SessionLocal, init_db
+from models import FoodLossRecord, PointsLedgerEntry, User, WeeklyPointAward, week_key_to_monday
+from points_ledger import WEEKLY_REDUCTION, record_points
+from rollups import apply_records_to_rollups
+
+WEEK_KEY = last_completed_week_key()
+REDUCING_USER_ID = 101       # 先週より廃棄が減った → 付与される
+INCREASING_USER_ID = 102     # 先週より廃棄が増えた → 付与されない
+PRE_CREDITED_USER_ID = 103   # /api/calculate_weekly_points で記帳済み → バッチでは 0
+USER_IDS = (REDUCING_USER_ID, INCREASING_USER_ID, PRE_CREDITED_USER_ID)
+
+@pytest.fixture(scope="module")
+def dataset():
+    init_db()
+    target_monday = datetime.datetime.combine(week_key_to_monday(WEEK_KEY), datetime.time(12))
+    previous_monday = target_monday - datetime.timedelta(days=7)
+    weights = {
+        REDUCING_USER_ID: (1000.0, 10.0),
+        INCREASING_USER_ID: (10.0, 1000.0),
+        PRE_CREDITED_USER_ID: (1000.0, 10.0),
+    }
+    with SessionLocal() as db:
+        for user_id, (previous_grams, target_grams) in weights.items():
+            db.add(User(id=user_id, username=f"batch_user_{user_id}", password="x",
+                        email=f"batch_user_{user_id}@example.com", total_points=0))
+            for recorded_at, grams in ((previous_monday, previous_grams), (target_monday, target_grams)):
+                db.add(FoodLossRecord(user_id=user_id, item_name="test_item", weight_grams=grams,
+                                      loss_reason_id=1, record_date=recorded_at.isoformat(), recorded_at=recorded_at))
+            apply_records_to_rollups(db, [(user_id, previous_monday, previous_grams),
+                                          (user_id, target_monday, target_grams)])
+        db.flush()
+        record_points(db, PRE_CREDITED_USER_ID, 10, WEEKLY_REDUCTION, WEEK_KEY)
+        db.commit()
+    yield
+    with SessionLocal() as db:
+        for model in (WeeklyPointAward, PointsLedgerEntry, FoodLossRecord):
+            db.execute(delete(model).where(model.user_id.in_(USER_IDS)))
+        db.execute(delete(User).where(User.id.in_(USER_IDS)))
+        db.commit()
+
+def _snapshot():
+    """対象ユーザーの (残高, 台帳の行, 付与実績の行) を返す。"""
+    with SessionLocal() as db:
+        balances = dict(db.execute(select(User.id, User.total_points).where(User.id.in_(USER_IDS))).all())
+        ledger = sorted(db.execute(
+            select(PointsLedgerEntry.id, PointsLedgerEntry.user_id, PointsLedgerEntry.week_key,
+                   PointsLedgerEntry.reason, PointsLedgerEntry.delta)
+            .where(PointsLedgerEntry.user_id.in_(USER_IDS))
+        ).all())
+        awards = sorted(db.execute(
+            select(WeeklyPointAward.user_id, WeeklyPointAward.week_key, WeeklyPointAward.points_added)
+            .where(WeeklyPointAward.user_id.in_(USER_IDS))
+        ).all())
+        ledger_sums = dict(db.execute(
+            select(PointsLedgerEntry.user_id, func.sum(PointsLedgerEntry.delta))
+            .where(PointsLedgerEntry.user_id.in_(USER_IDS))
+            .group_by(PointsLedgerEntry.user_id)
+        ).all())
+    return balances, ledger, awards, ledger_sums
+
+def test_rerun_same_week_is_noop(dataset):
+    run_weekly_points_batch(WEEK_KEY, workers=1)
+    balances, ledger, awards, ledger_sums = _snapshot()
+    assert balances[REDUCING_USER_ID] > 0
+    assert balances[INCREASING_USER_ID] == 0
+    assert balances[PRE_CREDITED_USER_ID] == 10
+    # 記帳済みの週は実績に 0 が残り、台帳は1行のまま
+    awarded = {user_id: points for user_id, _, points in awards}
+    assert awarded == {REDUCING_USER_ID: balances[REDUCING_USER_ID], INCREASING_USER_ID: 0, PRE_CREDITED_USER_ID: 0}
+    assert len(ledger) == 2
+    assert all(balances[user_id] == ledger_sums.get(user_id, 0) for user_id in USER_IDS)
+
+    report = run_weekly_points_batch(WEEK_KEY, workers=1)
+    assert report["rewarded_users"] == 0
+    assert report["points_added"] == 0
+    assert _snapshot() == (balances, ledger, awards, ledger_sums)
@@ -0,0 +1,51 @@
+# test_export.py
+"""
+/api/export（記録の逐次ダウンロード）のテスト。
+
+エクスポートが読み終わったあと（途中で切断された場合も）、読み取り用の接続がプールに返ることを確かめます。
+DBは conftest.py が用意する一時ファイルです。
+
+使い方:
+    python -m pytest python/test_export.py
+"""
+import pytest
+from sqlalchemy import delete
+
+from app import app
+from database import SessionLocal, read_engine
+from models import FoodLossRecord, User
+
+USER_ID = 301
+RECORDS = 2500
+
+@pytest.fixture(scope="module")
+def client():
+    with SessionLocal() as db:
+        db.add(User(id=USER_ID, username="export_user", password="x",
+                    email="export_user@example.com", total_points=0))
+        db.add_all(FoodLossRecord(user_id=USER_ID, item_name=f"item_{i}", weight_grams=1.0, loss_reason_id=1)
+                   for i in range(RECORDS))
+        db.commit()
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session["user_id"] = USER_ID
+    yield client
+    with SessionLocal() as db:
+        db.execute(delete(FoodLossRecord).where(FoodLossRecord.user_id == USER_ID))
+        db.execute(delete(User).where(User.id == USER_ID))
+        db.commit()
+
+@pytest.mark.parametrize("query", ["format=csv", "format=ndjson&gzip=1"])
+def test_export_returns_connection(client, query):
+    response = client.get(f"/api/export?{query}")
+    assert response.status_code == 200
+    assert len(response.get_data()) > 0
+    response.close()
+    assert read_engine.pool.checkedout() == 0
+
+def test_abandoned_export_returns_connection(client):
+    response = client.get("/api/export?format=csv", buffered=False)
+    next(iter(response.response))
+    # クライアントが途中で切断した場合
+    response.close()
+    assert read_engine.pool.checkedout() == 0
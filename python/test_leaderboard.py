@@ -0,0 +1,83 @@
+# test_leaderboard.py
+"""
+ランキング（leaderboard.Leaderboard）のテスト。
+
+- 順位は同点が同順位、ポイントが 0 のユーザーは rank が None
+- 台帳に記帳した差分だけでキャッシュを更新した結果が、users から読み直した結果と一致する
+- 台帳が変わっていなければ、順位の問い合わせは台帳の版を読む1クエリだけ
+
+使い方:
+    python -m pytest python/test_leaderboard.py
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from benchmark import QueryCounter
+from leaderboard import Leaderboard
+from models import Base, User
+from points_ledger import ADJUSTMENT, WEEKLY_REDUCTION, record_points
+
+USERS = 6
+WEEK_KEY = 105000
+
+@pytest.fixture
+def session_factory():
+    # インメモリDBは接続ごとに別のDBになるので、全セッションで1本の接続を使う
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with SessionFactory() as db:
+        db.add_all(User(id=user_id, username=f"user_{user_id}", password="x",
+                        email=f"user_{user_id}@example.com", total_points=0)
+                   for user_id in range(1, USERS + 1))
+        db.commit()
+    yield SessionFactory
+    engine.dispose()
+
+def _award(SessionFactory, points, week_key=WEEK_KEY):
+    with SessionFactory() as db:
+        for user_id, delta in points.items():
+            record_points(db, user_id, delta, WEEKLY_REDUCTION, week_key)
+        db.commit()
+
+def _ranks(board, SessionFactory):
+    with SessionFactory() as db:
+        return {user_id: board.rank_of(db, user_id) for user_id in range(1, USERS + 1)}
+
+def test_ranks_ties_and_zero_points(session_factory):
+    _award(session_factory, {1: 30, 2: 50, 3: 30, 4: 10})
+    board = Leaderboard(top_k=10)
+    ranks = _ranks(board, session_factory)
+    assert {user_id: result["rank"] for user_id, result in ranks.items()} == {1: 2, 2: 1, 3: 2, 4: 4, 5: None, 6: None}
+    assert all(result["ranked_users"] == 4 for result in ranks.values())
+    with session_factory() as db:
+        top = board.top(db, 10)
+    assert [(entry["user_id"], entry["rank"]) for entry in top] == [(2, 1), (1, 2), (3, 2), (4, 4)]
+
+def test_incremental_update_matches_reload(session_factory):
+    _award(session_factory, {1: 30, 2: 50, 3: 30})
+    board = Leaderboard(top_k=10)
+    _ranks(board, session_factory)
+
+    # 新しく順位が付くユーザー、順位が入れ替わるユーザー、残高が 0 に戻るユーザー
+    _award(session_factory, {4: 40, 1: 25}, week_key=WEEK_KEY + 1)
+    with session_factory() as db:
+        record_points(db, 3, -30, ADJUSTMENT)
+        db.commit()
+
+    updated = _ranks(board, session_factory)
+    assert updated == _ranks(Leaderboard(top_k=10), session_factory)
+    assert updated[1]["rank"] == 1 and updated[1]["total_points"] == 55
+    assert updated[3]["rank"] is None
+    assert updated[1]["ranked_users"] == 3
+
+def test_rank_of_reads_only_ledger_version(session_factory):
+    _award(session_factory, {1: 30, 2: 50})
+    board = Leaderboard(top_k=10)
+    _ranks(board, session_factory)
+    with session_factory() as db:
+        counter = QueryCounter(db.get_bind())
+        assert board.rank_of(db, 1)["rank"] == 2
+        assert counter.count == 1
@@ -0,0 +1,33 @@
+# test_metrics.py
+"""
+/metrics（Prometheus のテキスト形式）のテスト。
+
+リクエストの後に /metrics を読み、エンドポイント別の1リクエストあたりの SQL 文の数のヒストグラムが
+HELP・TYPE と _bucket / _sum / _count の系列で出力されることを確かめます。
+DBは conftest.py が用意する一時ファイルです。
+
+使い方:
+    python -m pytest python/test_metrics.py
+"""
+import re
+
+from app import app
+
+def test_request_sql_queries_histogram():
+    client = app.test_client()
+    assert client.get("/api/leaderboard?limit=5").status_code == 200
+    text = client.get("/metrics").get_data(as_text=True)
+
+    assert "# HELP food_loss_http_request_sql_queries " in text
+    assert "# TYPE food_loss_http_request_sql_queries histogram" in text
+    labels = 'method="GET",endpoint="/api/leaderboard"'
+    buckets = re.findall(rf'^food_loss_http_request_sql_queries_bucket\{{{labels},le="([^"]+)"\}} (\d+)$', text, re.M)
+    assert buckets[-1][0] == "+Inf"
+    counts = [int(count) for _, count in buckets]
+    # 累積の件数なので単調に増え、+Inf の件数が _count と一致する
+    assert counts == sorted(counts) and counts[-1] >= 1
+    count = re.search(rf'^food_loss_http_request_sql_queries_count\{{{labels}\}} (\d+)$', text, re.M)
+    assert int(count.group(1)) == counts[-1]
+    # リーダーボードは少なくとも台帳の版を読む
+    queries = re.search(rf'^food_loss_http_request_sql_queries_sum\{{{labels}\}} ([\d.]+)$', text, re.M)
+    assert float(queries.group(1)) >= 1
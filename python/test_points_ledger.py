@@ -0,0 +1,102 @@
+# test_points_ledger.py
+"""
+ポイントの台帳（points_ledger.record_points / record_weekly_points_bulk）のテスト。
+
+- 同じ (user_id, week_key, reason) の付与を繰り返しても、2回目以降は何も起きない
+- 重複した呼び出しや並行した呼び出しの後も、users.total_points が台帳の delta の合計と一致する
+
+使い方:
+    python -m pytest python/test_points_ledger.py
+"""
+import threading
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import create_db_engine
+from models import Base, PointsLedgerEntry, User
+from points_ledger import ADJUSTMENT, WEEKLY_REDUCTION, record_points, record_weekly_points_bulk
+
+USERS = 3
+WEEK_KEY = 105000
+
+def _create_users(engine) -> None:
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(User(id=user_id, username=f"user_{user_id}", password="x",
+                        email=f"user_{user_id}@example.com", total_points=0)
+                   for user_id in range(1, USERS + 1))
+        db.commit()
+
+def _balances_and_ledger_sums(engine):
+    with sessionmaker(bind=engine)() as db:
+        balances = dict(db.execute(select(User.id, User.total_points)).all())
+        sums = dict(db.execute(
+            select(PointsLedgerEntry.user_id, func.sum(PointsLedgerEntry.delta)).group_by(PointsLedgerEntry.user_id)
+        ).all())
+    return balances, {user_id: sums.get(user_id, 0) for user_id in balances}
+
+@pytest.fixture
+def engine():
+    # インメモリDBは接続ごとに別のDBになるので、全セッションで1本の接続を使う
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    _create_users(engine)
+    yield engine
+    engine.dispose()
+
+def test_repeated_award_is_noop(engine):
+    SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with SessionFactory() as db:
+        assert record_points(db, 1, 30, WEEKLY_REDUCTION, WEEK_KEY) is True
+        db.commit()
+    with SessionFactory() as db:
+        # 別の値で呼び直しても、最初の記帳のまま
+        assert record_points(db, 1, 50, WEEKLY_REDUCTION, WEEK_KEY) is False
+        assert record_weekly_points_bulk(db, WEEK_KEY, WEEKLY_REDUCTION, {1: 50, 2: 20}) == {2: 20}
+        db.commit()
+    with SessionFactory() as db:
+        assert db.scalar(select(func.count()).select_from(PointsLedgerEntry).where(PointsLedgerEntry.user_id == 1)) == 1
+        # 週に結び付かない調整は一意制約の対象外なので、毎回記帳される
+        assert record_points(db, 1, -5, ADJUSTMENT) is True
+        assert record_points(db, 1, -5, ADJUSTMENT) is True
+        db.commit()
+
+    balances, ledger_sums = _balances_and_ledger_sums(engine)
+    assert balances == ledger_sums == {1: 20, 2: 20, 3: 0}
+
+def test_concurrent_awards_match_ledger(tmp_path):
+    # 並行した書き込みを試すため、インメモリではなくファイルのDBを接続プール付きで使う
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'ledger.db'}")
+    _create_users(engine)
+    SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    errors = []
+
+    def award(thread_index: int) -> None:
+        try:
+            for week_key in range(WEEK_KEY, WEEK_KEY + 5):
+                with SessionFactory() as db:
+                    # 全スレッドが同じ週・同じユーザーに付与しようとする
+                    if thread_index % 2:
+                        record_weekly_points_bulk(db, week_key, WEEKLY_REDUCTION,
+                                                  {user_id: 10 * user_id for user_id in range(1, USERS + 1)})
+                    else:
+                        for user_id in range(1, USERS + 1):
+                            record_points(db, user_id, 10 * user_id, WEEKLY_REDUCTION, week_key)
+                    db.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=award, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert not errors
+        balances, ledger_sums = _balances_and_ledger_sums(engine)
+        # 5週分がちょうど1回ずつ記帳されている
+        assert balances == ledger_sums == {user_id: 50 * user_id for user_id in range(1, USERS + 1)}
+    finally:
+        engine.dispose()
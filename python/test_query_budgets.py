@@ -0,0 +1,103 @@
+# test_query_budgets.py
+"""
+よく呼ばれるサービス関数のクエリ数が benchmark.QUERY_BUDGETS の上限に収まっていることを確かめるテスト。
+
+インメモリの SQLite に小さなデータセットを作り、before_cursor_execute で実行された SQL 文を数えます。
+記録数に比例してクエリが増える（N+1）変更を入れると、ここで失敗します。
+
+使い方:
+    python -m pytest python/test_query_budgets.py
+"""
+import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import services
+import stats_engine
+from benchmark import HISTORY_DAYS, QUERY_BUDGETS, QueryCounter, build_dataset
+from models import FoodLossRecord, User, day_key_of, week_key_of
+from reason_registry import reason_registry
+from rollups import rebuild_rollups
+
+USERS = 5
+RECORDS = 500
+# ポイントが付与される（先週より今週の廃棄が少ない）ように記録を足すユーザー
+REDUCING_USER_ID = USERS + 1
+
+@pytest.fixture(scope="module")
+def engine():
+    # インメモリDBは接続ごとに別のDBになるので、全セッションで1本の接続を使う
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    build_dataset(engine, users=USERS, records=RECORDS)
+    _add_reducing_user(engine)
+    yield engine
+    engine.dispose()
+
+def _add_reducing_user(engine) -> None:
+    """先週 1000g、今週 10g を捨てたユーザーを追加する。"""
+    now = datetime.datetime.now()
+    with sessionmaker(bind=engine)() as db:
+        db.add(User(id=REDUCING_USER_ID, username="reducing_user", password="x",
+                    email="reducing_user@example.com", total_points=0))
+        for recorded_at, grams in ((now - datetime.timedelta(days=7), 1000.0), (now, 10.0)):
+            db.add(FoodLossRecord(
+                user_id=REDUCING_USER_ID, item_name="test_item", weight_grams=grams, loss_reason_id=1,
+                record_date=recorded_at.isoformat(), recorded_at=recorded_at,
+                day_key=day_key_of(recorded_at), week_key=week_key_of(recorded_at),
+            ))
+        db.commit()
+    rebuild_rollups(engine)
+
+@pytest.fixture
+def count_queries(engine):
+    """関数を新しいセッションで1回呼び、実行された SQL 文の数を返す。"""
+    SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    counter = QueryCounter(engine)
+    # 廃棄理由はプロセス内にキャッシュされるので、このDBから読み込み済みの状態で数える
+    reason_registry.invalidate()
+    with SessionFactory() as db:
+        reason_registry.texts(db)
+
+    def run(func):
+        with SessionFactory() as db:
+            before = counter.count
+            result = func(db)
+            return counter.count - before, result
+    return run
+
+@pytest.mark.parametrize("user_id", [1, REDUCING_USER_ID])
+def test_get_weekly_stats(count_queries, user_id):
+    queries, _ = count_queries(lambda db: stats_engine.get_weekly_stats(db, user_id, datetime.date.today()))
+    assert queries <= QUERY_BUDGETS["get_weekly_stats"]
+
+@pytest.mark.parametrize("group_by", [None, "reason"])
+def test_get_range_stats(count_queries, group_by):
+    today = datetime.date.today()
+    queries, result = count_queries(lambda db: stats_engine.get_range_stats(
+        db, 1, today - datetime.timedelta(days=HISTORY_DAYS), today, "week", group_by))
+    assert result
+    assert queries <= QUERY_BUDGETS["get_range_stats"]
+
+def test_list_loss_records(count_queries):
+    queries, page = count_queries(lambda db: services.list_loss_records(db, 1, limit=20))
+    assert len(page["records"]) == 20
+    assert queries <= QUERY_BUDGETS["list_loss_records"]
+
+    # 2ページ目（キーセット）と理由での絞り込みも同じ上限に収まる
+    queries, _ = count_queries(lambda db: services.list_loss_records(
+        db, 1, limit=20, cursor=page["next_cursor"], reason_text=reason_registry.texts(db)[0]))
+    assert queries <= QUERY_BUDGETS["list_loss_records"]
+
+def test_calculate_weekly_points_logic(count_queries):
+    # 付与する場合（集計 + 台帳の記帳 + 残高の更新）
+    queries, result = count_queries(lambda db: services.calculate_weekly_points_logic(db, REDUCING_USER_ID))
+    assert result["points_added"] > 0
+    assert queries <= QUERY_BUDGETS["calculate_weekly_points_logic"]
+
+    # 同じ週に2回目を呼んだ場合（付与済み）
+    queries, result = count_queries(lambda db: services.calculate_weekly_points_logic(db, REDUCING_USER_ID))
+    assert result["points_added"] == 0
+    assert queries <= QUERY_BUDGETS["calculate_weekly_points_logic"]
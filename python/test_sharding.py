@@ -0,0 +1,104 @@
+# test_sharding.py
+"""
+シャーディングの移行ツール（sharding.migrate_shards / detect_shard_count）のテスト。
+
+conftest.py が用意する一時ディレクトリで、共通のDB（シャード数1）→ 2シャード → 3シャードと移し、
+- 移行元の配置の判定（記録のある配置が複数あれば判定できない）
+- 移行先でIDが重なった記録の振り直し
+- ユーザーごとの記録数・重量の合計と集計行の一致
+を確かめます。
+
+使い方:
+    python -m pytest python/test_sharding.py
+"""
+import datetime
+import glob
+import os
+
+import pytest
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import sessionmaker
+
+import database
+from models import FoodLossRecord, UserWeekTotal, record_time_fields
+from sharding import _user_totals, create_shards, detect_shard_count, migrate_shards
+
+# 2シャードでは別々のシャード（402 % 2 = 0, 405 % 2 = 1）、3シャードでは同じシャード（% 3 = 0）に入るユーザー
+USER_IDS = (402, 405, 407)
+RECORDS_PER_USER = 20
+
+@pytest.fixture
+def common_db_records():
+    database.init_db()
+    recorded_at = datetime.datetime.now() - datetime.timedelta(days=1)
+    with database.SessionLocal() as db:
+        db.add_all(
+            FoodLossRecord(user_id=user_id, item_name=f"item_{i}", weight_grams=float(user_id % 10 + i),
+                           loss_reason_id=1, **record_time_fields(recorded_at))
+            for user_id in USER_IDS for i in range(RECORDS_PER_USER)
+        )
+        db.commit()
+    yield
+    with database.SessionLocal() as db:
+        db.execute(delete(FoodLossRecord).where(FoodLossRecord.user_id.in_(USER_IDS)))
+        db.commit()
+    for path in glob.glob(os.path.join(os.path.dirname(database.DATABASE_PATH), "food_loss_shard*_of_*.db*")):
+        os.remove(path)
+
+def _totals(count):
+    layout = create_shards(count)
+    try:
+        totals = _user_totals(shard.engine for shard in layout)
+    finally:
+        for shard in layout:
+            if count != 1:
+                shard.engine.dispose()
+                shard.read_engine.dispose()
+    return {user_id: totals.get(user_id) for user_id in USER_IDS}
+
+def test_migrate_round_trip(common_db_records):
+    before = _totals(1)
+
+    # 1 → 2（移行元を残す）
+    report = migrate_shards(1, 2)
+    assert report["pruned"] == 0
+    assert _totals(2) == before
+    # 共通のDBと2シャードの両方に記録があるので、移行元を判定できない
+    with pytest.raises(ValueError):
+        detect_shard_count(exclude=3)
+    assert detect_shard_count(exclude=1) == 2
+
+    # 2シャードの別々のファイルで、移行先（3シャードの同じファイル）では重なるIDを作る
+    shard0, shard1 = create_shards(2)
+    with shard0.engine.connect() as conn:
+        taken_id = conn.execute(select(func.min(FoodLossRecord.id)).where(FoodLossRecord.user_id == 402)).scalar()
+    with sessionmaker(bind=shard1.engine)() as db:
+        db.add(FoodLossRecord(id=taken_id, user_id=405, item_name="collision", weight_grams=123.0, loss_reason_id=1,
+                              **record_time_fields(datetime.datetime.now())))
+        db.commit()
+    for shard in (shard0, shard1):
+        shard.engine.dispose()
+        shard.read_engine.dispose()
+    expected = {**before, 405: (before[405][0] + 1, before[405][1] + 123.0)}
+
+    # 2 → 3（移行元から消す）
+    report = migrate_shards(2, 3, chunk_size=7, prune=True)
+    assert report["pruned"] == report["copied"]
+    assert _totals(3) == expected
+    assert all(totals is None for totals in _totals(2).values())
+    assert detect_shard_count(exclude=1) == 3
+
+    target = create_shards(3)[0]
+    with sessionmaker(bind=target.engine)() as db:
+        # 先に移したユーザー402の記録はIDを引き継ぎ、重なったユーザー405の記録だけ振り直される
+        assert db.get(FoodLossRecord, taken_id).user_id == 402
+        collision = db.scalars(select(FoodLossRecord).where(FoodLossRecord.item_name == "collision")).one()
+        assert collision.user_id == 405 and collision.id != taken_id
+        # 集計行も移行先で作り直されている
+        week_totals = dict(db.execute(
+            select(UserWeekTotal.user_id, func.sum(UserWeekTotal.total_grams))
+            .where(UserWeekTotal.user_id.in_((402, 405))).group_by(UserWeekTotal.user_id)
+        ).all())
+    target.engine.dispose()
+    target.read_engine.dispose()
+    assert week_totals == {402: expected[402][1], 405: expected[405][1]}
@@ -0,0 +1,68 @@
+# test_write_behind.py
+"""
+書き込みキュー（write_behind.LossRecordWriter）のテスト。
+
+- バッチ内の1件が INSERT に失敗しても、他の記録はコミットされ、失敗した記録だけが failed になる
+- 保留IDの結果は pending_writes に残り、別のワーカー（別のライター）からも持ち主にだけ見える
+
+DBは conftest.py が用意する一時ファイルです。
+
+使い方:
+    python -m pytest python/test_write_behind.py
+"""
+import pytest
+from sqlalchemy import delete
+
+from database import ReadSessionLocal, SessionLocal, init_db
+from models import FoodLossRecord, PendingWrite, User
+from reason_registry import reason_registry
+from write_behind import LossRecordWriter, new_pending_id
+
+USER_ID = 201
+OTHER_USER_ID = 202
+
+@pytest.fixture(scope="module")
+def reason_text():
+    init_db()
+    with SessionLocal() as db:
+        for user_id in (USER_ID, OTHER_USER_ID):
+            db.add(User(id=user_id, username=f"writer_user_{user_id}", password="x",
+                        email=f"writer_user_{user_id}@example.com", total_points=0))
+        db.commit()
+        # 他のテストが別のDBの理由を読み込んでいることがあるので、このDBから読み直す
+        reason_registry.invalidate()
+        text = reason_registry.texts(db)[0]
+    yield text
+    with SessionLocal() as db:
+        for model in (PendingWrite, FoodLossRecord):
+            db.execute(delete(model).where(model.user_id.in_((USER_ID, OTHER_USER_ID))))
+        db.execute(delete(User).where(User.id.in_((USER_ID, OTHER_USER_ID))))
+        db.commit()
+
+def test_failed_record_does_not_fail_batch(reason_text):
+    writer = LossRecordWriter()
+    good = {"user_id": USER_ID, "item_name": "rice", "weight_grams": 120.0, "reason_text": reason_text}
+    # item_name は NOT NULL なので、この1件だけ INSERT に失敗する
+    bad = {"user_id": USER_ID, "item_name": None, "weight_grams": 50.0, "reason_text": reason_text}
+    with SessionLocal() as db:
+        good_id, good_future = writer.submit(db, good)
+        bad_id, bad_future = writer.submit(db, bad)
+        assert writer.pending_status(db, good_id, USER_ID) == {"status": "pending"}
+    writer._write_batch([writer._queue.get_nowait(), writer._queue.get_nowait()])
+
+    record_id = good_future.result(timeout=0)
+    assert bad_future.exception(timeout=0) is not None
+    assert writer.metrics()["failed_batches"] == 1
+    with ReadSessionLocal() as db:
+        assert db.get(FoodLossRecord, record_id).item_name == "rice"
+
+        # 別のワーカーのライター（プロセス内の結果を持たない）からも同じ結果が見える
+        other_worker = LossRecordWriter()
+        assert other_worker.pending_status(db, good_id, USER_ID) == {"status": "committed", "record_id": record_id}
+        assert other_worker.pending_status(db, bad_id, USER_ID)["status"] == "failed"
+        # 持ち主以外には見えない
+        assert other_worker.pending_status(db, good_id, OTHER_USER_ID) is None
+        assert writer.pending_status(db, good_id, OTHER_USER_ID) is None
+        # 行のない保留IDは、発行直後なら pending、形式の違うIDは見つからない
+        assert other_worker.pending_status(db, new_pending_id(), USER_ID) == {"status": "pending"}
+        assert other_worker.pending_status(db, "unknown", USER_ID) is None
@@ -1,23 +1,28 @@
 # user_service.py
 from sqlalchemy.orm import Session
 from models import User, FoodLossRecord
+from database import reads, writes
+from points_ledger import ADJUSTMENT, record_points
 import hashlib
 from typing import Optional, Dict, Any
 
 # --- ユーザー情報の取得 ---
 
+@reads
 def get_user_by_username(db: Session, username: str) -> Optional[User]:
     """
     ユーザー名でユーザーオブジェクトを取得する。（認証やログインチェック用）
     """
     return db.query(User).filter_by(username=username).first()
 
+@reads
 def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
     """
     IDでユーザーオブジェクトを取得する。（プロフィール表示やポイント更新時用）
     """
     return db.query(User).get(user_id)
 
+@reads
 def get_user_profile(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
     """
     ユーザーIDから表示に必要な情報（ユーザー名、ポイントなど）を取得する。
@@ -37,6 +42,7 @@ def get_user_profile(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
 
 # --- ユーザーデータの作成と更新 ---
 
+@writes
 def register_new_user(db: Session, username: str, email: str, password: str) -> int:
     """
     新しいユーザーをデータベースに登録する。
@@ -62,13 +68,15 @@ def register_new_user(db: Session, username: str, email: str, password: str) ->
     
     return new_user.id
 
+@writes
 def update_user_points(db: Session, user_id: int, points_to_add: int) -> bool:
     """
-    ユーザーの合計ポイントを更新する。
+    ユーザーの合計ポイントを更新する（調整としてポイント台帳に記帳し、残高を1回の UPDATE で加算する）。
     """
-    user = db.query(User).get(user_id)
-    if user:
-        user.total_points += points_to_add
-        db.commit()
-        return True
-    return False
\ No newline at end of file
+    try:
+        record_points(db, user_id, points_to_add, ADJUSTMENT)
+    except ValueError:
+        db.rollback()
+        return False
+    db.commit()
+    return True
@@ -0,0 +1,308 @@
+# write_behind.py
+"""
+廃棄記録の書き込みを後回しにしてまとめてコミットする（グループコミット）ライター。
+
+/api/add_loss_record が受け付けた検証済みの記録を有界キューに積み、専用の書き込みスレッドが
+最大 max_batch 件・最大 max_latency_ms ミリ秒ぶんをまとめて1トランザクションで挿入します。
+SQLite ではコミットごとに fsync が走るため、負荷が集中したときのレイテンシを大きく下げられます。
+
+async モードで返す保留IDの結果（committed / failed）は、記録と同じシャードの pending_writes に
+記録の INSERT と同じトランザクションで書くので、どのワーカーに問い合わせても同じ結果が返ります。
+まだ行のない保留IDは、発行から FOOD_LOSS_WRITE_BEHIND_PENDING_GRACE_SECONDS 秒の間だけ pending とみなします
+（保留IDの先頭に発行時刻が入っています）。結果の行は FOOD_LOSS_WRITE_BEHIND_RESULT_TTL_SECONDS 秒後に削除されます。
+バッチの INSERT が失敗した場合は1件ずつ入れ直し、入らなかった記録だけを failed にします。
+
+環境変数:
+    FOOD_LOSS_WRITE_BEHIND                 off（既定）/ durable（コミットまで待つ）/ async（保留IDを即返す）
+    FOOD_LOSS_WRITE_BEHIND_MAX_BATCH       1トランザクションの最大件数（既定 500）
+    FOOD_LOSS_WRITE_BEHIND_MAX_LATENCY_MS  最初の1件を受けてからコミットするまでの最大待ち時間（既定 20）
+    FOOD_LOSS_WRITE_BEHIND_QUEUE_SIZE      キューの上限（既定 10000、超えると受付を断る）
+    FOOD_LOSS_WRITE_BEHIND_PENDING_GRACE_SECONDS  結果の行がない保留IDを pending とみなす時間（既定 60）
+    FOOD_LOSS_WRITE_BEHIND_RESULT_TTL_SECONDS     保留IDの結果を残す時間（既定 86400）
+"""
+import atexit
+import datetime
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import WRITE, reads
+from models import PendingWrite
+from reason_registry import reason_registry
+from request_log import get_logger
+from services import add_new_loss_records_bulk
+from sharding import group_by_shard, map_shards, shards
+
+logger = get_logger("write_behind")
+
+WRITE_BEHIND_MODES = ("off", "durable", "async")
+
+# 保留IDごとの結果をプロセス内に覚えておく件数（問い合わせの多くをDBを読まずに返すため）
+_MAX_REMEMBERED_RESULTS = 10000
+# 結果の行がまだない保留IDを pending とみなす時間（秒）
+PENDING_GRACE_SECONDS = float(os.environ.get("FOOD_LOSS_WRITE_BEHIND_PENDING_GRACE_SECONDS", "60"))
+# pending_writes の行を残す時間（秒）と、古い行を消す間隔（秒）
+RESULT_TTL_SECONDS = float(os.environ.get("FOOD_LOSS_WRITE_BEHIND_RESULT_TTL_SECONDS", "86400"))
+_PURGE_INTERVAL_SECONDS = 60.0
+
+def new_pending_id() -> str:
+    """発行時刻（ミリ秒、16進12桁）とランダムな20桁をつないだ32文字の保留IDを作る。"""
+    return f"{time.time_ns() // 1_000_000:012x}{uuid.uuid4().hex[:20]}"
+
+def pending_id_issued_at(pending_id: str) -> Optional[float]:
+    """保留IDの発行時刻（UNIX 時刻）。形式が違えば None。"""
+    if len(pending_id) != 32:
+        return None
+    try:
+        return int(pending_id[:12], 16) / 1000.0
+    except ValueError:
+        return None
+
+class LossRecordWriter(threading.Thread):
+    """廃棄記録をキューから取り出し、まとめてコミットする書き込みスレッド。"""
+
+    def __init__(self, max_batch: int = 500, max_latency_ms: float = 20.0, queue_size: int = 10000):
+        super().__init__(name="loss-record-writer", daemon=True)
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.0
+        self._queue: "queue.Queue[Optional[Tuple[str, Dict[str, Any], Future]]]" = queue.Queue(maxsize=queue_size)
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._results_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._batches = 0
+        self._records = 0
+        self._failed_batches = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+        self._last_commit_ms = 0.0
+        self._next_purge = time.monotonic() + _PURGE_INTERVAL_SECONDS
+
+    # --- 受付側（リクエストスレッド） ---
+
+    def submit(self, db: Session, record_data: Dict[str, Any]) -> Tuple[str, Future]:
+        """
+        検証済みの記録をキューに積む。
+
+        Returns:
+            (保留ID, コミット後に record_id が入る Future)
+
+        Raises:
+            ValueError: 廃棄理由が登録されていない場合（キューには積まない）
+            queue.Full: キューが上限に達している場合
+        """
+        if reason_registry.id_for(db, record_data['reason_text']) is None:
+            raise ValueError(f"無効な廃棄理由: {record_data['reason_text']}")
+        pending_id = new_pending_id()
+        future: Future = Future()
+        self._queue.put_nowait((pending_id, record_data, future))
+        self._remember(pending_id, record_data["user_id"], {"status": "pending"})
+        return pending_id, future
+
+    @reads
+    def pending_status(self, db: Session, pending_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        user_id の保留IDの処理状況（pending / committed / failed）を返す。
+        db は user_id のシャードのセッション。他のユーザーの保留IDや、知らない保留IDなら None
+        （ただし結果の行がまだない発行直後の保留IDは、持ち主を確かめられないので pending を返す。記録の中身は返さない）。
+        """
+        with self._results_lock:
+            remembered = self._results.get(pending_id)
+        if remembered is not None:
+            owner, result = remembered
+            return dict(result) if owner == user_id else None
+        # 別のワーカーが受け付けた記録は、pending_writes の行で確かめる
+        row = db.execute(
+            select(PendingWrite.user_id, PendingWrite.status, PendingWrite.record_id, PendingWrite.error)
+            .where(PendingWrite.pending_id == pending_id)
+        ).first()
+        if row is not None:
+            if row.user_id != user_id:
+                return None
+            if row.status == "committed":
+                return {"status": "committed", "record_id": row.record_id}
+            return {"status": "failed", "error": row.error}
+        issued_at = pending_id_issued_at(pending_id)
+        if issued_at is not None and 0 <= time.time() - issued_at <= PENDING_GRACE_SECONDS:
+            return {"status": "pending"}
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        """キューの深さとバッチサイズの統計を返す。"""
+        with self._metrics_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "batches_committed": self._batches,
+                "records_committed": self._records,
+                "failed_batches": self._failed_batches,
+                "last_batch_size": self._last_batch_size,
+                "max_batch_size": self._max_batch_size,
+                "avg_batch_size": round(self._records / self._batches, 2) if self._batches else 0.0,
+                "last_commit_ms": self._last_commit_ms,
+            }
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """キューに残った記録を書き終えてからスレッドを止める。"""
+        if self.is_alive():
+            self._queue.put(None)
+            self.join(timeout)
+
+    # --- 書き込み側（専用スレッド） ---
+
+    def _remember(self, pending_id: str, user_id: int, result: Dict[str, Any]) -> None:
+        with self._results_lock:
+            self._results[pending_id] = (user_id, result)
+            self._results.move_to_end(pending_id)
+            while len(self._results) > _MAX_REMEMBERED_RESULTS:
+                self._results.popitem(last=False)
+
+    def _collect_batch(self) -> Tuple[List[Tuple[str, Dict[str, Any], Future]], bool]:
+        """最初の1件を待ち、その後は max_latency の間だけ max_batch 件まで集める。"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write_batch(self, batch: List[Tuple[str, Dict[str, Any], Future]]) -> None:
+        # シャーディング中は、ユーザーの記録があるシャードごとに1トランザクションでコミットする
+        for index, group in group_by_shard(batch, lambda item: item[1]["user_id"]).items():
+            self._write_shard_batch(index, group)
+
+    def _write_shard_batch(self, shard_index: int, batch: List[Tuple[str, Dict[str, Any], Future]]) -> None:
+        started = time.perf_counter()
+        try:
+            record_ids = self._insert(shard_index, batch)
+        except Exception:
+            logger.exception("write_batch_failed", extra={"fields": {"shard": shard_index, "records": len(batch)}})
+            with self._metrics_lock:
+                self._failed_batches += 1
+            # 1件の不正な記録でバッチ全体を失わないよう、1件ずつ入れ直す
+            for item in batch:
+                self._write_one(shard_index, item)
+            return
+
+        with self._metrics_lock:
+            self._batches += 1
+            self._records += len(batch)
+            self._last_batch_size = len(batch)
+            self._max_batch_size = max(self._max_batch_size, len(batch))
+            self._last_commit_ms = round((time.perf_counter() - started) * 1000, 2)
+        for (pending_id, record, future), record_id in zip(batch, record_ids):
+            self._remember(pending_id, record["user_id"], {"status": "committed", "record_id": record_id})
+            future.set_result(record_id)
+
+    def _insert(self, shard_index: int, batch: List[Tuple[str, Dict[str, Any], Future]]) -> List[int]:
+        """記録と保留IDの結果を1トランザクションで挿入し、記録のIDを返す。"""
+        db = shards[shard_index].session_factory()()
+        try:
+            return add_new_loss_records_bulk(db, [record for _, record, _ in batch],
+                                             [pending_id for pending_id, _, _ in batch])
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_one(self, shard_index: int, item: Tuple[str, Dict[str, Any], Future]) -> None:
+        """バッチが失敗したときに1件だけ書く。失敗した記録は failed の結果を残す。"""
+        pending_id, record, future = item
+        try:
+            record_id = self._insert(shard_index, [item])
+        except Exception as e:
+            logger.warning("write_record_failed", extra={"fields": {
+                "shard": shard_index, "pending_id": pending_id, "error": str(e),
+            }})
+            self._remember(pending_id, record["user_id"], {"status": "failed", "error": str(e)})
+            self._record_failure(shard_index, pending_id, record["user_id"], str(e))
+            future.set_exception(e)
+            return
+        with self._metrics_lock:
+            self._records += 1
+        self._remember(pending_id, record["user_id"], {"status": "committed", "record_id": record_id[0]})
+        future.set_result(record_id[0])
+
+    def _record_failure(self, shard_index: int, pending_id: str, user_id: int, error: str) -> None:
+        db = shards[shard_index].session_factory()()
+        try:
+            db.execute(sqlite_insert(PendingWrite).on_conflict_do_nothing(), {
+                "pending_id": pending_id, "user_id": user_id, "status": "failed",
+                "error": error, "created_at": datetime.datetime.now(),
+            })
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("write_failure_not_recorded", extra={"fields": {"shard": shard_index, "pending_id": pending_id}})
+        finally:
+            db.close()
+
+    def _purge_expired_results(self) -> None:
+        """RESULT_TTL_SECONDS より古い保留IDの結果を全シャードから消す。"""
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=RESULT_TTL_SECONDS)
+
+        def purge(db: Session) -> int:
+            count = db.execute(delete(PendingWrite).where(PendingWrite.created_at < cutoff)).rowcount
+            db.commit()
+            return count
+
+        try:
+            map_shards(purge, access=WRITE)
+        except Exception:
+            logger.exception("purge_pending_writes_failed")
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+            if time.monotonic() >= self._next_purge:
+                self._next_purge = time.monotonic() + _PURGE_INTERVAL_SECONDS
+                self._purge_expired_results()
+        # 停止要求の後に積まれた分も書き切る
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._write_batch([item])
+
+def write_behind_mode() -> str:
+    """環境変数から書き込みモードを読む。"""
+    mode = os.environ.get("FOOD_LOSS_WRITE_BEHIND", "off").lower()
+    if mode not in WRITE_BEHIND_MODES:
+        raise ValueError(f"FOOD_LOSS_WRITE_BEHIND に指定できない値です: {mode} (指定可能: {list(WRITE_BEHIND_MODES)})")
+    return mode
+
+def start_record_writer() -> LossRecordWriter:
+    """環境変数の設定でライターを起動し、プロセス終了時に残りを書き切るよう登録する。"""
+    writer = LossRecordWriter(
+        max_batch=int(os.environ.get("FOOD_LOSS_WRITE_BEHIND_MAX_BATCH", "500")),
+        max_latency_ms=float(os.environ.get("FOOD_LOSS_WRITE_BEHIND_MAX_LATENCY_MS", "20")),
+        queue_size=int(os.environ.get("FOOD_LOSS_WRITE_BEHIND_QUEUE_SIZE", "10000")),
+    )
+    writer.start()
+    atexit.register(writer.stop)
+    return writer